@@ -3,17 +3,27 @@ import re
 __all__ = ['Range', 'ContentRange']
 
 _rx_range = re.compile('bytes *= *(\d*) *- *(\d*)', flags=re.I)
+_rx_range_set = re.compile(r'bytes *= *(.*)$', flags=re.I)
+_rx_range_spec = re.compile(r'(\d*) *- *(\d*)$')
 _rx_content_range = re.compile(r'bytes (?:(\d+)-(\d+)|[*])/(?:(\d+)|[*])')
 
 class Range(object):
     """
         Represents the Range header.
+
+        ``start`` and ``end`` are the first range of the header, ``ranges``
+        the list of all of them as (start, end) pairs.
     """
 
-    def __init__(self, start, end):
+    def __init__(self, start, end, ranges=None):
         assert end is None or end >= 0, "Bad range end: %r" % end
         self.start = start
         self.end = end # non-inclusive
+        if ranges is None:
+            ranges = [(start, end)]
+        # every (start, end) pair of a multi-range header; start and end
+        # are the first one
+        self.ranges = ranges
 
     def range_for_length(self, length):
         """
@@ -21,18 +31,27 @@ class Range(object):
             the given length, then return a (start, end) non-inclusive range
             of bytes to serve.  Otherwise return None
         """
+        return _range_for_length(self.start, self.end, length)
+
+    def ranges_for_length(self, length):
+        """
+            Return the list of (start, end) non-inclusive ranges of bytes to
+            serve for a body of the given length, leaving out the ones that
+            aren't satisfiable, sorted and with overlapping or adjacent
+            ranges merged.  Return None if the length is unknown.
+        """
         if length is None:
             return None
-        start, end = self.start, self.end
-        if end is None:
-            end = length
-            if start < 0:
-                start += length
-        if _is_content_range_valid(start, end, length):
-            stop = min(end, length)
-            return (start, stop)
-        else:
-            return None
+        result = []
+        for start, end in sorted(
+                filter(None, [_range_for_length(start, end, length)
+                              for start, end in self.ranges])):
+            if result and start <= result[-1][1]:
+                if end > result[-1][1]:
+                    result[-1] = (result[-1][0], end)
+            else:
+                result.append((start, end))
+        return result
 
     def content_range(self, length):
         """
@@ -50,18 +69,13 @@ class Range(object):
         return ContentRange(range[0], range[1], length)
 
     def __str__(self):
-        s,e = self.start, self.end
-        if e is None:
-            r = 'bytes=%s' % s
-            if s >= 0:
-                r += '-'
-            return r
-        return 'bytes=%s-%s' % (s, e-1)
+        return 'bytes=' + ','.join(
+            [_range_spec(s, e) for s, e in self.ranges])
 
     def __repr__(self):
-        return '<%s bytes %r-%r>' % (
+        return '<%s bytes %s>' % (
             self.__class__.__name__,
-            self.start, self.end)
+            ', '.join(['%r-%r' % (s, e) for s, e in self.ranges]))
 
     def __iter__(self):
         return iter((self.start, self.end))
@@ -69,21 +83,67 @@ class Range(object):
     @classmethod
     def parse(cls, header):
         """
-            Parse the header; may return None if header is invalid
+            Parse the header, which may list several ranges; may return
+            None if header is invalid
         """
-        m = _rx_range.match(header or '')
+        m = _rx_range_set.match(header or '')
         if not m:
             return None
-        start, end = m.groups()
-        if not start:
-            return cls(-int(end), None)
-        start = int(start)
+        specs = [spec.strip() for spec in m.group(1).split(',')]
+        specs = [spec for spec in specs if spec]
+        if len(specs) <= 1:
+            # a single range may be followed by garbage, as it always could
+            m = _rx_range.match(header)
+            range = m and _parse_range_spec(*m.groups())
+            if range is None:
+                return None
+            return cls(*range)
+        ranges = []
+        for spec in specs:
+            m = _rx_range_spec.match(spec)
+            if not m:
+                return None
+            range = _parse_range_spec(*m.groups())
+            if range is None:
+                return None
+            ranges.append(range)
+        return cls(ranges[0][0], ranges[0][1], ranges)
+
+
+def _parse_range_spec(start, end):
+    if not start:
         if not end:
-            return cls(start, None)
-        end = int(end) + 1 # return val is non-inclusive
-        if start >= end:
             return None
-        return cls(start, end)
+        return (-int(end), None)
+    start = int(start)
+    if not end:
+        return (start, None)
+    end = int(end) + 1 # return val is non-inclusive
+    if start >= end:
+        return None
+    return (start, end)
+
+
+def _range_spec(start, end):
+    if end is None:
+        if start >= 0:
+            return '%s-' % start
+        return str(start)
+    return '%s-%s' % (start, end - 1)
+
+
+def _range_for_length(start, end, length):
+    if length is None:
+        return None
+    if end is None:
+        end = length
+        if start < 0:
+            start += length
+    if _is_content_range_valid(start, end, length):
+        stop = min(end, length)
+        return (start, stop)
+    else:
+        return None
 
 
 class ContentRange(object):
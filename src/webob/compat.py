@@ -127,6 +127,28 @@ else:
             yield (x.decode(encoding), y.decode(encoding))
 
 
+def split_qsl(qs):
+    """
+    Split a query string into a list of ``(name, value)`` pairs without
+    unquoting or decoding them; :func:`unquote_qs_text` turns a name or
+    value into the text :func:`parse_qsl_text` would have produced.
+    """
+    result = []
+    for s1 in qs.split('&'):
+        for name_value in s1.split(';'):
+            if name_value:
+                name, sep, value = name_value.partition('=')
+                result.append((name, value))
+    return result
+
+if PY3:
+    def unquote_qs_text(s, encoding='utf-8'):
+        return unquote(s.encode('latin-1').replace(b'+', b' ')).decode(encoding)
+else:
+    def unquote_qs_text(s, encoding='utf-8'):
+        return url_unquote(s.replace('+', ' ')).decode(encoding)
+
+
 if PY3:
     from html import escape
 else:
@@ -0,0 +1,377 @@
+"""
+Content codings (``Content-Encoding``) used to compress response bodies
+"""
+from collections import OrderedDict
+import struct
+import threading
+import zlib
+
+try:
+    from time import monotonic as _clock
+except ImportError: # pragma: no cover
+    from time import time as _clock
+
+from webob.acceptparse import AcceptEncoding
+from webob.compat import (
+    PY2,
+    string_types,
+    )
+
+__all__ = [
+    'CompressionCache',
+    'DeflateEncoder',
+    'GzipEncoder',
+    'default_pool',
+    'encode_app_iter',
+    'encode_parallel',
+    'encoders',
+    'negotiate_encoding',
+    'register_encoder',
+    ]
+
+#: The zlib compression level used when none is given.  Level 9 costs a
+#: lot more CPU than this for output that's barely smaller.
+DEFAULT_LEVEL = 6
+
+_gzip_header = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+
+
+class DeflateEncoder(object):
+    """
+    Incrementally compresses data as a raw deflate stream (the ``deflate``
+    content coding as WebOb decodes it).
+
+    ``level`` and ``strategy`` are passed to :func:`zlib.compressobj`.
+    An encoder produces one body: call :meth:`header`, :meth:`compress` for
+    each chunk of data, :meth:`flush` and finally :meth:`trailer`, and
+    concatenate what they return (see :func:`encode_app_iter`).
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, strategy=zlib.Z_DEFAULT_STRATEGY):
+        self.level = level
+        self.strategy = strategy
+        self._compressobj = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+            strategy)
+
+    def header(self):
+        return b''
+
+    def compress(self, data):
+        # This may return nothing if the input is small enough; zlib
+        # buffers it for the next call or for a flush.
+        return self._compressobj.compress(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        """
+        Return the data zlib has buffered.  With ``mode=zlib.Z_SYNC_FLUSH``
+        the output ends on a byte boundary and more data can be compressed
+        afterwards; the default ends the stream.
+        """
+        return self._compressobj.flush(mode)
+
+    def trailer(self):
+        return b''
+
+
+class GzipEncoder(DeflateEncoder):
+    """
+    Incrementally compresses data in the gzip format, the ``gzip`` content
+    coding.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, strategy=zlib.Z_DEFAULT_STRATEGY):
+        DeflateEncoder.__init__(self, level, strategy)
+        self.crc = zlib.crc32(b'') & 0xffffffff
+        self.size = 0
+
+    def header(self):
+        return _gzip_header
+
+    def compress(self, data):
+        self.size += len(data)
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        return self._compressobj.compress(data)
+
+    def trailer(self):
+        return struct.pack('<2L', self.crc, self.size & 0xffffffff)
+
+
+#: The encoder for each content coding, by name.  Each value is called
+#: with the ``level`` and ``strategy`` keyword arguments and must return an
+#: object with the interface of :class:`DeflateEncoder`.
+encoders = {
+    'gzip': GzipEncoder,
+    'deflate': DeflateEncoder,
+    }
+
+
+def register_encoder(name, encoder):
+    """
+    Make ``Response.encode_content`` support the content coding ``name``
+    using ``encoder`` (see :data:`encoders`).
+    """
+    encoders[name] = encoder
+
+
+def encode_app_iter(app_iter, encoder, flush_every=None, flush_bytes=None,
+                    flush_interval=None):
+    """
+    Return an iterator over the chunks of ``app_iter`` encoded with
+    ``encoder``, without collecting the whole body.
+
+    Normally zlib holds on to compressed data until it has a block's worth,
+    which is bad for bodies produced slowly (progress updates, server-sent
+    events): the client sees nothing for a long time.  The ``flush_*``
+    arguments make the encoder do a ``Z_SYNC_FLUSH`` after a chunk, so
+    everything compressed so far is sent along with it, when any of these
+    is reached since the last flush:
+
+    ``flush_every``
+        a number of chunks (``1`` flushes after every chunk);
+    ``flush_bytes``
+        a number of bytes of uncompressed data;
+    ``flush_interval``
+        a number of seconds.  This is checked as chunks arrive, so it
+        can't flush while ``app_iter`` is blocked.
+
+    Each flush costs a few bytes of output; the result is still a single
+    valid stream, with the same gzip checksum and size trailer.
+    """
+    result = encoder.header()
+    if result:
+        yield result
+    flushing = (flush_every is not None or flush_bytes is not None or
+                flush_interval is not None)
+    if flushing:
+        chunks = size = 0
+        last_flush = _clock()
+    for item in app_iter:
+        result = encoder.compress(item)
+        if flushing:
+            chunks += 1
+            size += len(item)
+            if ((flush_every is not None and chunks >= flush_every) or
+                    (flush_bytes is not None and size >= flush_bytes) or
+                    (flush_interval is not None and
+                     _clock() - last_flush >= flush_interval)):
+                result += encoder.flush(zlib.Z_SYNC_FLUSH)
+                chunks = size = 0
+                if flush_interval is not None:
+                    last_flush = _clock()
+        if result:
+            yield result
+    result = encoder.flush()
+    if result:
+        yield result
+    result = encoder.trailer()
+    if result:
+        yield result
+
+
+def negotiate_encoding(accept_encoding, offers=('gzip', 'deflate')):
+    """
+    Return the content coding in ``offers`` that ``accept_encoding`` (an
+    ``Accept-Encoding`` header value or ``request.accept_encoding``) gives
+    the highest quality, preferring the earlier offer on ties.  Return
+    ``None`` if none of them are acceptable, or if there's no
+    ``Accept-Encoding`` header at all.
+
+    Codings the header names explicitly take precedence over ``*``, so
+    ``gzip;q=0, *`` never selects ``gzip``.
+    """
+    if isinstance(accept_encoding, string_types):
+        accept_encoding = AcceptEncoding(accept_encoding)
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for mask, quality in accept_encoding.parsed:
+        mask = mask.lower()
+        qualities[mask] = max(quality, qualities.get(mask, 0))
+    wildcard = qualities.get('*', 0)
+    best_offer = None
+    best_quality = 0
+    for offer in offers:
+        quality = qualities.get(offer.lower(), wildcard)
+        if quality > best_quality:
+            best_offer = offer
+            best_quality = quality
+    return best_offer
+
+
+#: The default size of the blocks :func:`encode_parallel` compresses.
+PARALLEL_BLOCK_SIZE = 1 << 17
+
+# deflate can refer back this far, so this much of the preceding data is
+# given to each block's compressor as a dictionary
+_WINDOW_SIZE = 1 << 15
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """
+    Return the thread pool, with one thread per CPU, that
+    :func:`encode_parallel` uses when it isn't given one.  It's created the
+    first time it's needed and shared by everything that uses it.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from multiprocessing import cpu_count
+                from multiprocessing.pool import ThreadPool
+                _pool = ThreadPool(cpu_count())
+    return _pool
+
+
+def _deflate_block(args):
+    data, start, stop, level, strategy = args
+    if start and not PY2:
+        compressobj = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+            strategy, data[max(0, start - _WINDOW_SIZE):start])
+    else:
+        compressobj = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+            strategy)
+    result = compressobj.compress(data[start:stop])
+    if stop < len(data):
+        # end on a byte boundary without ending the stream, so the next
+        # block's output can simply follow
+        return result + compressobj.flush(zlib.Z_SYNC_FLUSH)
+    return result + compressobj.flush()
+
+
+def encode_parallel(data, encoding='gzip', level=DEFAULT_LEVEL,
+                    strategy=zlib.Z_DEFAULT_STRATEGY,
+                    block_size=PARALLEL_BLOCK_SIZE, pool=None):
+    """
+    Compress the bytes ``data`` with the ``gzip`` or ``deflate`` content
+    coding, compressing blocks of ``block_size`` bytes on several threads
+    at once (zlib releases the GIL while it works), and return the list of
+    chunks of the result.
+
+    Like pigz, each block is compressed separately, using the end of the
+    previous block as a dictionary so little compression is lost, and the
+    results are joined into a single stream that any client can decode.
+    ``pool`` is anything with a ``map(func, iterable)`` method that
+    returns the results in order, such as a
+    :class:`multiprocessing.pool.ThreadPool` or a
+    :class:`concurrent.futures.ThreadPoolExecutor`; by default
+    :func:`default_pool` is used.
+    """
+    if encoding not in ('gzip', 'deflate'):
+        raise ValueError('Cannot compress %r in parallel' % (encoding,))
+    if pool is None:
+        pool = default_pool()
+    size = len(data)
+    blocks = [(data, start, min(start + block_size, size), level, strategy)
+              for start in range(0, size, block_size)]
+    if not blocks:
+        blocks = [(data, 0, 0, level, strategy)]
+    chunks = list(pool.map(_deflate_block, blocks))
+    if encoding == 'gzip':
+        crc = zlib.crc32(data) & 0xffffffff
+        chunks.insert(0, _gzip_header)
+        chunks.append(struct.pack('<2L', crc, size & 0xffffffff))
+    return chunks
+
+
+class CompressionCache(object):
+    """
+    A thread-safe LRU cache of compressed bodies, for
+    ``Response.compression_cache``.
+
+    Values are lists of chunks.  The cache holds at most ``max_size`` bytes
+    of them in total, evicting the least recently used entries to make
+    room; bodies larger than ``max_entry_size`` (by default a quarter of
+    ``max_size``) aren't cached at all.  ``hits``, ``misses`` and
+    ``evictions`` count what happened so far, ``size`` is the number of
+    bytes cached.
+    """
+
+    def __init__(self, max_size=32 << 20, max_entry_size=None):
+        self.max_size = max_size
+        if max_entry_size is None:
+            max_entry_size = max_size // 4
+        self.max_entry_size = min(max_entry_size, max_size)
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s %d entries, %d bytes, %d hits, %d misses>' % (
+            self.__class__.__name__, len(self), self.size, self.hits,
+            self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        """
+        Return the chunks cached for ``key``, or ``None``.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            # re-inserting makes it the most recently used entry
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, chunks):
+        """
+        Cache the list of bytes ``chunks`` for ``key``, unless it's too big.
+        Return True if it was cached.
+        """
+        size = sum(map(len, chunks))
+        if size > self.max_entry_size:
+            return False
+        chunks = list(chunks)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[0]
+            while self._entries and self.size + size > self.max_size:
+                evicted_key, (evicted_size, evicted) = \
+                    self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+            self._entries[key] = (size, chunks)
+            self.size += size
+        return True
+
+    def clear(self):
+        """
+        Empty the cache (the counters are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def store_iter(self, key, app_iter):
+        """
+        Return an iterator over ``app_iter`` that caches the chunks it
+        produced under ``key`` once it's been consumed to the end.  Nothing
+        is cached if it's closed early or grows too big to cache.
+        """
+        chunks = []
+        size = 0
+        for chunk in app_iter:
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.max_entry_size:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is not None:
+            self.set(key, chunks)
@@ -134,22 +134,24 @@ def header_getter(header, rfc_section):
     key = header.lower()
 
     def fget(r):
-        for k, v in r._headerlist:
-            if k.lower() == key:
-                return v
+        headerlist = r._headerlist
+        positions = headerlist.positions(key)
+        if positions:
+            return headerlist[positions[0]][1]
 
     def fset(r, value):
-        fdel(r)
-        if value is not None:
-            if '\n' in value or '\r' in value:
-                raise ValueError('Header value may not contain control characters')
+        if value is None:
+            fdel(r)
+            return
+        if '\n' in value or '\r' in value:
+            raise ValueError('Header value may not contain control characters')
 
-            if isinstance(value, text_type) and PY2:
-                value = value.encode('latin-1')
-            r._headerlist.append((header, value))
+        if isinstance(value, text_type) and PY2:
+            value = value.encode('latin-1')
+        r._headerlist.replace(header, value)
 
     def fdel(r):
-        r._headerlist[:] = [(k, v) for (k, v) in r._headerlist if k.lower() != key]
+        r._headerlist.remove_all(key)
 
     return property(fget, fset, fdel, doc)
 
@@ -261,6 +263,8 @@ def serialize_range(value):
         return None
     elif isinstance(value, (list, tuple)):
         return str(Range(*value))
+    elif isinstance(value, Range):
+        return str(value)
     else:
         assert isinstance(value, str)
         return value
@@ -1,27 +1,150 @@
 from collections import MutableMapping
 from webob.compat import (
+    PY2,
     iteritems_,
     string_types,
     )
 from webob.multidict import MultiDict
 
-__all__ = ['ResponseHeaders', 'EnvironHeaders']
+__all__ = ['HeaderList', 'ResponseHeaders', 'EnvironHeaders']
+
+class HeaderList(list):
+    """
+    A list of ``(name, value)`` header tuples, as passed to
+    ``start_response``, that also keeps an index from lowercased header
+    names to their positions in the list.
+
+    :meth:`positions`, :meth:`replace` and :meth:`remove_all` use the
+    index instead of comparing every header name.  Appending and extending
+    keep the index up to date; any other change to the list drops it, and
+    it's rebuilt the next time it's needed.
+
+    ``version`` is incremented by every change, so something computed from
+    the headers can tell whether it's still current.
+    """
+
+    __slots__ = ('_index', 'version')
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self._index = None
+        self.version = 0
+
+    def _get_index(self):
+        index = self._index
+        if index is None:
+            index = self._index = {}
+            for i, (k, v) in enumerate(self):
+                index.setdefault(k.lower(), []).append(i)
+        return index
+
+    def positions(self, name):
+        """
+        Return the positions of the headers called ``name`` (compared
+        case-insensitively), in order.  The list returned mustn't be changed.
+        """
+        return self._get_index().get(name.lower(), ())
+
+    def replace(self, name, value):
+        """
+        Set the header ``name`` to ``value``.  A single existing header of
+        that name is replaced in place; otherwise all of them are removed and
+        the header is appended.
+        """
+        positions = self.positions(name)
+        if len(positions) == 1:
+            list.__setitem__(self, positions[0], (name, value))
+            self.version += 1
+        else:
+            self.remove_all(name)
+            self.append((name, value))
+
+    def remove_all(self, name):
+        """
+        Remove all headers called ``name``, returning True if there were any.
+        """
+        positions = self.positions(name)
+        if not positions:
+            return False
+        for i in reversed(positions):
+            list.__delitem__(self, i)
+        self._index = None
+        self.version += 1
+        return True
+
+    def append(self, item):
+        list.append(self, item)
+        self.version += 1
+        index = self._index
+        if index is not None:
+            index.setdefault(item[0].lower(), []).append(len(self) - 1)
+
+    def extend(self, items):
+        start = len(self)
+        list.extend(self, items)
+        self.version += 1
+        index = self._index
+        if index is not None:
+            for i in range(start, len(self)):
+                index.setdefault(self[i][0].lower(), []).append(i)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def _invalidate(name):
+        method = getattr(list, name)
+        def invalidate(self, *args):
+            self._index = None
+            self.version += 1
+            return method(self, *args)
+        invalidate.__name__ = name
+        return invalidate
+
+    __setitem__ = _invalidate('__setitem__')
+    __delitem__ = _invalidate('__delitem__')
+    __imul__ = _invalidate('__imul__')
+    insert = _invalidate('insert')
+    pop = _invalidate('pop')
+    remove = _invalidate('remove')
+    reverse = _invalidate('reverse')
+    sort = _invalidate('sort')
+    if PY2:
+        __setslice__ = _invalidate('__setslice__')
+        __delslice__ = _invalidate('__delslice__')
+    else:
+        clear = _invalidate('clear')
+    del _invalidate
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
 
 class ResponseHeaders(MultiDict):
     """
         Dictionary view on the response headerlist.
         Keys are normalized for case and whitespace.
     """
-    def __getitem__(self, key):
+    def __init__(self, *args, **kw):
+        MultiDict.__init__(self, *args, **kw)
+        self._items = HeaderList(self._items)
+
+    def _positions(self, key):
+        items = self._items
+        if isinstance(items, HeaderList):
+            return items.positions(key)
         key = key.lower()
-        for k, v in reversed(self._items):
-            if k.lower() == key:
-                return v
-        raise KeyError(key)
+        return [i for i, (k, v) in enumerate(items) if k.lower() == key]
+
+    def __getitem__(self, key):
+        positions = self._positions(key)
+        if not positions:
+            raise KeyError(key.lower())
+        return self._items[positions[-1]][1]
 
     def getall(self, key):
-        key = key.lower()
-        return [v for (k, v) in self._items if k.lower() == key]
+        items = self._items
+        return [items[i][1] for i in self._positions(key)]
 
     def mixed(self):
         r = self.dict_of_lists()
@@ -37,35 +160,31 @@ class ResponseHeaders(MultiDict):
         return r
 
     def __setitem__(self, key, value):
+        items = self._items
+        if isinstance(items, HeaderList):
+            items.replace(key, value)
+            return
         norm_key = key.lower()
-        self._items[:] = [(k, v) for (k, v) in self._items if k.lower() != norm_key]
-        self._items.append((key, value))
+        items[:] = [(k, v) for (k, v) in items if k.lower() != norm_key]
+        items.append((key, value))
 
     def __delitem__(self, key):
-        key = key.lower()
         items = self._items
-        found = False
-        for i in range(len(items)-1, -1, -1):
-            if items[i][0].lower() == key:
-                del items[i]
-                found = True
-        if not found:
-            raise KeyError(key)
+        positions = self._positions(key)
+        if not positions:
+            raise KeyError(key.lower())
+        for i in reversed(positions):
+            del items[i]
 
     def __contains__(self, key):
-        key = key.lower()
-        for k, v in self._items:
-            if k.lower() == key:
-                return True
-        return False
+        return bool(self._positions(key))
 
     has_key = __contains__
 
     def setdefault(self, key, default=None):
-        c_key = key.lower()
-        for k, v in self._items:
-            if k.lower() == c_key:
-                return v
+        positions = self._positions(key)
+        if positions:
+            return self._items[positions[0]][1]
         self._items.append((key, default))
         return default
 
@@ -73,16 +192,16 @@ class ResponseHeaders(MultiDict):
         if len(args) > 1:
             raise TypeError("pop expected at most 2 arguments, got %s"
                               % repr(1 + len(args)))
-        key = key.lower()
-        for i in range(len(self._items)):
-            if self._items[i][0].lower() == key:
-                v = self._items[i][1]
-                del self._items[i]
-                return v
+        positions = self._positions(key)
+        if positions:
+            i = positions[0]
+            v = self._items[i][1]
+            del self._items[i]
+            return v
         if args:
             return args[0]
         else:
-            raise KeyError(key)
+            raise KeyError(key.lower())
 
 
 
@@ -98,47 +217,116 @@ key2header = {
 
 header2key = dict([(v.upper(),k) for (k,v) in key2header.items()])
 
+# The translations below are cached, up to this many entries each (header
+# names come from clients, so the caches can't be allowed to grow forever).
+_TRANS_CACHE_SIZE = 1000
+
+_key2name = {}
+_name2key = {}
+
 def _trans_key(key):
+    try:
+        return _key2name[key]
+    except KeyError:
+        pass
     if not isinstance(key, string_types):
-        return None
+        name = None
     elif key in key2header:
-        return key2header[key]
+        name = key2header[key]
     elif key.startswith('HTTP_'):
-        return key[5:].replace('_', '-').title()
+        name = key[5:].replace('_', '-').title()
     else:
-        return None
+        name = None
+    if len(_key2name) < _TRANS_CACHE_SIZE:
+        _key2name[key] = name
+    return name
 
 def _trans_name(name):
-    name = name.upper()
-    if name in header2key:
-        return header2key[name]
-    return 'HTTP_'+name.replace('-', '_')
+    try:
+        return _name2key[name]
+    except KeyError:
+        pass
+    key = name.upper()
+    if key in header2key:
+        key = header2key[key]
+    else:
+        key = 'HTTP_'+key.replace('-', '_')
+    if len(_name2key) < _TRANS_CACHE_SIZE:
+        _name2key[name] = key
+    return key
+
+for _name in (
+    'Accept', 'Accept-Charset', 'Accept-Encoding', 'Accept-Language',
+    'Authorization', 'Cache-Control', 'Connection', 'Content-Length',
+    'Content-Type', 'Cookie', 'Host', 'If-Match', 'If-Modified-Since',
+    'If-None-Match', 'If-Range', 'If-Unmodified-Since', 'Origin', 'Pragma',
+    'Range', 'Referer', 'User-Agent', 'X-Forwarded-For', 'X-Forwarded-Host',
+    'X-Forwarded-Proto', 'X-Requested-With',
+    ):
+    _trans_key(_trans_name(_name))
+    _trans_name(_name.lower())
+del _name
 
 class EnvironHeaders(MutableMapping):
     """An object that represents the headers as present in a
     WSGI environment.
 
-    This object is a wrapper (with no internal state) for a WSGI
-    request object, representing the CGI-style HTTP_* keys as a
-    dictionary.  Because a CGI environment can only hold one value for
-    each key, this dictionary is single-valued (unlike outgoing
-    headers).
+    This object is a wrapper for a WSGI request object, representing the
+    CGI-style HTTP_* keys as a dictionary.  Because a CGI environment can
+    only hold one value for each key, this dictionary is single-valued
+    (unlike outgoing headers).
+
+    With ``cache_keys=True`` the list of header names is computed once and
+    reused by ``keys()``, iteration and ``len()`` until the headers are
+    changed through this object or the environ gains or loses keys.  If
+    other code replaces environ keys without changing their number, call
+    :meth:`invalidate`.
     """
 
-    def __init__(self, environ):
+    def __init__(self, environ, cache_keys=False):
         self.environ = environ
+        self.cache_keys = cache_keys
+        self._keys = None
 
     def __getitem__(self, hname):
         return self.environ[_trans_name(hname)]
 
     def __setitem__(self, hname, value):
         self.environ[_trans_name(hname)] = value
+        self._keys = None
 
     def __delitem__(self, hname):
         del self.environ[_trans_name(hname)]
+        self._keys = None
+
+    def invalidate(self):
+        """
+        Forget the cached header names (see ``cache_keys``).
+        """
+        self._keys = None
 
     def keys(self):
-        return filter(None, map(_trans_key, self.environ))
+        environ = self.environ
+        if not self.cache_keys:
+            return filter(None, map(_trans_key, environ))
+        cached = self._keys
+        if cached is not None:
+            size, env_keys, names = cached
+            if size == len(environ):
+                for key in env_keys:
+                    if key not in environ:
+                        break
+                else:
+                    return list(names)
+        env_keys = []
+        names = []
+        for key in environ:
+            name = _trans_key(key)
+            if name:
+                env_keys.append(key)
+                names.append(name)
+        self._keys = (len(environ), env_keys, names)
+        return list(names)
 
     def __contains__(self, hname):
         return _trans_name(hname) in self.environ
@@ -13,10 +13,13 @@ from webob.compat import (
     PY2,
     iteritems_,
     itervalues_,
+    split_qsl,
+    unquote_qs_text,
     url_encode,
     )
 
-__all__ = ['MultiDict', 'NestedMultiDict', 'NoVars', 'GetDict']
+__all__ = ['MultiDict', 'IndexedMultiDict', 'NestedMultiDict', 'NoVars',
+           'GetDict']
 
 class MultiDict(MutableMapping):
     """
@@ -276,51 +279,306 @@ class MultiDict(MutableMapping):
     else:
         values = itervalues
 
+class IndexedMultiDict(MultiDict):
+    """
+    A MultiDict that also keeps an index from each key to the positions of
+    its items, so looking up, testing for or removing a key doesn't scan
+    every item.
+
+    Items keep their order and the dict behaves exactly like a MultiDict.
+    Adding items updates the index as it goes; removing items rebuilds it
+    the next time a key is looked up.  Keys must be hashable, and the
+    item list must not be changed behind the dict's back (e.g. through
+    :meth:`view_list`).
+    """
+
+    _index = None
+
+    def _items__get(self):
+        return self._list
+
+    def _items__set(self, items):
+        self._list = items
+        self._index = None
+
+    _items = property(_items__get, _items__set)
+
+    def _get_index(self):
+        index = self._index
+        if index is None:
+            index = self._index = {}
+            for i, (k, v) in enumerate(self._items):
+                index.setdefault(k, []).append(i)
+        return index
+
+    def _index_from(self, start):
+        # index the items appended at position ``start`` and later
+        index = self._index
+        if index is not None:
+            items = self._items
+            for i in range(start, len(items)):
+                index.setdefault(items[i][0], []).append(i)
+
+    def __getitem__(self, key):
+        positions = self._get_index().get(key)
+        if not positions:
+            raise KeyError(key)
+        return self._items[positions[-1]][1]
+
+    def __setitem__(self, key, value):
+        if key in self._get_index():
+            self._remove(key)
+        self.add(key, value)
+
+    def add(self, key, value):
+        """
+        Add the key and value, not overwriting any previous value.
+        """
+        items = self._items
+        items.append((key, value))
+        index = self._index
+        if index is not None:
+            index.setdefault(key, []).append(len(items) - 1)
+
+    def getall(self, key):
+        """
+        Return a list of all values matching the key (may be an empty list)
+        """
+        items = self._items
+        return [items[i][1] for i in self._get_index().get(key, ())]
+
+    def _remove(self, key, positions=None):
+        if positions is None:
+            positions = self._get_index()[key]
+        items = self._items
+        for i in reversed(positions):
+            del items[i]
+        self._index = None
+
+    def __delitem__(self, key):
+        if key not in self._get_index():
+            raise KeyError(key)
+        self._remove(key)
+
+    def __contains__(self, key):
+        return key in self._get_index()
+
+    has_key = __contains__
+
+    def clear(self):
+        del self._items[:]
+        self._index = {}
+
+    def setdefault(self, key, default=None):
+        positions = self._get_index().get(key)
+        if positions:
+            return self._items[positions[0]][1]
+        self.add(key, default)
+        return default
+
+    def pop(self, key, *args):
+        if len(args) > 1:
+            raise TypeError("pop expected at most 2 arguments, got %s"
+                             % repr(1 + len(args)))
+        positions = self._get_index().get(key)
+        if positions:
+            v = self._items[positions[0]][1]
+            self._remove(key, positions[:1])
+            return v
+        if args:
+            return args[0]
+        else:
+            raise KeyError(key)
+
+    def popitem(self):
+        item = self._items.pop()
+        index = self._index
+        if index is not None:
+            positions = index[item[0]]
+            positions.pop()
+            if not positions:
+                del index[item[0]]
+        return item
+
+    def extend(self, other=None, **kwargs):
+        start = len(self._items)
+        MultiDict.extend(self, other)
+        self._index_from(start)
+        if kwargs:
+            self.update(kwargs)
+
 _dummy = object()
 
-class GetDict(MultiDict):
+class GetDict(IndexedMultiDict):
+    """
+    The MultiDict used for ``request.GET``: changes to it are written back
+    to ``QUERY_STRING`` in the environ it was created for.
+
+    Use :meth:`batch` to make several changes and rewrite the query string
+    only once.
+    """
 #     def __init__(self, data, tracker, encoding, errors):
 #         d = lambda b: b.decode(encoding, errors)
 #         data = [(d(k), d(v)) for k,v in data]
+    # undecoded (name, value) pairs of a lazily parsed query string
+    _raw = None
+
     def __init__(self, data, env):
         self.env = env
-        MultiDict.__init__(self, data)
+        self._batch_depth = 0
+        self._batch_changed = False
+        IndexedMultiDict.__init__(self, data)
+
+    @classmethod
+    def from_query_string(cls, qs, env, encoding='utf-8'):
+        """
+        Create a GetDict for the query string ``qs``.
+
+        The query string is only split into pairs here.  Names are decoded
+        the first time the dict is searched, and each value the first time
+        it's returned, so reading a few parameters of a long query string
+        doesn't decode all of them.  Anything that needs every item
+        (iterating over items or values, or any change) decodes the rest.
+        """
+        obj = cls((), env)
+        obj._raw = split_qsl(qs)
+        obj._encoding = encoding
+        obj._keys = None
+        obj._values = {}
+        return obj
+
+    def _items__get(self):
+        if self._raw is not None:
+            keys = self._decoded_keys()
+            value = self._decoded_value
+            # the positions stay the same, so the index is still good
+            index = self._index
+            self._items = [(k, value(i)) for i, k in enumerate(keys)]
+            self._index = index
+        return self._list
+
+    def _items__set(self, items):
+        self._raw = None
+        self._keys = self._values = None
+        IndexedMultiDict._items__set(self, items)
+
+    _items = property(_items__get, _items__set)
+
+    def _decoded_keys(self):
+        # decodes every name, and indexes them at the same time
+        keys = self._keys
+        if keys is None:
+            unquote, encoding = unquote_qs_text, self._encoding
+            keys = self._keys = [unquote(k, encoding) for k, v in self._raw]
+            index = self._index = {}
+            for i, k in enumerate(keys):
+                index.setdefault(k, []).append(i)
+        return keys
+
+    def _decoded_value(self, index):
+        values = self._values
+        try:
+            return values[index]
+        except KeyError:
+            value = values[index] = unquote_qs_text(
+                self._raw[index][1], self._encoding)
+            return value
+
+    def __getitem__(self, key):
+        if self._raw is None:
+            return IndexedMultiDict.__getitem__(self, key)
+        self._decoded_keys()
+        positions = self._index.get(key)
+        if not positions:
+            raise KeyError(key)
+        return self._decoded_value(positions[-1])
+
+    def getall(self, key):
+        if self._raw is None:
+            return IndexedMultiDict.getall(self, key)
+        self._decoded_keys()
+        value = self._decoded_value
+        return [value(i) for i in self._index.get(key, ())]
+
+    def __contains__(self, key):
+        if self._raw is None:
+            return IndexedMultiDict.__contains__(self, key)
+        self._decoded_keys()
+        return key in self._index
+
+    has_key = __contains__
+
+    def __len__(self):
+        if self._raw is None:
+            return len(self._list)
+        return len(self._raw)
+
+    def iterkeys(self):
+        if self._raw is None:
+            return IndexedMultiDict.iterkeys(self)
+        return iter(self._decoded_keys())
+
+    if PY2:
+        def keys(self):
+            return list(self.iterkeys())
+    else:
+        keys = iterkeys
+
+    __iter__ = iterkeys
+
+    def batch(self):
+        """
+        Return a context manager that delays rewriting ``QUERY_STRING`` until
+        the end of the ``with`` block, however many changes are made in it::
+
+            with req.GET.batch():
+                del req.GET['page']
+                req.GET['sort'] = 'name'
+        """
+        return _GetDictBatch(self)
+
     def on_change(self):
+        if self._batch_depth:
+            self._batch_changed = True
+            return
         e = lambda t: t.encode('utf8')
         data = [(e(k), e(v)) for k,v in self.items()]
         qs = url_encode(data)
         self.env['QUERY_STRING'] = qs
         self.env['webob._parsed_query_vars'] = (self, qs)
     def __setitem__(self, key, value):
-        MultiDict.__setitem__(self, key, value)
-        self.on_change()
+        with self.batch():
+            IndexedMultiDict.__setitem__(self, key, value)
+            self.on_change()
     def add(self, key, value):
-        MultiDict.add(self, key, value)
+        IndexedMultiDict.add(self, key, value)
         self.on_change()
     def __delitem__(self, key):
-        MultiDict.__delitem__(self, key)
+        IndexedMultiDict.__delitem__(self, key)
         self.on_change()
     def clear(self):
-        MultiDict.clear(self)
+        IndexedMultiDict.clear(self)
         self.on_change()
     def setdefault(self, key, default=None):
-        result = MultiDict.setdefault(self, key, default)
+        result = IndexedMultiDict.setdefault(self, key, default)
         self.on_change()
         return result
     def pop(self, key, *args):
-        result = MultiDict.pop(self, key, *args)
+        result = IndexedMultiDict.pop(self, key, *args)
         self.on_change()
         return result
     def popitem(self):
-        result = MultiDict.popitem(self)
+        result = IndexedMultiDict.popitem(self)
         self.on_change()
         return result
     def update(self, *args, **kwargs):
-        MultiDict.update(self, *args, **kwargs)
-        self.on_change()
+        with self.batch():
+            IndexedMultiDict.update(self, *args, **kwargs)
+            self.on_change()
     def extend(self, *args, **kwargs):
-        MultiDict.extend(self, *args, **kwargs)
-        self.on_change()
+        with self.batch():
+            IndexedMultiDict.extend(self, *args, **kwargs)
+            self.on_change()
     def __repr__(self):
         items = map('(%r, %r)'.__mod__, _hide_passwd(self.items()))
         # TODO: GET -> GetDict
@@ -329,6 +587,21 @@ class GetDict(MultiDict):
         # Copies shouldn't be tracked
         return MultiDict(self)
 
+class _GetDictBatch(object):
+    def __init__(self, vars):
+        self.vars = vars
+
+    def __enter__(self):
+        self.vars._batch_depth += 1
+        return self.vars
+
+    def __exit__(self, exc_type, exc_value, tb):
+        vars = self.vars
+        vars._batch_depth -= 1
+        if not vars._batch_depth and vars._batch_changed:
+            vars._batch_changed = False
+            vars.on_change()
+
 class NestedMultiDict(MultiDict):
     """
     Wraps several MultiDict objects, treating it as one large MultiDict
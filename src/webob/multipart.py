@@ -0,0 +1,251 @@
+"""
+Incremental parser for ``multipart/form-data`` request bodies
+"""
+import binascii
+import tempfile
+
+from webob.compat import (
+    PY2,
+    cgi_FieldStorage,
+    parse_header,
+    )
+
+from webob.headers import ResponseHeaders
+from webob.multidict import IndexedMultiDict
+
+__all__ = ['MultipartParser', 'MultipartPart', 'parse_boundary']
+
+BLOCK_SIZE = 1 << 16
+
+# The largest amount of header data we accept for a single part before
+# giving up on the body as malformed.
+MAX_HEADER_SIZE = 1 << 16
+
+_transfer_decoders = {
+    'base64': binascii.a2b_base64,
+    'quoted-printable': binascii.a2b_qp,
+}
+
+
+def parse_boundary(content_type):
+    """
+    Return the ``boundary`` parameter of a ``multipart/*`` Content-Type, or
+    ``None`` if there isn't one.
+    """
+    ctype, params = parse_header(content_type or '')
+    return params.get('boundary') or None
+
+
+class MultipartPart(cgi_FieldStorage):
+    """
+    A single part of a ``multipart/form-data`` body.
+
+    This is API-compatible with the ``cgi.FieldStorage`` objects WebOb used
+    to put in ``request.POST`` for file uploads (``name``, ``filename``,
+    ``file``, ``value``, ``type``, ``type_options``, ``headers``), and adds
+    ``size``, the number of body bytes that were read for the part.
+    """
+
+    def __init__(self, headers, charset='utf8', errors='replace'):
+        self.headers = headers
+        self.list = None
+        self.file = None
+        self.length = -1
+        self.size = 0
+        self.disposition, self.disposition_options = parse_header(
+            headers.get('Content-Disposition', ''))
+        self.name = self.disposition_options.get('name')
+        self.filename = self.disposition_options.get('filename')
+        if 'Content-Type' in headers:
+            self.type, self.type_options = parse_header(
+                headers['Content-Type'])
+        else:
+            self.type, self.type_options = 'text/plain', {}
+        self.charset = self.type_options.get('charset', charset)
+        self.errors = errors
+
+    @property
+    def is_file(self):
+        """
+        True if the part is a file upload (its ``Content-Disposition`` has a
+        non-empty ``filename``); the contents are then kept in ``file``.
+        """
+        return bool(self.filename)
+
+    def _finish(self, chunks):
+        if self.file is not None:
+            self.file.seek(0)
+            return
+        data = b''.join(chunks)
+        decoder = _transfer_decoders.get(
+            self.headers.get('Content-Transfer-Encoding', '').lower())
+        if decoder is not None:
+            data = decoder(data)
+        if self.filename is not None and not PY2:
+            # an empty file field; cgi.FieldStorage gave its bytes
+            self.value = data
+        else:
+            self.value = data.decode(self.charset, self.errors)
+
+
+class MultipartParser(object):
+    """
+    Incrementally parses a ``multipart/form-data`` body read from ``fp``.
+
+    The body is read in blocks of ``block_size`` bytes, and the contents of
+    file uploads are written straight to a file created by ``make_file``
+    (an anonymous temporary file by default) instead of being buffered in
+    memory.  Plain form fields are decoded using the charset of the part,
+    falling back to ``charset``.
+
+    Iterating over the parser yields :class:`MultipartPart` objects as
+    they are completed; :meth:`parse` collects them into a
+    :class:`~webob.multidict.IndexedMultiDict` with the same shape as
+    ``request.POST``.  ``sizes`` records a ``(name, size)`` pair for every
+    part parsed so far.
+    """
+
+    def __init__(self, fp, boundary, charset='utf8', errors='replace',
+                 block_size=BLOCK_SIZE, make_file=None):
+        if not boundary:
+            raise ValueError('Invalid boundary in multipart form: %r'
+                             % (boundary,))
+        if not isinstance(boundary, bytes):
+            boundary = boundary.encode('latin-1')
+        self.fp = fp
+        self.boundary = boundary
+        self.charset = charset
+        self.errors = errors
+        self.block_size = block_size
+        if make_file is None:
+            make_file = tempfile.TemporaryFile
+        self.make_file = make_file
+        self.sizes = []
+
+    def __repr__(self):
+        return '<%s boundary=%r>' % (self.__class__.__name__, self.boundary)
+
+    def parse(self):
+        """
+        Parse the whole body and return an IndexedMultiDict of its fields.
+
+        File uploads are stored as :class:`MultipartPart` objects, all other
+        fields as text.
+        """
+        result = IndexedMultiDict()
+        add = result.add
+        for part in self:
+            if part.is_file:
+                add(part.name, part)
+            else:
+                add(part.name, part.value)
+        return result
+
+    def __iter__(self):
+        read = self.fp.read
+        block_size = self.block_size
+        delimiter = b'\n--' + self.boundary
+        keep = len(delimiter)
+        # the first delimiter doesn't have to be preceded by a line break
+        buf = b'\n'
+        eof = False
+
+        # skip the preamble
+        while True:
+            idx = buf.find(delimiter)
+            if idx != -1:
+                buf = buf[idx + keep:]
+                break
+            if eof:
+                return
+            buf = buf[-keep:]
+            data = read(block_size)
+            eof = not data
+            buf += data
+
+        while True:
+            # the rest of the delimiter line; ``--`` marks the last one
+            while len(buf) < 2 and not eof:
+                data = read(block_size)
+                eof = not data
+                buf += data
+            if len(buf) < 2 or buf[:2] == b'--':
+                return
+            while buf.find(b'\n') == -1:
+                if eof:
+                    return
+                if len(buf) > MAX_HEADER_SIZE:
+                    raise ValueError('Malformed multipart delimiter line')
+                data = read(block_size)
+                eof = not data
+                buf += data
+            buf = buf[buf.find(b'\n') + 1:]
+
+            # part headers, up to the first empty line
+            headers = []
+            while True:
+                idx = buf.find(b'\n')
+                if idx == -1:
+                    if eof:
+                        return
+                    if len(buf) > MAX_HEADER_SIZE:
+                        raise ValueError('Multipart part headers too large')
+                    data = read(block_size)
+                    eof = not data
+                    buf += data
+                    continue
+                line = buf[:idx].rstrip(b'\r')
+                buf = buf[idx + 1:]
+                if not line:
+                    break
+                line = line.decode(self.charset, self.errors)
+                if line[0] in ' \t' and headers:
+                    name, value = headers[-1]
+                    headers[-1] = (name, value + ' ' + line.strip())
+                elif ':' in line:
+                    name, value = line.split(':', 1)
+                    headers.append((name.strip(), value.strip()))
+
+            part = MultipartPart(ResponseHeaders(headers),
+                                 charset=self.charset, errors=self.errors)
+            if part.is_file:
+                part.file = self.make_file()
+                write = part.file.write
+                chunks = None
+            else:
+                chunks = []
+                write = chunks.append
+
+            # part body, up to the next delimiter
+            while True:
+                idx = buf.find(delimiter)
+                if idx != -1:
+                    end = idx
+                    if end and buf[end - 1:end] == b'\r':
+                        end -= 1
+                    if end:
+                        write(buf[:end])
+                        part.size += end
+                    buf = buf[idx + keep:]
+                    break
+                if eof:
+                    # truncated body; keep what we've got
+                    if buf:
+                        write(buf)
+                        part.size += len(buf)
+                    buf = b''
+                    break
+                if len(buf) > keep:
+                    flush = len(buf) - keep
+                    write(buf[:flush])
+                    part.size += flush
+                    buf = buf[flush:]
+                data = read(block_size)
+                eof = not data
+                buf += data
+
+            part._finish(chunks)
+            self.sizes.append((part.name, part.size))
+            yield part
+            if eof and not buf:
+                return
@@ -1,10 +1,12 @@
 import binascii
 import io
+import mmap
 import os
 import re
 import sys
 import tempfile
 import mimetypes
+import zlib
 try:
     import simplejson as json
 except ImportError:
@@ -71,12 +73,17 @@ from webob.etag import (
 from webob.headers import EnvironHeaders
 
 from webob.multidict import (
+    IndexedMultiDict,
     NestedMultiDict,
-    MultiDict,
     NoVars,
     GetDict,
     )
 
+from webob.multipart import (
+    MultipartParser,
+    parse_boundary,
+    )
+
 __all__ = ['BaseRequest', 'Request', 'LegacyRequest']
 
 class _NoDefault:
@@ -97,6 +104,29 @@ class BaseRequest(object):
     # in memory):
     request_body_tempfile_limit = 10 * 1024
 
+    # Whether ``body_file`` wraps an input stream of known length in an
+    # ``io.BufferedReader``.  Turn this off for large sequential reads, so
+    # that data is read straight into the caller's buffer; line-oriented
+    # reads (``readline``) are slow without the buffer.
+    buffered_body_file = True
+
+    # If true, request bodies sent with ``Content-Encoding: gzip`` (or
+    # ``deflate``) are transparently decompressed when they are read.  A
+    # body that expands to more than ``max_body_decompression_ratio`` times
+    # its compressed size is rejected with a ``DecompressionError``.
+    decompress_body = False
+    max_body_decompression_ratio = 100
+
+    # If true, a request with ``Transfer-Encoding: chunked`` and no
+    # ``Content-Length`` is assumed to have its chunked body passed through
+    # undecoded by the server (unless ``wsgi.input_terminated`` says
+    # otherwise), and ``body_file`` decodes it.
+    decode_chunked_body = False
+
+    # If true, ``headers`` caches the list of header names for iteration
+    # and ``len()``; see ``EnvironHeaders``.
+    cache_header_keys = False
+
     _charset = None
 
     def __init__(self, environ, charset=None, unicode_errors=None,
@@ -215,21 +245,12 @@ class BaseRequest(object):
         elif content_type != 'multipart/form-data':
             return r
 
-        fs_environ = self.environ.copy()
-        fs_environ.setdefault('CONTENT_LENGTH', '0')
-        fs_environ['QUERY_STRING'] = ''
-        if PY2:
-            fs = cgi_FieldStorage(fp=self.body_file,
-                                  environ=fs_environ,
-                                  keep_blank_values=True)
-        else:
-            fs = cgi_FieldStorage(fp=self.body_file,
-                                  environ=fs_environ,
-                                  keep_blank_values=True,
-                                  encoding=charset,
-                                  errors=errors)
+        parser = MultipartParser(self.body_file,
+                                 parse_boundary(self._content_type_raw),
+                                 charset=charset,
+                                 errors=errors)
 
-        fout = t.transcode_fs(fs, r._content_type_raw)
+        fout = t.transcode_parts(parser, r._content_type_raw)
 
         # this order is important, because setting body_file
         # resets content_length
@@ -248,6 +269,10 @@ class BaseRequest(object):
             Input stream of the request (wsgi.input).
             Setting this property resets the content_length and seekable flag
             (unlike setting req.body_file_raw).
+
+            If the input is not seekable, it is limited to the
+            Content-Length of the request and, unless
+            ``buffered_body_file`` is false, buffered.
         """
 
         if not self.is_body_readable:
@@ -255,8 +280,12 @@ class BaseRequest(object):
 
         r = self.body_file_raw
         clen = self.content_length
+        encoding = self._body_compression
+        chunked = self._body_chunked
 
-        if not self.is_body_seekable and clen is not None:
+        limit = not self.is_body_seekable and clen is not None
+
+        if limit or chunked or encoding:
             # we need to wrap input in LimitedLengthFile
             # but we have to cache the instance as well
             # otherwise this would stop working
@@ -267,8 +296,16 @@ class BaseRequest(object):
             wrapped, raw = env.get('webob._body_file', (0, 0))
 
             if raw is not r:
-                wrapped = LimitedLengthFile(r, clen)
-                wrapped = io.BufferedReader(wrapped)
+                wrapped = r
+                if limit:
+                    wrapped = LimitedLengthFile(wrapped, clen)
+                elif chunked:
+                    wrapped = ChunkedFile(wrapped)
+                if encoding:
+                    wrapped = DecompressingFile(
+                        wrapped, encoding, self.max_body_decompression_ratio)
+                if self.buffered_body_file:
+                    wrapped = io.BufferedReader(wrapped)
                 env['webob._body_file'] = wrapped, r
             r = wrapped
 
@@ -299,10 +336,34 @@ class BaseRequest(object):
 
             If you access this value, CONTENT_LENGTH will also be updated.
         """
-        if not self.is_body_seekable:
+        if not self.is_body_seekable or self._body_compression:
             self.make_body_seekable()
         return self.body_file_raw
 
+    @property
+    def _body_chunked(self):
+        # Whether body_file has to decode the chunked transfer coding
+        env = self.environ
+        return (
+            self.decode_chunked_body and
+            self.content_length is None and
+            not self.is_body_seekable and
+            not env.get('wsgi.input_terminated') and
+            env.get('HTTP_TRANSFER_ENCODING', '').strip().lower() == 'chunked'
+        )
+
+    @property
+    def _body_compression(self):
+        # The Content-Encoding body_file has to decode, if any
+        if not self.decompress_body:
+            return None
+        encoding = self.environ.get('HTTP_CONTENT_ENCODING')
+        if encoding:
+            encoding = encoding.strip().lower()
+            if encoding in _DECOMPRESS_WBITS:
+                return encoding
+        return None
+
     url_encoding = environ_getter('webob.url_encoding', 'UTF-8')
     scheme = environ_getter('wsgi.url_scheme')
     method = environ_getter('REQUEST_METHOD', 'GET')
@@ -359,7 +420,8 @@ class BaseRequest(object):
         object.
         """
         if self._headers is None:
-            self._headers = EnvironHeaders(self.environ)
+            self._headers = EnvironHeaders(
+                self.environ, cache_keys=self.cache_header_keys)
         return self._headers
 
     def _headers__set(self, value):
@@ -712,6 +774,42 @@ class BaseRequest(object):
     def body(self):
         self.body = b''
 
+    @property
+    def body_buffer(self):
+        """
+        The content of the request body as a read-only ``memoryview``.
+
+        Unlike :attr:`body` this does not copy the body: a body held in
+        memory is viewed in place, and a body that was spooled to a
+        temporary file (see ``request_body_tempfile_limit``) is memory-mapped.
+        Use it to hash or scan large bodies, e.g.
+        ``hashlib.sha256(req.body_buffer)``.
+
+        The view must be released (or dropped) before the body is changed.
+        """
+        if not self.is_body_readable:
+            return memoryview(b'')
+
+        self.make_body_seekable() # we need this to have content_length
+        clen = self.content_length
+        f = self.body_file_raw
+
+        getbuffer = getattr(f, 'getbuffer', None)
+        if getbuffer is not None:
+            return _readonly(getbuffer()[:clen])
+
+        try:
+            fileno = f.fileno()
+        except (AttributeError, IOError, ValueError):
+            fileno = None
+        # mmap objects don't support memoryview on Python 2
+        if fileno is not None and clen and not PY2:
+            f.flush()
+            mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+            return memoryview(mapped)[:clen]
+
+        return memoryview(self.body)
+
     def _json_body__get(self):
         """Access the body of the request as JSON"""
         return json.loads(self.body.decode(self.charset))
@@ -780,24 +878,31 @@ class BaseRequest(object):
         self.make_body_seekable()
         self.body_file_raw.seek(0)
 
-        fs_environ = env.copy()
-        # FieldStorage assumes a missing CONTENT_LENGTH, but a
-        # default of 0 is better:
-        fs_environ.setdefault('CONTENT_LENGTH', '0')
-        fs_environ['QUERY_STRING'] = ''
-        if PY2:
-            fs = cgi_FieldStorage(
-                fp=self.body_file,
-                environ=fs_environ,
-                keep_blank_values=True)
+        if content_type == 'multipart/form-data':
+            parser = MultipartParser(
+                self.body_file,
+                parse_boundary(self._content_type_raw),
+                charset='utf8')
+            vars = parser.parse()
         else:
-            fs = cgi_FieldStorage(
-                fp=self.body_file,
-                environ=fs_environ,
-                keep_blank_values=True,
-                encoding='utf8')
+            fs_environ = env.copy()
+            # FieldStorage assumes a missing CONTENT_LENGTH, but a
+            # default of 0 is better:
+            fs_environ.setdefault('CONTENT_LENGTH', '0')
+            fs_environ['QUERY_STRING'] = ''
+            if PY2:
+                fs = cgi_FieldStorage(
+                    fp=self.body_file,
+                    environ=fs_environ,
+                    keep_blank_values=True)
+            else:
+                fs = cgi_FieldStorage(
+                    fp=self.body_file,
+                    environ=fs_environ,
+                    keep_blank_values=True,
+                    encoding='utf8')
 
-        vars = MultiDict.from_fieldstorage(fs)
+            vars = IndexedMultiDict.from_fieldstorage(fs)
         env['webob._parsed_post_vars'] = (vars, self.body_file_raw)
         return vars
 
@@ -806,6 +911,10 @@ class BaseRequest(object):
         """
         Return a MultiDict containing all the variables from the
         QUERY_STRING.
+
+        Names and values are decoded as they're first looked up, and changes
+        are written back to ``QUERY_STRING``; see
+        :class:`~webob.multidict.GetDict`.
         """
         env = self.environ
         source = env.get('QUERY_STRING', '')
@@ -814,15 +923,10 @@ class BaseRequest(object):
             if qs == source:
                 return vars
 
-        data = []
-        if source:
-            # this is disabled because we want to access req.GET
-            # for text/plain; charset=ascii uploads for example
-            #self._check_charset()
-            data = parse_qsl_text(source)
-            #d = lambda b: b.decode('utf8')
-            #data = [(d(k), d(v)) for k,v in data]
-        vars = GetDict(data, env)
+        # this is disabled because we want to access req.GET
+        # for text/plain; charset=ascii uploads for example
+        #self._check_charset()
+        vars = GetDict.from_query_string(source, env)
         env['webob._parsed_query_vars'] = (vars, source)
         return vars
 
@@ -886,7 +990,9 @@ class BaseRequest(object):
     def is_body_readable(self):
         """
         webob.is_body_readable is a flag that tells us that we can read the
-        input stream even though CONTENT_LENGTH is missing.
+        input stream even though CONTENT_LENGTH is missing.  The same goes
+        for servers that set ``wsgi.input_terminated``, and for chunked
+        bodies that ``body_file`` decodes (see ``decode_chunked_body``).
         """
 
         clen = self.content_length
@@ -894,8 +1000,13 @@ class BaseRequest(object):
         if clen is not None and clen != 0:
             return True
         elif clen is None:
-            # rely on the special flag
-            return self.environ.get('webob.is_body_readable', False)
+            # rely on the special flags
+            env = self.environ
+            return bool(
+                env.get('webob.is_body_readable', False) or
+                env.get('wsgi.input_terminated', False) or
+                self._body_chunked
+            )
 
         return False
 
@@ -915,8 +1026,12 @@ class BaseRequest(object):
 
         The choice to copy to BytesIO is made from
         ``self.request_body_tempfile_limit``
+
+        If ``decompress_body`` is set, a compressed body is decompressed
+        along the way; ``Content-Length`` is then the decompressed length and
+        the ``Content-Encoding`` header is removed.
         """
-        if self.is_body_seekable:
+        if self.is_body_seekable and not self._body_compression:
             self.body_file_raw.seek(0)
         else:
             self.copy_body()
@@ -931,51 +1046,99 @@ class BaseRequest(object):
         """
 
         if self.is_body_readable:
+            encoding = self._body_compression
+            chunked = self._body_chunked
+
             # Before we copy, if we can, rewind the body file
             if self.is_body_seekable:
                 self.body_file_raw.seek(0)
+                if encoding:
+                    # start decompressing from the beginning too
+                    self.environ.pop('webob._body_file', None)
 
             tempfile_limit = self.request_body_tempfile_limit
-            todo = self.content_length if self.content_length is not None else 65535
+            readinto = _make_readinto(self.body_file)
+            if encoding:
+                # Content-Length is the compressed size; we read until the
+                # decompressed stream ends.
+                clen = None
+            else:
+                clen = self.content_length
 
-            newbody = b''
             fileobj = None
-            input = self.body_file
 
-            while todo > 0:
-                data = input.read(min(todo, 65535))
-
-                if not data and self.content_length is None:
-                    # We attempted to read more data, but got none, break.
-                    # This can happen if for instance we are reading as much as
-                    # we can because we don't have a Content-Length...
-                    break
-                elif not data:
-                    # We have a Content-Length and we attempted to read, but
-                    # there was nothing more to read. Oh the humanity! This
-                    # should rarely if never happen because self.body_file
-                    # should be a LimitedLengthFile which should already have
-                    # raised if there was less data than expected.
-                    raise DisconnectionError(
-                        "Client disconnected (%s more bytes were expected)" % todo
-                    )
-
-                if fileobj:
-                    fileobj.write(data)
+            if clen is not None and clen <= tempfile_limit:
+                # The whole body fits in memory and we know its size, so read
+                # it straight into a buffer of the right size.
+                newbody = bytearray(clen)
+                view = memoryview(newbody)
+                pos = 0
+                while pos < clen:
+                    n = readinto(view[pos:pos + _COPY_BLOCK_SIZE])
+                    if not n:
+                        # We have a Content-Length and we attempted to read,
+                        # but there was nothing more to read. Oh the
+                        # humanity! This should rarely if never happen
+                        # because self.body_file should be a
+                        # LimitedLengthFile which should already have raised
+                        # if there was less data than expected.
+                        raise DisconnectionError(
+                            "Client disconnected (%s more bytes were expected)"
+                            % (clen - pos)
+                        )
+                    pos += n
+            else:
+                chunk = memoryview(bytearray(_COPY_BLOCK_SIZE))
+                todo = clen
+                if clen is None:
+                    # Without a Content-Length we buffer in memory until we
+                    # cross the tempfile limit.
+                    newbody = bytearray()
                 else:
-                    newbody += data
+                    # We already know we're going to need a file.
+                    newbody = None
+                    fileobj = self.make_tempfile()
 
-                    # When we have enough data that we need a tempfile, let's
-                    # create one, then clear the temporary variable we were
-                    # using
-                    if len(newbody) > tempfile_limit:
-                        fileobj = self.make_tempfile()
-                        fileobj.write(newbody)
-                        newbody = b''
-
-                # Only decrement todo if Content-Length is set
-                if self.content_length is not None:
-                    todo -= len(data)
+                while todo is None or todo > 0:
+                    if todo is None:
+                        n = readinto(chunk)
+                    else:
+                        n = readinto(chunk[:min(todo, _COPY_BLOCK_SIZE)])
+
+                    if not n and todo is None:
+                        # We attempted to read more data, but got none,
+                        # break. This can happen if for instance we are
+                        # reading as much as we can because we don't have a
+                        # Content-Length...
+                        break
+                    elif not n:
+                        raise DisconnectionError(
+                            "Client disconnected (%s more bytes were expected)"
+                            % todo
+                        )
+
+                    if fileobj:
+                        fileobj.write(chunk[:n])
+                    else:
+                        newbody += chunk[:n]
+
+                        # When we have enough data that we need a tempfile,
+                        # let's create one and hand over what we buffered so
+                        # far.
+                        if len(newbody) > tempfile_limit:
+                            fileobj = self.make_tempfile()
+                            fileobj.write(newbody)
+                            newbody = None
+
+                    if todo is not None:
+                        todo -= n
+
+            if encoding:
+                # What we store from here on is no longer encoded
+                del self.environ['HTTP_CONTENT_ENCODING']
+            if chunked:
+                # ... nor chunked; it gets a Content-Length below
+                del self.environ['HTTP_TRANSFER_ENCODING']
 
             if fileobj:
                 # We apparently had enough data to need a file
@@ -998,7 +1161,7 @@ class BaseRequest(object):
             else:
                 # No file created, set the body and let it deal with creating
                 # Content-Length and other vars.
-                self.body = newbody
+                self.body = bytes(newbody)
         else:
             # Always leave the request with a valid body, and this is pretty
             # cheap.
@@ -1008,6 +1171,9 @@ class BaseRequest(object):
         """
             Create a tempfile to store big request body.
             This API is not stable yet. A 'size' argument might be added.
+
+            Files with a ``fileno()`` can be memory-mapped by
+            :attr:`body_buffer`; others are read back into memory.
         """
         return tempfile.TemporaryFile()
 
@@ -1506,11 +1672,208 @@ class DisconnectionError(IOError):
     pass
 
 
+_COPY_BLOCK_SIZE = 1 << 16
+
+
+def _readonly(view):
+    toreadonly = getattr(view, 'toreadonly', None)
+    if toreadonly is not None:
+        return toreadonly()
+    return view
+
+
+def _make_readinto(fileobj):
+    """
+    Return a ``readinto(buffer)`` function for ``fileobj``, falling back to
+    ``read()`` for file-like objects that don't provide ``readinto``.
+    """
+    readinto = getattr(fileobj, 'readinto', None)
+    if readinto is not None:
+        return readinto
+
+    def readinto(buff):
+        data = fileobj.read(len(buff))
+        sz = len(data)
+        buff[:sz] = data
+        return sz
+    return readinto
+
+
+class ChunkedFile(io.RawIOBase):
+    """
+    Decodes a ``Transfer-Encoding: chunked`` stream read from ``file``.
+
+    Every read returns data from at most one chunk, so the memory used per
+    read is bounded by the size of the caller's buffer.  ``length`` counts
+    the decoded bytes read so far; once the last chunk has been read, it is
+    the length of the whole body, and ``trailers`` holds the trailer header
+    lines that followed it.
+    """
+    max_line_length = 4096
+
+    def __init__(self, file):
+        self.file = file
+        self.length = 0
+        self.trailers = []
+        self.done = False
+        self._remaining = 0
+        self._readinto = _make_readinto(file)
+
+    def __repr__(self):
+        return '<%s(%r)>' % (self.__class__.__name__, self.file)
+
+    @staticmethod
+    def readable():
+        return True
+
+    def _readline(self):
+        line = self.file.readline(self.max_line_length + 1)
+        if not line:
+            raise DisconnectionError(
+                "The client disconnected while sending a chunked body")
+        if not line.endswith(b'\n'):
+            raise ValueError("Invalid chunked body: line too long")
+        return line.rstrip(b'\r\n')
+
+    def readinto(self, buff):
+        if self.done:
+            return 0
+        if not self._remaining:
+            line = self._readline()
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise ValueError("Invalid chunk size: %r" % line)
+            if size < 0:
+                raise ValueError("Invalid chunk size: %r" % line)
+            if not size:
+                while True:
+                    line = self._readline()
+                    if not line:
+                        break
+                    self.trailers.append(line)
+                self.done = True
+                return 0
+            self._remaining = size
+        sz0 = min(len(buff), self._remaining)
+        sz = self._readinto(memoryview(buff)[:sz0])
+        if not sz:
+            raise DisconnectionError(
+                "The client disconnected while sending the body "
+                "(%d more bytes of the chunk were expected)"
+                % (self._remaining,)
+            )
+        self._remaining -= sz
+        self.length += sz
+        if not self._remaining and self._readline():
+            raise ValueError("Invalid chunked body: missing chunk terminator")
+        return sz
+
+
+class DecompressionError(ValueError):
+    pass
+
+
+_DECOMPRESS_WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'x-gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+class DecompressingFile(io.RawIOBase):
+    """
+    Wraps a file, decompressing the ``gzip`` or ``deflate`` encoded data
+    read from it.
+
+    ``compressed`` and ``decompressed`` count the bytes read from the file
+    and returned so far.  Output is produced at most one buffer at a time,
+    and if ``max_ratio`` is set a :exc:`DecompressionError` is raised as
+    soon as more than ``max_ratio`` times as many bytes have been
+    decompressed as were read.
+    """
+    block_size = 1 << 16
+
+    def __init__(self, file, encoding, max_ratio=None):
+        self.file = file
+        self.encoding = encoding
+        self.max_ratio = max_ratio
+        self.compressed = 0
+        self.decompressed = 0
+        self._wbits = _DECOMPRESS_WBITS[encoding]
+        self._decompressor = zlib.decompressobj(self._wbits)
+        self._tail = b''
+        self._out = b''
+        self._eof = False
+
+    def __repr__(self):
+        return '<%s(%r, encoding=%r)>' % (
+            self.__class__.__name__,
+            self.file,
+            self.encoding
+        )
+
+    @staticmethod
+    def readable():
+        return True
+
+    def _decompress(self, data, size):
+        try:
+            return self._decompressor.decompress(data, size)
+        except zlib.error as e:
+            if (self._wbits > 0 and not self.decompressed
+                    and self.encoding == 'deflate'):
+                # Plenty of clients send raw deflate data instead of the
+                # zlib format that HTTP asks for.
+                self._wbits = -zlib.MAX_WBITS
+                self._decompressor = zlib.decompressobj(self._wbits)
+                return self._decompress(data, size)
+            raise DecompressionError(
+                "Invalid %s encoded request body: %s" % (self.encoding, e))
+
+    def _check_complete(self):
+        # Python 2 can't tell whether the stream was complete
+        if self.compressed and not getattr(self._decompressor, 'eof', True):
+            raise DecompressionError(
+                "Truncated %s encoded request body" % self.encoding)
+
+    def readinto(self, buff):
+        size = len(buff)
+        out = self._out
+        while not out and size:
+            if self._tail:
+                data = self._tail
+            elif self._eof:
+                break
+            else:
+                data = self.file.read(self.block_size)
+                if not data:
+                    self._eof = True
+                    out = self._decompressor.flush()
+                    self._check_complete()
+                    break
+                self.compressed += len(data)
+            out = self._decompress(data, size)
+            self._tail = self._decompressor.unconsumed_tail
+        sz = min(len(out), size)
+        buff[:sz] = out[:sz]
+        self._out = out[sz:]
+        self.decompressed += sz
+        if (self.max_ratio is not None and
+                self.decompressed > self.max_ratio * self.compressed):
+            raise DecompressionError(
+                "Request body decompresses to more than %s times its "
+                "compressed size" % self.max_ratio)
+        return sz
+
+
 class LimitedLengthFile(io.RawIOBase):
     def __init__(self, file, maxlen):
         self.file = file
         self.maxlen = maxlen
         self.remaining = maxlen
+        # read straight into the caller's buffer if the input supports it
+        self._readinto = getattr(file, 'readinto', None)
 
     def __repr__(self):
         return '<%s(%r, maxlen=%s)>' % (
@@ -1530,6 +1893,17 @@ class LimitedLengthFile(io.RawIOBase):
         if not self.remaining:
             return 0
         sz0 = min(len(buff), self.remaining)
+        if self._readinto is not None:
+            # a short read is fine here (the caller will simply ask again),
+            # but no data at all means the input was exhausted
+            sz = self._readinto(memoryview(buff)[:sz0]) or 0
+            self.remaining -= sz
+            if not sz:
+                raise DisconnectionError(
+                    "The client disconnected while sending the body "
+                    "(%d more bytes were expected)" % (self.remaining,)
+                )
+            return sz
         data = self.file.read(sz0)
         sz = len(data)
         self.remaining -= sz
@@ -1707,28 +2081,16 @@ class Transcoder(object):
 
         return url_encode(q)
 
-    def transcode_fs(self, fs, content_type):
-        # transcode FieldStorage
-        if PY2:
-            def decode(b):
-                if b is not None:
-                    return b.decode(self.charset, self.errors)
-                else:
-                    return b
-        else:
-            def decode(b):
-                return b
-
+    def transcode_parts(self, parts, content_type):
+        # transcode MultipartPart objects; they are already decoded using
+        # the source charset
         data = []
-        for field in fs.list or ():
-            field.name = decode(field.name)
-            if field.filename:
-                field.filename = decode(field.filename)
-                data.append((field.name, field))
+        for part in parts:
+            if part.is_file:
+                data.append((part.name, part))
             else:
-                data.append((field.name, decode(field.value)))
+                data.append((part.name, part.value))
 
-        # TODO: transcode big requests to temp file
         content_type, fout = _encode_multipart(
             data,
             content_type,
@@ -1,11 +1,17 @@
 from base64 import b64encode
+from binascii import hexlify
 from datetime import (
     datetime,
     timedelta,
     )
-from hashlib import md5
+from fnmatch import fnmatchcase
+import hashlib
+from hashlib import (
+    md5,
+    sha1,
+    )
+import os
 import re
-import struct
 import zlib
 try:
     import simplejson as json
@@ -14,6 +20,16 @@ except ImportError:
 
 from webob.byterange import ContentRange
 
+from webob.compression import (
+    DEFAULT_LEVEL,
+    PARALLEL_BLOCK_SIZE,
+    GzipEncoder,
+    encode_app_iter,
+    encode_parallel,
+    encoders,
+    negotiate_encoding,
+    )
+
 from webob.cachecontrol import (
     CacheControl,
     serialize_cache_control,
@@ -23,6 +39,7 @@ from webob.compat import (
     PY2,
     bytes_,
     native_,
+    string_types,
     text_type,
     url_quote,
     urlparse,
@@ -34,6 +51,7 @@ from webob.cookies import (
     )
 
 from webob.datetime_utils import (
+    parse_date,
     parse_date_delta,
     serialize_date_delta,
     timedelta_to_seconds,
@@ -57,17 +75,23 @@ from webob.descriptors import (
     serialize_int,
     )
 
-from webob.headers import ResponseHeaders
+from webob.etag import ETagMatcher
+
+from webob.headers import (
+    HeaderList,
+    ResponseHeaders,
+    )
 from webob.request import BaseRequest
 from webob.util import status_reasons, status_generic_reasons, warn_deprecation
 
 __all__ = ['Response']
 
+# the most request URIs a relative Location is kept absolutized for
+_LOCATION_CACHE_SIZE = 100
+
 _PARAM_RE = re.compile(r'([a-z0-9]+)=(?:"([^"]*)"|([a-z0-9_.-]*))', re.I)
 _OK_PARAM_RE = re.compile(r'^[a-z0-9_.-]+$', re.I)
 
-_gzip_header = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
-
 _marker = object()
 
 class Response(object):
@@ -158,6 +182,48 @@ class Response(object):
     * ``default_body_encoding`` is set to 'UTF-8' by default. It exists to
       allow users to get/set the ``Response`` object using ``.text``, even if
       no ``charset`` has been set for the ``Content-Type``.
+
+    * ``default_compression_level`` (6) and ``default_compression_strategy``
+      are the zlib settings :meth:`~Response.encode_content` uses when it
+      isn't given any.
+
+    * ``compress_encodings``, ``compressible_types`` and
+      ``compress_min_size`` decide what :meth:`~Response.encode_content_for`
+      compresses: the content codings to offer, in order of preference, the
+      content types (``fnmatch`` patterns, or ``None`` for any) and the
+      smallest ``Content-Length`` worth compressing.
+
+    * ``parallel_compression_threshold`` is ``None`` by default. Set it to
+      a number of bytes to have :meth:`~Response.encode_content` compress
+      bodies at least that large with
+      :func:`webob.compression.encode_parallel`, in blocks of
+      ``parallel_compression_block_size`` bytes using
+      ``parallel_compression_pool`` (``None`` for a shared default pool).
+
+    * ``compression_cache`` is ``None`` by default. Set it to a
+      :class:`webob.compression.CompressionCache` to have
+      :meth:`~Response.encode_content` reuse bodies it compressed before.
+      They are looked up by strong ``ETag`` (with the ``Content-Type`` and
+      ``Content-Length``) if the response has one, otherwise by a digest of
+      the body; responses without a strong ``ETag`` are only cached when
+      they're compressed eagerly.
+
+    * ``max_ranges`` (50) is the largest number of ranges
+      :meth:`~Response.conditional_response_app` serves as a
+      ``multipart/byteranges`` body, after merging overlapping and adjacent
+      ones; a request for more gets the whole body.
+
+    * ``write_block_size`` (64 KiB) is the size small chunks written with
+      :meth:`~Response.write` are joined into, so the ``app_iter`` doesn't
+      end up with thousands of tiny chunks; the ones written after the last
+      full block are joined when the ``app_iter`` or ``body`` is read.  Set
+      it to ``0`` to keep every chunk as written.
+
+    * ``cache_headerlist`` is ``False`` by default.  If true, the header
+      list passed to ``start_response`` is computed once and reused by
+      every call until the headers change, with relative ``Location``
+      headers made absolute once per request URI.  This is meant for
+      responses that are created once and served many times.
     """
 
     default_content_type = 'text/html'
@@ -165,6 +231,28 @@ class Response(object):
     unicode_errors = 'strict'
     default_conditional_response = False
     default_body_encoding = 'UTF-8'
+    default_compression_level = DEFAULT_LEVEL
+    default_compression_strategy = zlib.Z_DEFAULT_STRATEGY
+    compress_encodings = ('gzip', 'deflate')
+    compressible_types = (
+        'text/*',
+        'application/javascript',
+        'application/json',
+        'application/xml',
+        'application/*+json',
+        'application/*+xml',
+        'image/svg+xml',
+        )
+    compress_min_size = 256
+    parallel_compression_threshold = None
+    parallel_compression_block_size = PARALLEL_BLOCK_SIZE
+    parallel_compression_pool = None
+    compression_cache = None
+    max_ranges = 50
+    write_block_size = 1 << 16
+    _write_state = None
+    cache_headerlist = False
+    _headerlist_cache = None
 
     # These two are only around so that when people pass them into the
     # constructor they correctly get saved and set, however they are not used
@@ -207,9 +295,11 @@ class Response(object):
         # Initialize headers
         self._headers = None
         if headerlist is None:
-            self._headerlist = []
-        else:
+            self._headerlist = HeaderList()
+        elif isinstance(headerlist, HeaderList):
             self._headerlist = headerlist
+        else:
+            self._headerlist = HeaderList(headerlist)
 
         # Set the encoding for the Response to charset, so if a charset is
         # passed but the Content-Type does not allow for a charset, we can
@@ -313,12 +403,7 @@ class Response(object):
             app_iter = [body]
 
             if headerlist is not None:
-                self._headerlist[:] = [
-                    (k, v)
-                    for (k, v)
-                    in self._headerlist
-                    if k.lower() != 'content-length'
-                ]
+                self._headerlist.remove_all('content-length')
             self._headerlist.append(('Content-Length', str(len(body))))
         elif app_iter is None and not code_has_body:
             app_iter = [b'']
@@ -478,15 +563,18 @@ class Response(object):
     def _headerlist__get(self):
         """
         The list of response headers.
+
+        This is a :class:`~webob.headers.HeaderList`, which indexes the
+        headers by name; lists assigned to it are copied into one.
         """
         return self._headerlist
 
     def _headerlist__set(self, value):
         self._headers = None
-        if not isinstance(value, list):
+        if not isinstance(value, HeaderList):
             if hasattr(value, 'items'):
                 value = value.items()
-            value = list(value)
+            value = HeaderList(value)
         self._headerlist = value
 
     def _headerlist__del(self):
@@ -686,17 +774,60 @@ class Response(object):
                        "been set")
                 raise TypeError(msg)
             text = text.encode(self.charset)
-        app_iter = self._app_iter
-        if not isinstance(app_iter, list):
-            try:
-                new_app_iter = self._app_iter = list(app_iter)
-            finally:
-                iter_close(app_iter)
-            app_iter = new_app_iter
-            self.content_length = sum(len(chunk) for chunk in app_iter)
+        # not self._app_iter, which would join the pending chunks each time
+        app_iter = self._raw_app_iter
+        state = self._write_state
+        if (state is None or state.app_iter is not app_iter or
+                state.chunks != len(app_iter)):
+            if not isinstance(app_iter, list):
+                try:
+                    new_app_iter = self._app_iter = list(app_iter)
+                finally:
+                    iter_close(app_iter)
+                app_iter = new_app_iter
+                self.content_length = sum(len(chunk) for chunk in app_iter)
+            state = self._write_state = _WriteState(app_iter)
+        size = len(text)
         app_iter.append(text)
+        state.size += size
+        block_size = self.write_block_size
+        if block_size and size < block_size:
+            # join runs of small chunks into one once they fill a block;
+            # every byte is copied at most once
+            state.pending += 1
+            state.pending_size += size
+            if state.pending_size >= block_size:
+                state.join_pending()
+        else:
+            state.pending = state.pending_size = 0
+        state.chunks = len(app_iter)
         if self.content_length is not None:
-            self.content_length += len(text)
+            self.content_length += size
+
+    def _written_size(self):
+        # the length of a list app_iter; O(1) if it was built by write()
+        app_iter = self._raw_app_iter
+        state = self._write_state
+        if (state is not None and state.app_iter is app_iter and
+                state.chunks == len(app_iter)):
+            return state.size
+        return sum([len(chunk) for chunk in app_iter])
+
+    def _joined_app_iter(self):
+        # the app_iter, with the small chunks write() has added since the
+        # last full block joined into one
+        app_iter = self._raw_app_iter
+        state = self._write_state
+        if (state is not None and state.pending > 1 and
+                state.app_iter is app_iter and
+                state.chunks == len(app_iter)):
+            state.join_pending()
+        return app_iter
+
+    def _set_raw_app_iter(self, value):
+        self._raw_app_iter = value
+
+    _app_iter = property(_joined_app_iter, _set_raw_app_iter)
 
     #
     # app_iter
@@ -1224,25 +1355,144 @@ class Response(object):
     # encode_content, decode_content, md5_etag
     #
 
-    def encode_content(self, encoding='gzip', lazy=False):
+    def encode_content(self, encoding='gzip', lazy=False, level=None,
+                       strategy=None, flush_every=None, flush_bytes=None,
+                       flush_interval=None):
         """
-        Encode the content with the given encoding (only ``gzip`` and
-        ``identity`` are supported).
+        Encode the content with the given encoding: ``identity`` or one of
+        the content codings in :data:`webob.compression.encoders` (``gzip``
+        and ``deflate`` unless others were registered).
+
+        ``level`` and ``strategy`` are the zlib compression level and
+        strategy, defaulting to ``default_compression_level`` and
+        ``default_compression_strategy``.  If ``lazy`` is true the body is
+        compressed as the ``app_iter`` is consumed; the ``flush_*``
+        arguments then make compressed data go out as the ``app_iter``
+        produces it instead of once zlib has filled a block (see
+        :func:`webob.compression.encode_app_iter`).
         """
-        assert encoding in ('identity', 'gzip'), \
+        assert encoding == 'identity' or encoding in encoders, \
             "Unknown encoding: %r" % encoding
         if encoding == 'identity':
             self.decode_content()
             return
-        if self.content_encoding == 'gzip':
+        if self.content_encoding == encoding:
             return
+        if self.content_encoding:
+            self.decode_content()
+        if level is None:
+            level = self.default_compression_level
+        if strategy is None:
+            strategy = self.default_compression_strategy
+        cache = self.compression_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = self._compression_cache_key(lazy)
+        if cache_key is not None:
+            cache_key += (encoding, level, strategy)
+            chunks = cache.get(cache_key)
+            if chunks is not None:
+                iter_close(self._app_iter)
+                self.app_iter = list(chunks)
+                self.content_length = sum(map(len, chunks))
+                self.content_encoding = encoding
+                return
+        threshold = self.parallel_compression_threshold
+        if (not lazy and threshold is not None and
+                encoding in ('gzip', 'deflate')):
+            body = self.body
+            if len(body) >= threshold:
+                self.app_iter = encode_parallel(
+                    body, encoding, level=level, strategy=strategy,
+                    block_size=self.parallel_compression_block_size,
+                    pool=self.parallel_compression_pool)
+                self.content_length = sum(map(len, self._app_iter))
+                self.content_encoding = encoding
+                if cache_key is not None:
+                    cache.set(cache_key, self._app_iter)
+                return
+        app_iter = encode_app_iter(
+            self._app_iter, encoders[encoding](level=level, strategy=strategy),
+            flush_every=flush_every, flush_bytes=flush_bytes,
+            flush_interval=flush_interval)
         if lazy:
-            self.app_iter = gzip_app_iter(self._app_iter)
+            if cache_key is not None:
+                app_iter = cache.store_iter(cache_key, app_iter)
+            self.app_iter = app_iter
             self.content_length = None
         else:
-            self.app_iter = list(gzip_app_iter(self._app_iter))
+            self.app_iter = list(app_iter)
             self.content_length = sum(map(len, self._app_iter))
-        self.content_encoding = 'gzip'
+            if cache_key is not None:
+                cache.set(cache_key, self._app_iter)
+        self.content_encoding = encoding
+
+    def _compression_cache_key(self, lazy):
+        # An ETag only identifies a body among the representations of one
+        # resource, so the type and length are part of the key too.
+        etag = self.etag_strong
+        if etag is not None:
+            return ('etag', etag, self.headers.get('Content-Type'),
+                    self.content_length)
+        if lazy:
+            return None
+        return ('sha1', sha1(self.body).digest())
+
+    def encode_content_for(self, request, lazy=False, level=None,
+                           strategy=None, flush_every=None, flush_bytes=None,
+                           flush_interval=None):
+        """
+        Compress the content with the best of ``compress_encodings`` that
+        ``request`` accepts, if the response is worth compressing, and
+        return the content coding used (or ``None``).  The other arguments
+        are passed to :meth:`encode_content`.
+
+        Responses that already have a ``Content-Encoding``, have no body,
+        are marked ``Cache-Control: no-transform``, have a content type not
+        matching ``compressible_types`` or a ``Content-Length`` below
+        ``compress_min_size`` are left alone.  Otherwise
+        ``Vary: Accept-Encoding`` is added, whether or not the request
+        accepts any of the codings.
+        """
+        if not self._compressible():
+            return None
+        vary = self.vary or ()
+        if 'accept-encoding' not in [v.lower() for v in vary]:
+            self.vary = tuple(vary) + ('Accept-Encoding',)
+        encoding = negotiate_encoding(
+            request.accept_encoding, self.compress_encodings)
+        if encoding is not None:
+            self.encode_content(encoding, lazy=lazy, level=level,
+                                strategy=strategy, flush_every=flush_every,
+                                flush_bytes=flush_bytes,
+                                flush_interval=flush_interval)
+        return encoding
+
+    def _compressible(self):
+        if self.content_encoding not in (None, 'identity'):
+            return False
+        status = self._status
+        if status[0] == '1' or status[:3] in ('204', '205', '304'):
+            return False
+        cache_control = self.headers.get('Cache-Control')
+        if cache_control and 'no-transform' in cache_control.lower():
+            return False
+        types = self.compressible_types
+        if types is not None:
+            content_type = self.content_type
+            if not content_type:
+                return False
+            content_type = content_type.lower()
+            for pattern in types:
+                if fnmatchcase(content_type, pattern):
+                    break
+            else:
+                return False
+        content_length = self.content_length
+        if (content_length is not None and
+                content_length < self.compress_min_size):
+            return False
+        return True
 
     def decode_content(self):
         content_encoding = self.content_encoding or 'identity'
@@ -1282,6 +1532,53 @@ class Response(object):
         if set_content_md5:
             self.content_md5 = md5_digest
 
+    def digest_etag(self, algorithm='md5', max_buffer=1 << 20):
+        """
+        Generate a strong etag for the response object from a digest of the
+        body, hashing the ``app_iter`` chunk by chunk instead of joining it
+        into ``self.body``.  ``algorithm`` is a :mod:`hashlib` algorithm
+        name (``'sha256'``, ``'blake2b'``...) or constructor.
+
+        The chunks are kept as the new ``app_iter``, but only up to
+        ``max_buffer`` bytes (``None`` for no limit).  For a larger body
+        the ``app_iter`` is left to stream the rest, and the etag is a weak
+        one computed from the digest of the first ``max_buffer`` bytes, the
+        ``Content-Length`` and the ``Last-Modified`` date; without a
+        ``Last-Modified`` date two bodies could share all of that, so no
+        etag is set at all.
+
+        Sets ``self.etag``, and returns True if it's a strong one.  To get
+        a strong etag for a body of any size once it has been sent, use
+        :class:`DigestAppIter`.
+        """
+        app_iter = self._app_iter
+        content_length = self.content_length
+        hasher = _new_hash(algorithm)
+        chunks = []
+        size = 0
+        iterator = iter(app_iter)
+        for chunk in iterator:
+            chunks.append(chunk)
+            hasher.update(chunk)
+            size += len(chunk)
+            if max_buffer is not None and size > max_buffer:
+                break
+        else:
+            iter_close(app_iter)
+            self.app_iter = chunks
+            self.content_length = size
+            self.etag = _digest_etag(hasher.digest())
+            return True
+        self.app_iter = _ResumedAppIter(chunks, iterator, app_iter)
+        self.content_length = content_length
+        last_modified = self.headers.get('Last-Modified')
+        if last_modified is None:
+            self.etag = None
+            return False
+        hasher.update(bytes_('\n%s\n%s' % (content_length, last_modified)))
+        self.etag = (_digest_etag(hasher.digest()), False)
+        return False
+
     @staticmethod
     def _make_location_absolute(environ, value):
         if SCHEME_RE.search(value):
@@ -1292,12 +1589,41 @@ class Response(object):
 
     def _abs_headerlist(self, environ):
         # Build the headerlist, if we have a Location header, make it absolute
-        return [
-            (k, v) if k.lower() != 'location'
-            else (k, self._make_location_absolute(environ, v))
-            for (k, v)
-            in self._headerlist
-        ]
+        headerlist = self._headerlist
+        if self.cache_headerlist:
+            return self._cached_abs_headerlist(environ, headerlist)
+        result = list(headerlist)
+        for i in headerlist.positions('location'):
+            k, v = result[i]
+            result[i] = (k, self._make_location_absolute(environ, v))
+        return result
+
+    def _cached_abs_headerlist(self, environ, headerlist):
+        cache = self._headerlist_cache
+        if (cache is None or cache[0] is not headerlist or
+                cache[1] != headerlist.version):
+            relative = [i for i in headerlist.positions('location')
+                        if not SCHEME_RE.search(headerlist[i][1])]
+            cache = self._headerlist_cache = (
+                headerlist, headerlist.version, tuple(headerlist), relative,
+                {})
+        # always a new list: servers may add their own headers to it
+        result = list(cache[2])
+        if cache[3]:
+            # relative Locations, made absolute for each request URI
+            uri = _request_uri(environ)
+            locations = cache[4].get(uri)
+            if locations is None:
+                locations = [
+                    (i, (result[i][0],
+                         self._make_location_absolute(environ, result[i][1])))
+                    for i in cache[3]]
+                if len(cache[4]) >= _LOCATION_CACHE_SIZE:
+                    cache[4].clear()
+                cache[4][uri] = locations
+            for i, header in locations:
+                result[i] = header
+        return result
 
     #
     # __call__, conditional_response_app
@@ -1330,6 +1656,9 @@ class Response(object):
               ``HEAD``)
             * ``Range``               (``406 Partial Content``; only on ``GET``,
               ``HEAD``)
+
+        A ``Range`` header with several ranges is answered with a
+        ``multipart/byteranges`` body (see :class:`AppIterRanges`).
         """
         req = BaseRequest(environ)
 
@@ -1352,8 +1681,8 @@ class Response(object):
             self.status_code == 200 and
             self.content_length is not None
         ):
-            content_range = req.range.content_range(self.content_length)
-            if content_range is None:
+            ranges = req.range.ranges_for_length(self.content_length)
+            if not ranges:
                 iter_close(self._app_iter)
                 body = bytes_("Requested range not satisfiable: %s" % req.range)
                 headerlist = [
@@ -1367,13 +1696,12 @@ class Response(object):
                 if method == 'HEAD':
                     return ()
                 return [body]
-            else:
+            elif len(ranges) == 1:
+                content_range = ContentRange(ranges[0][0], ranges[0][1],
+                                             self.content_length)
                 app_iter = self.app_iter_range(content_range.start,
                                                content_range.stop)
                 if app_iter is not None:
-                    # the following should be guaranteed by
-                    # Range.range_for_length(length)
-                    assert content_range.start is not None
                     headerlist = [
                         ('Content-Length',
                          str(content_range.stop - content_range.start)),
@@ -1383,6 +1711,18 @@ class Response(object):
                     if method == 'HEAD':
                         return EmptyResponse(app_iter)
                     return app_iter
+            elif len(ranges) <= self.max_ranges:
+                app_iter = AppIterRanges(self._app_iter, ranges,
+                                         self.content_length,
+                                         self.headers.get('Content-Type'))
+                headerlist = [
+                    ('Content-Length', str(app_iter.content_length)),
+                    ('Content-Type', app_iter.content_type),
+                ] + filter_headers(headerlist)
+                start_response('206 Partial Content', headerlist)
+                if method == 'HEAD':
+                    return EmptyResponse(app_iter)
+                return app_iter
 
         start_response(self.status, headerlist)
         if method == 'HEAD':
@@ -1400,6 +1740,133 @@ class Response(object):
         return AppIterRange(app_iter, start, stop)
 
 
+class CannedResponse(object):
+    """
+    An immutable response, for replies served over and over again (health
+    checks, redirects, common errors).
+
+    The arguments are those of :class:`Response`; use
+    :meth:`from_response` to make one from an existing response instead.
+    The status, the header list and the body are computed once, when it's
+    created, so calling it costs little more than ``start_response``, and
+    it can be shared between threads.
+
+    If ``conditional_response`` is true it answers ``If-None-Match`` and
+    ``If-Modified-Since`` with a ``304 Not Modified``, like
+    :meth:`Response.conditional_response_app`; ``Range`` is ignored.
+    """
+
+    __slots__ = ('status', 'headerlist', 'body', 'etag', 'last_modified',
+                 'conditional_response', '_not_modified_headerlist',
+                 '_if_none_match', '_if_modified_since', '_locations',
+                 '_not_modified_locations', '_location_cache')
+
+    def __init__(self, *args, **kw):
+        self._init(Response(*args, **kw))
+
+    @classmethod
+    def from_response(cls, response):
+        """
+        Make a :class:`CannedResponse` with the status, headers, body and
+        ``conditional_response`` of ``response``, which isn't changed.
+        """
+        self = cls.__new__(cls)
+        self._init(response.copy())
+        return self
+
+    def _init(self, response):
+        set = object.__setattr__
+        body = response.body
+        headerlist = tuple(response.headerlist)
+        etag = response.etag
+        last_modified = response.last_modified
+        set(self, 'status', response.status)
+        set(self, 'headerlist', headerlist)
+        set(self, 'body', body)
+        set(self, 'etag', etag)
+        set(self, 'last_modified', last_modified)
+        set(self, 'conditional_response', response.conditional_response)
+        not_modified_headerlist = tuple(filter_headers(headerlist))
+        set(self, '_not_modified_headerlist', not_modified_headerlist)
+        # the header values that match exactly, to avoid parsing them
+        set(self, '_if_none_match', response.headers.get('ETag'))
+        set(self, '_if_modified_since', response.headers.get('Last-Modified'))
+        set(self, '_locations', _relative_locations(headerlist))
+        set(self, '_not_modified_locations',
+            _relative_locations(not_modified_headerlist))
+        set(self, '_location_cache', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError('%s is immutable' % self.__class__.__name__)
+
+    def __repr__(self):
+        return '<%s at 0x%x %s>' % (self.__class__.__name__, abs(id(self)),
+                                    self.status)
+
+    @property
+    def status_code(self):
+        return int(self.status.split(' ', 1)[0])
+
+    def _headers_for(self, environ, headerlist, positions):
+        # always a new list: servers may add their own headers to it
+        headerlist = list(headerlist)
+        if positions:
+            # relative Locations, made absolute for each request URI
+            uri = _request_uri(environ)
+            cache = self._location_cache
+            locations = cache.get(uri)
+            if locations is None:
+                locations = [
+                    Response._make_location_absolute(
+                        environ, headerlist[i][1])
+                    for i in positions]
+                if len(cache) >= _LOCATION_CACHE_SIZE:
+                    cache.clear()
+                cache[uri] = locations
+            for i, location in zip(positions, locations):
+                headerlist[i] = (headerlist[i][0], location)
+        return headerlist
+
+    def _not_modified(self, environ):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and self.etag:
+            return (if_none_match == self._if_none_match or self.etag in
+                    ETagMatcher.parse(if_none_match, strong=False))
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and self.last_modified:
+            if if_modified_since == self._if_modified_since:
+                return True
+            if_modified_since = parse_date(if_modified_since)
+            return bool(if_modified_since and
+                        self.last_modified <= if_modified_since)
+        return False
+
+    def __call__(self, environ, start_response):
+        """
+        WSGI application interface
+        """
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if (self.conditional_response and method in ('GET', 'HEAD') and
+                self._not_modified(environ)):
+            start_response('304 Not Modified', self._headers_for(
+                environ, self._not_modified_headerlist,
+                self._not_modified_locations))
+            return []
+        start_response(self.status, self._headers_for(
+            environ, self.headerlist, self._locations))
+        if method == 'HEAD':
+            return []
+        return [self.body]
+
+
+def _relative_locations(headerlist):
+    return [i for i, (k, v) in enumerate(headerlist)
+            if k.lower() == 'location' and not SCHEME_RE.search(v)]
+
+
 def filter_headers(hlist, remove_headers=('content-length', 'content-type')):
     return [h for h in hlist if (h[0].lower() not in remove_headers)]
 
@@ -1411,6 +1878,24 @@ def iter_file(file, block_size=1 << 18): # 256Kb
             break
         yield data
 
+class _WriteState(object):
+    # What Response.write knows about the list app_iter it appends to
+    __slots__ = ('app_iter', 'chunks', 'size', 'pending', 'pending_size')
+
+    def __init__(self, app_iter):
+        self.app_iter = app_iter
+        self.chunks = len(app_iter)
+        self.size = sum([len(chunk) for chunk in app_iter])
+        self.pending = self.pending_size = 0
+
+    def join_pending(self):
+        app_iter = self.app_iter
+        if self.pending > 1:
+            app_iter[-self.pending:] = [b''.join(app_iter[-self.pending:])]
+            self.chunks = len(app_iter)
+        self.pending = self.pending_size = 0
+
+
 class ResponseBodyFile(object):
     mode = 'wb'
     closed = False
@@ -1450,20 +1935,44 @@ class ResponseBodyFile(object):
         if not self.response.has_body:
             return 0
 
-        return sum([len(chunk) for chunk in self.response.app_iter])
+        return self.response._written_size()
 
 
 class AppIterRange(object):
     """
     Wraps an ``app_iter``, returning just a range of bytes.
+
+    The bytes before ``start`` aren't read if they can be skipped: a list
+    or tuple of chunks is indexed past them, and an ``app_iter`` with a
+    ``seek`` method (a file, for instance) is seeked to ``start``, relative
+    to where it's at; if it has a ``read`` method too it's read in blocks,
+    otherwise iterated from there.
     """
 
     def __init__(self, app_iter, start, stop):
         assert start >= 0, "Bad start: %r" % start
         assert stop is None or (stop >= 0 and stop >= start), (
             "Bad stop: %r" % stop)
-        self.app_iter = iter(app_iter)
+        self._app_iter = app_iter
         self._pos = 0 # position in app_iter
+        if start:
+            if isinstance(app_iter, (list, tuple)):
+                index = 0
+                for chunk in app_iter:
+                    if self._pos + len(chunk) > start:
+                        break
+                    self._pos += len(chunk)
+                    index += 1
+                app_iter = app_iter[index:]
+            elif _seekable(app_iter):
+                offset = start
+                if hasattr(app_iter, 'tell'):
+                    offset += app_iter.tell()
+                app_iter.seek(offset)
+                self._pos = start
+        if hasattr(app_iter, 'seek') and hasattr(app_iter, 'read'):
+            app_iter = iter_file(app_iter)
+        self.app_iter = iter(app_iter)
         self.start = start
         self.stop = stop
 
@@ -1505,6 +2014,152 @@ class AppIterRange(object):
 
     __next__ = next # py3
 
+    def close(self):
+        iter_close(self.app_iter)
+        if self._app_iter is not self.app_iter:
+            iter_close(self._app_iter)
+
+
+def _seekable(app_iter):
+    if not hasattr(app_iter, 'seek'):
+        return False
+    seekable = getattr(app_iter, 'seekable', None)
+    return seekable is None or seekable()
+
+
+class AppIterRanges(object):
+    """
+    Wraps an ``app_iter``, returning several ranges of bytes as a
+    ``multipart/byteranges`` body.
+
+    ``ranges`` are sorted, non-overlapping ``(start, stop)`` pairs of a
+    body ``length`` bytes long whose type is ``content_type``.  If the
+    ``app_iter`` has an ``app_iter_ranges`` method (like
+    :class:`webob.static.FileIter`), it's used to read just those bytes;
+    otherwise the ``app_iter`` is read once, dropping what's between the
+    ranges.  ``content_type`` and ``content_length`` are set to the headers
+    of the result.
+    """
+
+    def __init__(self, app_iter, ranges, length, content_type=None,
+                 boundary=None):
+        if boundary is None:
+            boundary = native_(hexlify(os.urandom(10)))
+        self.app_iter = app_iter
+        self.ranges = ranges
+        self.boundary = boundary
+        self.content_type = 'multipart/byteranges; boundary=%s' % boundary
+        self._part_headers = []
+        for start, stop in ranges:
+            headers = '--%s\r\n' % boundary
+            if self._part_headers:
+                headers = '\r\n' + headers
+            if content_type:
+                headers += 'Content-Type: %s\r\n' % content_type
+            headers += 'Content-Range: %s\r\n\r\n' % ContentRange(
+                start, stop, length)
+            self._part_headers.append(bytes_(headers, 'latin-1'))
+        self._end = bytes_('\r\n--%s--\r\n' % boundary)
+        self.content_length = (
+            sum(map(len, self._part_headers)) + len(self._end) +
+            sum([stop - start for start, stop in ranges]))
+
+    def __iter__(self):
+        if hasattr(self.app_iter, 'app_iter_ranges'):
+            parts = self.app_iter.app_iter_ranges(self.ranges)
+        else:
+            parts = _iter_ranges(self.app_iter, self.ranges)
+        part_headers = self._part_headers
+        current = -1
+        for index, chunk in parts:
+            while current < index:
+                current += 1
+                yield part_headers[current]
+            yield chunk
+        yield self._end
+
+    def close(self):
+        iter_close(self.app_iter)
+
+
+def _iter_ranges(app_iter, ranges):
+    # (index, chunk) pairs with the bytes of each range, in one pass
+    pos = 0
+    index = 0
+    count = len(ranges)
+    for chunk in app_iter:
+        end = pos + len(chunk)
+        while index < count and ranges[index][0] < end:
+            start, stop = ranges[index]
+            piece = chunk[max(start - pos, 0):stop - pos]
+            if piece:
+                yield index, piece
+            if stop > end:
+                break
+            index += 1
+        pos = end
+        if index == count:
+            return
+
+
+class DigestAppIter(object):
+    """
+    Wraps an ``app_iter``, hashing the chunks as they pass through.
+
+    ``algorithm`` is a :mod:`hashlib` algorithm name or constructor.  Once
+    the whole ``app_iter`` has been produced, ``digest`` is the digest and
+    ``etag`` a strong etag made from it, and ``callback`` (if given) is
+    called with the etag.  This doesn't hold on to the body, but the etag
+    is only known after the headers were sent; it can go into a cache, a
+    log or an HTTP trailer.
+    """
+
+    digest = None
+    etag = None
+
+    def __init__(self, app_iter, algorithm='md5', callback=None):
+        self.app_iter = app_iter
+        self._iter = iter(app_iter)
+        self._hash = _new_hash(algorithm)
+        self.callback = callback
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            chunk = next(self._iter)
+        except StopIteration:
+            if self.digest is None:
+                self.digest = self._hash.digest()
+                self.etag = _digest_etag(self.digest)
+                if self.callback is not None:
+                    self.callback(self.etag)
+            raise
+        self._hash.update(chunk)
+        return chunk
+
+    __next__ = next # py3
+
+    def close(self):
+        iter_close(self.app_iter)
+
+
+class _ResumedAppIter(object):
+    # The chunks already read from an app_iter followed by the rest of it
+
+    def __init__(self, chunks, iterator, app_iter):
+        self._chunks = chunks
+        self._iter = iterator
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield chunk
+        self._chunks = ()
+        for chunk in self._iter:
+            yield chunk
+
     def close(self):
         iter_close(self.app_iter)
 
@@ -1582,33 +2237,21 @@ def _request_uri(environ):
     return url
 
 
+def _new_hash(algorithm):
+    if isinstance(algorithm, string_types):
+        return hashlib.new(algorithm)
+    return algorithm()
+
+def _digest_etag(digest):
+    return native_(b64encode(digest)).strip('=')
+
 def iter_close(iter):
     if hasattr(iter, 'close'):
         iter.close()
 
-def gzip_app_iter(app_iter):
-    size = 0
-    crc = zlib.crc32(b"") & 0xffffffff
-    compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS,
-                                zlib.DEF_MEM_LEVEL, 0)
-
-    yield _gzip_header
-    for item in app_iter:
-        size += len(item)
-        crc = zlib.crc32(item, crc) & 0xffffffff
-
-        # The compress function may return zero length bytes if the input is
-        # small enough; it buffers the input for the next iteration or for a
-        # flush.
-        result = compress.compress(item)
-        if result:
-            yield result
-
-    # Similarly, flush may also not yield a value.
-    result = compress.flush()
-    if result:
-        yield result
-    yield struct.pack("<2L", crc, size & 0xffffffff)
+def gzip_app_iter(app_iter, level=DEFAULT_LEVEL,
+                  strategy=zlib.Z_DEFAULT_STRATEGY):
+    return encode_app_iter(app_iter, GzipEncoder(level, strategy))
 
 def _error_unicode_in_app_iter(app_iter, body):
     app_iter_repr = repr(app_iter)
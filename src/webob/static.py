@@ -1,12 +1,39 @@
+from collections import OrderedDict
+import hashlib
 import mimetypes
 import os
+from stat import (
+    S_ISDIR,
+    S_ISREG,
+    )
+import threading
+import time
+from wsgiref.simple_server import ServerHandler
+
+try:
+    from time import monotonic as _clock
+except ImportError: # pragma: no cover
+    from time import time as _clock
 
 from webob import exc
+from webob.compat import PY2
+from webob.compression import (
+    default_pool,
+    encode_app_iter,
+    encoders,
+    negotiate_encoding,
+    )
 from webob.dec import wsgify
-from webob.response import Response
+from webob.request import Request
+from webob.response import (
+    CannedResponse,
+    Response,
+    _digest_etag,
+    )
 
 __all__ = [
-    'FileApp', 'DirectoryApp',
+    'FileApp', 'DirectoryApp', 'SendfileIter', 'SendfileServerHandler',
+    'FileCache', 'StatCache', 'precompress',
 ]
 
 mimetypes._winreg = None # do not load mimetypes from windows registry
@@ -15,15 +42,52 @@ mimetypes.add_type('image/x-icon', '.ico') # not among defaults
 
 BLOCK_SIZE = 1<<16
 
+#: The ``(content coding, file suffix)`` pairs of the precompressed files
+#: :class:`DirectoryApp` looks for with ``precompressed=True``, in order of
+#: preference.
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+#: The files :func:`precompress` compresses by default.
+PRECOMPRESS_EXTENSIONS = ('.css', '.csv', '.html', '.js', '.json', '.map',
+                          '.mjs', '.svg', '.txt', '.xml')
+
 
 class FileApp(object):
     """An application that will send the file at the given filename.
 
     Adds a mime type based on `mimetypes.guess_type()`.
+
+    The file is sent with the server's ``wsgi.file_wrapper`` if there is
+    one, otherwise with a :class:`SendfileIter`.
+
+    Pass a :class:`StatCache` as ``stat_cache`` to avoid a ``stat`` (and,
+    without a ``wsgi.file_wrapper``, possibly an ``open``) for every
+    request.
+
+    ``etag_source`` chooses how the ``ETag`` is made, so conditional
+    requests can be answered with ``304 Not Modified``:
+
+    ``'stat'``
+        from the inode, size and modification time of the file.  The etag
+        is weak if the file was modified less than a second ago, as it may
+        still be changing without its modification time changing.
+    ``'content'``
+        from an MD5 digest of the contents.  It's computed once for every
+        version of the file and remembered until the file changes, in the
+        ``stat_cache`` if there's one.
+    ``None``
+        no ``ETag`` is sent.
+
+    An ``etag`` keyword argument sets a fixed ``ETag`` instead.
     """
 
-    def __init__(self, filename, **kw):
+    def __init__(self, filename, stat_cache=None, etag_source='stat', **kw):
+        if etag_source not in ('stat', 'content', None):
+            raise ValueError('Invalid etag_source: %r' % (etag_source,))
         self.filename = filename
+        self.stat_cache = stat_cache
+        self.etag_source = etag_source
+        self._content_etag_cache = None
         content_type, content_encoding = mimetypes.guess_type(filename)
         kw.setdefault('content_type', content_type)
         kw.setdefault('content_encoding', content_encoding)
@@ -37,30 +101,77 @@ class FileApp(object):
         if req.method not in ('GET', 'HEAD'):
             return exc.HTTPMethodNotAllowed("You cannot %s a file" %
                                             req.method)
+        stat_cache = self.stat_cache
         try:
-            stat = os.stat(self.filename)
+            if stat_cache is None:
+                stat = os.stat(self.filename)
+            else:
+                stat = stat_cache.stat(self.filename)
         except (IOError, OSError) as e:
             msg = "Can't open %r: %s" % (self.filename, e)
             return exc.HTTPNotFound(comment=msg)
 
+        file_wrapper = req.environ.get('wsgi.file_wrapper')
         try:
-            file = self._open(self.filename, 'rb')
+            etag = self._etag(stat)
+            if stat_cache is None or file_wrapper is not None:
+                # a server's file_wrapper may use the descriptor's offset,
+                # so it can't have a shared one
+                file = self._open(self.filename, 'rb')
+            else:
+                file = stat_cache.open(self.filename, self._open)
         except (IOError, OSError) as e:
             msg = "You are not permitted to view this file (%s)" % e
             return exc.HTTPForbidden(msg)
 
-        if 'wsgi.file_wrapper' in req.environ:
-            app_iter = req.environ['wsgi.file_wrapper'](file, BLOCK_SIZE)
+        if file_wrapper is not None:
+            app_iter = file_wrapper(file, BLOCK_SIZE)
         else:
-            app_iter = FileIter(file)
+            app_iter = SendfileIter(file)
 
-        return Response(
+        resp = Response(
             app_iter = app_iter,
             content_length = stat.st_size,
             last_modified = stat.st_mtime,
-            #@@ etag
             **self.kw
-        ).conditional_response_app
+        )
+        if etag is not None and 'etag' not in self.kw:
+            resp.etag = etag
+        return resp.conditional_response_app
+
+    def _etag(self, stat):
+        if self.etag_source is None:
+            return None
+        version = _file_version(stat)
+        if self.etag_source == 'stat':
+            etag = '%x-%x-%x' % version
+            if time.time() - stat.st_mtime < 1:
+                return (etag, False)
+            return etag
+        if self.stat_cache is not None:
+            return self.stat_cache.digest(self.filename, stat,
+                                          self._content_etag)
+        cached = self._content_etag_cache
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        etag = self._content_etag()
+        self._content_etag_cache = (version, etag)
+        return etag
+
+    def _content_etag(self):
+        md5 = hashlib.md5()
+        with self._open(self.filename, 'rb') as fp:
+            for block in iter(lambda: fp.read(BLOCK_SIZE), b''):
+                md5.update(block)
+        return _digest_etag(md5.digest())
+
+
+def _file_version(stat):
+    # what identifies the contents of a file without reading it
+    mtime_ns = getattr(stat, 'st_mtime_ns', None)
+    if mtime_ns is None: # pragma: no cover
+        mtime_ns = int(stat.st_mtime * 1000000000)
+    return (stat.st_ino, stat.st_size, mtime_ns)
 
 
 class FileIter(object):
@@ -104,6 +215,140 @@ class FileIter(object):
 
     __iter__ = app_iter_range
 
+    def app_iter_ranges(self, ranges, block_size=None):
+        """Iter over ``(index, data)`` pairs with the content of each of the
+        sorted ``(start, stop)`` ``ranges`` of the file.
+
+        This seeks to each range, so nothing is read twice or needlessly.
+        """
+
+        if block_size is None:
+            block_size = BLOCK_SIZE
+
+        try:
+            for index, (start, stop) in enumerate(ranges):
+                self.file.seek(start)
+                limit = stop - start
+                while limit > 0:
+                    data = self.file.read(min(block_size, limit))
+                    if not data:
+                        return
+                    yield index, data
+                    limit -= len(data)
+        finally:
+            self.file.close()
+
+
+
+class SendfileIter(FileIter):
+    """An ``app_iter`` for ``length`` bytes of a file from ``offset`` (to the
+    end of the file if ``length`` is None), that servers can send without
+    copying it through Python.
+
+    Iterating over it reads the file in blocks like :class:`FileIter`, but a
+    server that recognizes it can instead hand :meth:`fileno`, ``offset``
+    and ``length`` to ``os.sendfile``, or call :meth:`sendfile`.
+    :meth:`app_iter_range` returns another :class:`SendfileIter`, so Range
+    requests can be sent the same way.  :class:`SendfileServerHandler` is
+    such a server for :mod:`wsgiref`.
+    """
+
+    def __init__(self, file, offset=0, length=None, block_size=None):
+        self.file = file
+        self.offset = offset
+        self.length = length
+        self.block_size = block_size
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def __iter__(self):
+        stop = None
+        if self.length is not None:
+            stop = self.offset + self.length
+            if not self.length:
+                # FileIter takes a limit of 0 to mean the start of the file
+                self.file.close()
+                return iter(())
+        return FileIter.app_iter_range(self, self.offset, stop,
+                                       self.block_size)
+
+    def app_iter_range(self, seek=None, limit=None, block_size=None):
+        """Return a :class:`SendfileIter` for the bytes of this one from
+        ``seek`` up to ``limit``.
+        """
+        start = self.offset + (seek or 0)
+        stop = self.length
+        if limit is not None and (stop is None or limit < stop):
+            stop = limit
+        length = None
+        if stop is not None:
+            length = max(stop - (seek or 0), 0)
+        return self.__class__(self.file, start, length,
+                              block_size or self.block_size)
+
+    def app_iter_ranges(self, ranges, block_size=None):
+        offset = self.offset
+        return FileIter.app_iter_ranges(
+            self, [(start + offset, stop + offset) for start, stop in ranges],
+            block_size or self.block_size)
+
+    app_iter_ranges.__doc__ = FileIter.app_iter_ranges.__doc__
+
+    def close(self):
+        self.file.close()
+
+    def sendfile(self, out):
+        """Send the bytes to the file descriptor or socket ``out`` with
+        ``os.sendfile``, and return how many were sent.
+        """
+        if not isinstance(out, int):
+            out = out.fileno()
+        fd = self.fileno()
+        offset = self.offset
+        remaining = self.length
+        if remaining is None:
+            remaining = max(os.fstat(fd).st_size - offset, 0)
+        sent = 0
+        while remaining > 0:
+            count = os.sendfile(out, fd, offset, remaining)
+            if not count:
+                break
+            offset += count
+            remaining -= count
+            sent += count
+        return sent
+
+
+class SendfileServerHandler(ServerHandler):
+    """A :mod:`wsgiref` handler that sends :class:`SendfileIter` bodies with
+    ``os.sendfile``.
+
+    It doesn't provide ``wsgi.file_wrapper``, so :class:`FileApp` uses
+    :class:`SendfileIter`.  Bodies that can't be sent this way (no
+    ``os.sendfile``, an output or a file without a file descriptor) are
+    written as usual.  Use it wherever
+    :class:`wsgiref.simple_server.ServerHandler` is used.
+    """
+
+    wsgi_file_wrapper = None
+
+    def result_is_file(self):
+        return isinstance(self.result, SendfileIter)
+
+    def sendfile(self):
+        if not hasattr(os, 'sendfile'): # pragma: no cover
+            return False
+        try:
+            out = self.stdout.fileno()
+            self.result.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            return False
+        self.send_headers()
+        self._flush()
+        self.bytes_sent += self.result.sendfile(out)
+        return True
+
 
 class DirectoryApp(object):
     """An application that serves up the files in a given directory.
@@ -115,10 +360,28 @@ class DirectoryApp(object):
 
     To customize `FileApp` instances creation (which is what actually
     serves the responses), override the `make_fileapp` method.
+
+    A :class:`StatCache` passed as ``stat_cache`` is used to look up the
+    files, and by the `FileApp` instances.  With ``etag_source='content'``
+    one that calls ``stat`` every time is made if none is given, to keep
+    the digests of the files.
+
+    With ``precompressed=True`` (or a sequence of ``(content coding, file
+    suffix)`` pairs, :data:`PRECOMPRESSED` by default), a request for
+    ``app.js`` from a client that accepts e.g. ``gzip`` is answered with
+    ``app.js.gz``, if it exists and isn't older than ``app.js``.  The file
+    is served with the ``Content-Type`` of ``app.js`` and a
+    ``Content-Encoding``; ``Range`` requests apply to the compressed file.
+    Every file is then served with ``Vary: Accept-Encoding``.  See
+    :func:`precompress` to create the files; override
+    `make_precompressed_fileapp` to customize how they're served.
+
+    Pass a :class:`FileCache` as ``file_cache`` to keep the responses for
+    small files in memory.
     """
 
     def __init__(self, path, index_page='index.html', hide_index_with_redirect=False,
-                 **kw):
+                 stat_cache=None, precompressed=None, file_cache=None, **kw):
         self.path = os.path.abspath(path)
         if not self.path.endswith(os.path.sep):
             self.path += os.path.sep
@@ -127,16 +390,123 @@ class DirectoryApp(object):
                 "Path does not exist or is not directory: %r" % self.path)
         self.index_page = index_page
         self.hide_index_with_redirect = hide_index_with_redirect
+        if stat_cache is None and kw.get('etag_source') == 'content':
+            # the FileApps made for each request share the digests there;
+            # with ttl=0 every lookup still calls stat
+            stat_cache = StatCache(ttl=0)
+        self.stat_cache = stat_cache
+        if precompressed is True:
+            precompressed = PRECOMPRESSED
+        self.precompressed = tuple(precompressed or ())
+        if self.precompressed:
+            kw.setdefault('vary', ('Accept-Encoding',))
+        self.file_cache = file_cache
         self.fileapp_kw = kw
 
     def make_fileapp(self, path):
-        return FileApp(path, **self.fileapp_kw)
+        return FileApp(path, stat_cache=self.stat_cache, **self.fileapp_kw)
+
+    def make_precompressed_fileapp(self, path, original, encoding):
+        """
+        Return the application serving ``path``, the ``encoding`` compressed
+        version of the file ``original``.
+        """
+        kw = dict(self.fileapp_kw)
+        kw.setdefault('content_type', mimetypes.guess_type(original)[0])
+        kw['content_encoding'] = encoding
+        return FileApp(path, stat_cache=self.stat_cache, **kw)
+
+    def _stat(self, path):
+        try:
+            if self.stat_cache is None:
+                return os.stat(path)
+            return self.stat_cache.stat(path)
+        except (IOError, OSError):
+            return None
+
+    def _precompressed_app(self, req, path):
+        if not req.accept_encoding:
+            return None
+        stat = self._stat(path)
+        if stat is None:
+            return None
+        available = {}
+        for encoding, suffix in self.precompressed:
+            sibling = self._stat(path + suffix)
+            if (sibling is not None and S_ISREG(sibling.st_mode) and
+                    sibling.st_mtime >= stat.st_mtime):
+                available[encoding] = path + suffix
+        encoding = negotiate_encoding(
+            req.accept_encoding,
+            [e for e, suffix in self.precompressed if e in available])
+        if encoding is None:
+            return None
+        return self.make_precompressed_fileapp(
+            available[encoding], path, encoding)
+
+    def _serve(self, req, path):
+        app = None
+        if self.precompressed:
+            app = self._precompressed_app(req, path)
+        if app is None:
+            app = self.make_fileapp(path)
+        key = self._file_cache_key(req)
+        if key is not None and isinstance(app, FileApp):
+            # a file too big to cache is served against the real environ,
+            # so the server's wsgi.file_wrapper can still be used
+            stat = self._stat(app.filename)
+            if (stat is None or
+                    stat.st_size > self.file_cache.max_entry_size):
+                return app
+            paths = [app.filename]
+            if app.filename != path:
+                paths.append(path)
+            return self.file_cache.load(key, app, paths)
+        return app
+
+    def _file_cache_key(self, req):
+        if (self.file_cache is None or
+                req.method not in ('GET', 'HEAD') or
+                'HTTP_RANGE' in req.environ):
+            return None
+        if self.precompressed:
+            return (req.path_info, self._accepted_encodings(req))
+        return req.path_info
+
+    def _accepted_encodings(self, req):
+        # the precompressed codings the client accepts, best first: which
+        # of them is served only depends on this, not on how the
+        # Accept-Encoding header is spelled
+        accept_encoding = req.accept_encoding
+        offers = [encoding for encoding, suffix in self.precompressed]
+        accepted = []
+        while True:
+            encoding = negotiate_encoding(accept_encoding, offers)
+            if encoding is None:
+                return tuple(accepted)
+            accepted.append(encoding)
+            offers.remove(encoding)
+
+    def _isdir(self, path):
+        if self.stat_cache is None:
+            return os.path.isdir(path)
+        return self.stat_cache.isdir(path)
+
+    def _isfile(self, path):
+        if self.stat_cache is None:
+            return os.path.isfile(path)
+        return self.stat_cache.isfile(path)
 
     @wsgify
     def __call__(self, req):
+        key = self._file_cache_key(req)
+        if key is not None:
+            resp = self.file_cache.get(key)
+            if resp is not None:
+                return resp
         path = os.path.abspath(os.path.join(self.path,
                                             req.path_info.lstrip('/')))
-        if os.path.isdir(path) and self.index_page:
+        if self.index_page and self._isdir(path):
             return self.index(req, path)
         if (self.index_page and self.hide_index_with_redirect
             and path.endswith(os.path.sep + self.index_page)):
@@ -149,14 +519,14 @@ class DirectoryApp(object):
                 location=new_url)
         if not path.startswith(self.path):
             return exc.HTTPForbidden()
-        elif not os.path.isfile(path):
+        elif not self._isfile(path):
             return exc.HTTPNotFound(comment=path)
         else:
-            return self.make_fileapp(path)
+            return self._serve(req, path)
 
     def index(self, req, path):
         index_path = os.path.join(path, self.index_page)
-        if not os.path.isfile(index_path):
+        if not self._isfile(index_path):
             return exc.HTTPNotFound(comment=index_path)
         if not req.path_info.endswith('/'):
             url = req.path_url + '/'
@@ -165,4 +535,445 @@ class DirectoryApp(object):
             return Response(
                 status=301,
                 location=url)
-        return self.make_fileapp(index_path)
+        return self._serve(req, index_path)
+
+
+class FileCache(object):
+    """A thread-safe in-memory cache of the responses :class:`DirectoryApp`
+    serves for small files, as :class:`~webob.response.CannedResponse`
+    objects.
+
+    Files of at most ``max_entry_size`` bytes are cached, up to
+    ``max_size`` bytes in total, evicting the least recently used ones to
+    make room.  A cached response is served without looking at the file
+    for ``ttl`` seconds; the next request after that checks with ``stat``
+    that the file wasn't changed (``ttl=None`` never does).  Files
+    modified less than a second ago (or with a weak ``ETag``) aren't
+    cached, and ``Range`` requests always go to the file.
+
+    ``hits``, ``misses``, ``evictions`` and ``revalidations`` count what
+    happened so far, ``size`` is the number of bytes cached.
+    """
+
+    def __init__(self, max_size=8 << 20, max_entry_size=64 << 10, ttl=1.0):
+        self.max_size = max_size
+        self.max_entry_size = min(max_entry_size, max_size)
+        self.ttl = ttl
+        self.size = 0
+        self.hits = self.misses = self.evictions = self.revalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s %d entries, %d bytes, %d hits, %d misses>' % (
+            self.__class__.__name__, len(self), self.size, self.hits,
+            self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the response cached for ``key`` if it's still valid, or
+        ``None``.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            checked, versions, resp = entry
+            if self.ttl is None or _clock() - checked < self.ttl:
+                self.hits += 1
+                return resp
+            self.revalidations += 1
+        # check outside the lock, it does I/O
+        now = _clock()
+        for path, version in versions:
+            try:
+                if _file_version(os.stat(path)) == version:
+                    continue
+            except OSError:
+                pass
+            self._remove(key, entry)
+            return None
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._entries[key] = (now, versions, resp)
+            self.hits += 1
+        return resp
+
+    def load(self, key, app, paths):
+        """
+        Get the response of the :class:`FileApp` ``app`` and cache it for
+        ``key``, to be revalidated against the files ``paths`` (the file
+        ``app`` serves first), if it can be.  Return the response to
+        serve, cached or not; the file is read only once either way.
+        """
+        now = _clock()
+        resp = Request.blank('/').get_response(app)
+        resp.conditional_response = True
+        length = resp.content_length
+        if (resp.status_code != 200 or length is None or
+                length > self.max_entry_size or
+                resp.headers.get('ETag', '').startswith('W/')):
+            return resp
+        try:
+            stats = [os.stat(path) for path in paths]
+        except OSError:
+            return resp
+        body = resp.body
+        if (len(body) != stats[0].st_size or
+                time.time() - max(st.st_mtime for st in stats) < 1):
+            # it's being changed; what was read may not match the stat
+            return resp
+        resp = CannedResponse.from_response(resp)
+        versions = [(path, _file_version(stat))
+                    for path, stat in zip(paths, stats)]
+        size = len(body)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2].body)
+            while self._entries and self.size + size > self.max_size:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[2].body)
+                self.evictions += 1
+            self._entries[key] = (now, versions, resp)
+            self.size += size
+        return resp
+
+    def clear(self):
+        """
+        Empty the cache (the counters are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key, entry):
+        with self._lock:
+            self.misses += 1
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+                self.size -= len(entry[2].body)
+
+
+class StatCache(object):
+    """A thread-safe cache of ``os.stat`` results, and optionally of open
+    file descriptors, for :class:`FileApp` and :class:`DirectoryApp`.
+
+    A result (including "no such file") is trusted for ``ttl`` seconds
+    after the ``stat`` call that got it; the next lookup after that does a
+    new ``stat`` (``ttl=None`` never does, ``ttl=0`` always does).  At most
+    ``max_entries`` paths are kept, evicting the least recently used ones.
+
+    If ``open_files`` is more than 0, up to that many files are also kept
+    open, and shared by the requests for them.  The file objects
+    :meth:`open` returns read with ``os.pread``, and :class:`SendfileIter`
+    hands their descriptor to ``os.sendfile`` with explicit offsets, so
+    neither moves the others' position; anything that reads the descriptor
+    itself (e.g. a server's ``wsgi.file_wrapper``) isn't safe to use with
+    it, so :class:`FileApp` opens a file of its own for those.  A descriptor
+    is dropped when a new ``stat`` shows the file was changed or replaced,
+    and closed once the responses still using it are done.  This needs
+    ``os.pread``, which Python 2 doesn't have.
+
+    ``hits``, ``misses``, ``evictions`` and ``revalidations`` count what
+    happened so far; ``open_files_count`` is the number of descriptors
+    held.
+    """
+
+    def __init__(self, max_entries=1024, ttl=1.0, open_files=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        if not hasattr(os, 'pread'): # pragma: no cover
+            open_files = 0
+        self.open_files = open_files
+        self.hits = self.misses = self.evictions = self.revalidations = 0
+        self._entries = OrderedDict()
+        self._files = OrderedDict()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<%s %d entries, %d open files, %d hits, %d misses>' % (
+            self.__class__.__name__, len(self), self.open_files_count,
+            self.hits, self.misses)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def open_files_count(self):
+        return len(self._files)
+
+    def _lookup(self, path):
+        # (stat_result, None) or (None, (errno, strerror))
+        now = _clock()
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._entries[path] = entry
+                if self.ttl is None or now - entry[0] <= self.ttl:
+                    self.hits += 1
+                    return entry[1], entry[2]
+                self.revalidations += 1
+            else:
+                self.misses += 1
+        try:
+            result, error = os.stat(path), None
+        except (IOError, OSError) as e:
+            result, error = None, (e.errno, e.strerror)
+        with self._lock:
+            if entry is not None and _changed(entry[1], result):
+                self._drop_file(path)
+            if path not in self._entries:
+                while len(self._entries) >= self.max_entries:
+                    evicted, ignored = self._entries.popitem(last=False)
+                    self._drop_file(evicted)
+                    self.evictions += 1
+            self._entries[path] = (now, result, error)
+        return result, error
+
+    def stat(self, path):
+        """Return the ``os.stat`` result for ``path``, raising ``OSError``
+        if there's no such file.
+        """
+        result, error = self._lookup(path)
+        if error is not None:
+            raise OSError(error[0], error[1], path)
+        return result
+
+    def isfile(self, path):
+        result = self._lookup(path)[0]
+        return result is not None and S_ISREG(result.st_mode)
+
+    def isdir(self, path):
+        result = self._lookup(path)[0]
+        return result is not None and S_ISDIR(result.st_mode)
+
+    def open(self, path, opener=open):
+        """Return a file object reading ``path``.  It uses a shared
+        descriptor if ``open_files`` allows, otherwise it's
+        ``opener(path, 'rb')``.
+        """
+        if not self.open_files:
+            return opener(path, 'rb')
+        with self._lock:
+            descriptor = self._files.pop(path, None)
+            if descriptor is not None:
+                self._files[path] = descriptor
+                return _SharedFile(descriptor)
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            size = os.fstat(fd).st_size
+        except BaseException:
+            os.close(fd)
+            raise
+        descriptor = _SharedDescriptor(fd, size)
+        shared = _SharedFile(descriptor)
+        with self._lock:
+            if path not in self._files:
+                while len(self._files) >= self.open_files:
+                    self._files.popitem(last=False)[1].release()
+                self._files[path] = descriptor
+            else:
+                # opened by another thread meanwhile; use ours just once
+                descriptor.release()
+        return shared
+
+    def _drop_file(self, path):
+        descriptor = self._files.pop(path, None)
+        if descriptor is not None:
+            descriptor.release()
+
+    def digest(self, path, stat, compute):
+        """Return the digest (or any value computed from the contents) of
+        the file ``path`` whose ``stat`` result is ``stat``.  ``compute()``
+        is called to get it only the first time for each version of the
+        file (same inode, size and modification time).
+        """
+        version = _file_version(stat)
+        with self._lock:
+            entry = self._digests.pop(path, None)
+            if entry is not None and entry[0] == version:
+                self._digests[path] = entry
+                return entry[1]
+        value = compute()
+        with self._lock:
+            self._digests.pop(path, None)
+            while len(self._digests) >= self.max_entries:
+                self._digests.popitem(last=False)
+            self._digests[path] = (version, value)
+        return value
+
+    def clear(self):
+        """Forget all the results and close the descriptors once they aren't
+        in use (the counters are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._digests.clear()
+            for descriptor in self._files.values():
+                descriptor.release()
+            self._files.clear()
+
+
+def _changed(old, new):
+    if old is None or new is None:
+        return old is not new
+    return (old.st_ino != new.st_ino or old.st_size != new.st_size or
+            old.st_mtime != new.st_mtime)
+
+
+class _SharedDescriptor(object):
+    # A file descriptor closed when its last user releases it
+
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.size = size
+        self.refs = 1
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.refs += 1
+
+    def release(self):
+        with self._lock:
+            self.refs -= 1
+            if self.refs:
+                return
+        os.close(self.fd)
+
+
+class _SharedFile(object):
+    # A file object reading a shared descriptor with positional reads
+
+    def __init__(self, descriptor):
+        descriptor.acquire()
+        self._descriptor = descriptor
+        self._pos = 0
+        self.closed = False
+
+    def fileno(self):
+        return self._descriptor.fd
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self._pos
+        elif whence == 2:
+            pos += self._descriptor.size
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self._descriptor.size - self._pos, 0)
+        data = os.pread(self._descriptor.fd, size, self._pos)
+        self._pos += len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._descriptor.release()
+
+
+def _precompress_file(args):
+    path, encodings, level = args
+    stat = os.stat(path)
+    written = []
+    for encoding, suffix in encodings:
+        target = path + suffix
+        try:
+            if os.stat(target).st_mtime >= stat.st_mtime:
+                continue
+        except OSError:
+            pass
+        encoder = encoders[encoding](level=level)
+        tmp = '%s.%d.tmp' % (target, os.getpid())
+        with open(path, 'rb') as src:
+            with open(tmp, 'wb') as dest:
+                for chunk in encode_app_iter(
+                        iter(lambda: src.read(BLOCK_SIZE), b''), encoder):
+                    dest.write(chunk)
+        if os.path.getsize(tmp) >= stat.st_size:
+            # not worth it; make sure a stale one isn't served
+            os.remove(tmp)
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        # the same modification time marks it as fresh for DirectoryApp
+        if PY2: # pragma: no cover
+            # utime only takes microseconds; don't round down to stale
+            os.utime(tmp, (stat.st_atime, stat.st_mtime + 1e-6))
+        else:
+            os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        if PY2: # pragma: no cover
+            # rename doesn't replace an existing file on Windows
+            if os.path.exists(target):
+                os.remove(target)
+            os.rename(tmp, target)
+        else:
+            os.replace(tmp, target)
+        written.append(target)
+    return written
+
+
+def precompress(path, encodings=('gzip',), extensions=PRECOMPRESS_EXTENSIONS,
+                min_size=256, level=9, pool=None):
+    """
+    Compress the files under the directory ``path`` for ``DirectoryApp(...,
+    precompressed=True)``, as a build step, and return the list of files
+    written.
+
+    Each file whose name ends with one of ``extensions`` (all files if
+    ``None``) and that has at least ``min_size`` bytes is compressed with
+    every content coding in ``encodings``, which must be among
+    :data:`webob.compression.encoders`, to a file named with its suffix in
+    :data:`PRECOMPRESSED` (or given with the coding as a ``(coding,
+    suffix)`` pair).  Files already compressed since they were modified are
+    skipped, as are results no smaller than the original.
+
+    The files are compressed on several threads at once; ``pool`` is
+    anything with a ``map(func, iterable)`` method, by default
+    :func:`webob.compression.default_pool`.
+    """
+    suffixes = dict(PRECOMPRESSED)
+    pairs = []
+    for encoding in encodings:
+        if isinstance(encoding, tuple):
+            encoding, suffix = encoding
+        elif encoding in suffixes:
+            suffix = suffixes[encoding]
+        else:
+            raise ValueError('No file suffix known for %r' % (encoding,))
+        if encoding not in encoders:
+            raise ValueError('Unknown content coding: %r' % (encoding,))
+        pairs.append((encoding, suffix))
+    all_suffixes = tuple(suffix for encoding, suffix in pairs)
+    if extensions is not None:
+        extensions = tuple(extensions)
+    jobs = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename.endswith(all_suffixes):
+                continue
+            if extensions is not None and not filename.endswith(extensions):
+                continue
+            filename = os.path.join(dirpath, filename)
+            if os.path.getsize(filename) < min_size:
+                continue
+            jobs.append((filename, pairs, level))
+    if pool is None:
+        pool = default_pool()
+    written = []
+    for result in pool.map(_precompress_file, jobs):
+        written.extend(result)
+    return written
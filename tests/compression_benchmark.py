@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Compare serial and parallel gzip compression of a large response body.
+
+Usage: compression_benchmark.py [size in MiB] [block size in KiB] [level]
+"""
+import sys
+import time
+
+from webob.compat import bytes_
+from webob.compression import (
+    GzipEncoder,
+    encode_app_iter,
+    encode_parallel,
+    )
+
+
+def make_body(size):
+    # JSON-ish rows: repetitive, but not trivially compressible
+    rows = []
+    length = 0
+    i = 0
+    while length < size:
+        row = bytes_('{"id": %d, "name": "item %d", "price": %d.%02d, '
+                     '"tags": ["t%d", "t%d"]},\n'
+                     % (i, i * 7919 % 100003, i % 997, i % 100, i % 13,
+                        i % 29))
+        rows.append(row)
+        length += len(row)
+        i += 1
+    return b''.join(rows)[:size]
+
+
+def timed(func, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, len(b''.join(result))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    size = int(float(args[0]) * (1 << 20)) if args else 16 << 20
+    block_size = int(args[1]) << 10 if len(args) > 1 else 1 << 17
+    level = int(args[2]) if len(args) > 2 else 6
+    body = make_body(size)
+
+    serial = timed(lambda: list(encode_app_iter(
+        [body], GzipEncoder(level=level))))
+    parallel = timed(lambda: encode_parallel(
+        body, level=level, block_size=block_size))
+
+    print('%.1f MiB body, level %d, %d KiB blocks'
+          % (size / float(1 << 20), level, block_size >> 10))
+    for name, (elapsed, compressed) in (('serial', serial),
+                                        ('parallel', parallel)):
+        print('%-8s %8.1f ms %10d bytes (%.1f%%)'
+              % (name, elapsed * 1000, compressed,
+                 compressed * 100.0 / size))
+    print('speedup  %8.2fx' % (serial[0] / parallel[0]))
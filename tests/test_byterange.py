@@ -60,6 +60,32 @@ def test_range_repr():
     assert repr(range) == '<Range bytes 0-99>'
 
 
+def test_range_parse_multiple():
+    range = Range.parse('bytes=0-99, 200-299,-50')
+    assert range.ranges == [(0, 100), (200, 300), (-50, None)]
+    assert (range.start, range.end) == (0, 100)
+    assert str(range) == 'bytes=0-99,200-299,-50'
+    assert repr(range) == '<Range bytes 0-100, 200-300, -50-None>'
+    assert Range.parse('bytes=0-1,,5-').ranges == [(0, 2), (5, None)]
+
+def test_range_parse_multiple_invalid():
+    assert Range.parse('bytes=0-99,x') is None
+    assert Range.parse('bytes=0-99,10-5') is None
+    assert Range.parse('bytes=0-99,-') is None
+    assert Range.parse('bytes=-') is None
+    assert Range.parse('bytes=') is None
+
+def test_ranges_for_length():
+    range = Range.parse('bytes=50-59,0-9,5-19,20-29,-5,1000-')
+    assert range.ranges_for_length(100) == [(0, 30), (50, 60), (95, 100)]
+    assert range.ranges_for_length(None) is None
+    assert Range.parse('bytes=1000-,2000-').ranges_for_length(100) == []
+
+def test_ranges_for_length_single():
+    assert Range(0, 10).ranges_for_length(5) == [(0, 5)]
+    assert Range(10, None).ranges_for_length(5) == []
+
+
 # ContentRange class
 
 def test_contentrange_bad_input():
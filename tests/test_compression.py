@@ -0,0 +1,255 @@
+import gzip
+import io
+import zlib
+
+import pytest
+
+from webob.acceptparse import AcceptEncoding, NoAccept
+from webob.compat import bytes_
+from webob.compression import (
+    CompressionCache,
+    DeflateEncoder,
+    GzipEncoder,
+    default_pool,
+    encode_app_iter,
+    encode_parallel,
+    encoders,
+    negotiate_encoding,
+    register_encoder,
+    )
+
+DATA = [b'hello ', b'world ' * 100, b'', b'!']
+
+
+def _gunzip(body):
+    return gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+
+
+class TestEncoders(object):
+    @pytest.mark.parametrize('level', [1, 6, 9])
+    def test_gzip(self, level):
+        body = b''.join(encode_app_iter(DATA, GzipEncoder(level=level)))
+        assert _gunzip(body) == b''.join(DATA)
+
+    def test_gzip_strategy(self):
+        encoder = GzipEncoder(strategy=zlib.Z_HUFFMAN_ONLY)
+        body = b''.join(encode_app_iter(DATA, encoder))
+        assert _gunzip(body) == b''.join(DATA)
+        assert encoder.size == len(b''.join(DATA))
+
+    def test_deflate(self):
+        body = b''.join(encode_app_iter(DATA, DeflateEncoder(level=1)))
+        assert zlib.decompress(body, -zlib.MAX_WBITS) == b''.join(DATA)
+
+    def test_empty(self):
+        body = b''.join(encode_app_iter([], GzipEncoder()))
+        assert _gunzip(body) == b''
+
+    def test_encode_app_iter_is_lazy(self):
+        def app_iter():
+            yield b'a' * 100
+            raise AssertionError('read too far')
+        result = encode_app_iter(app_iter(), GzipEncoder())
+        assert next(result) == b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+
+    def _stream(self, items, **kw):
+        # decompress each chunk as it arrives, returning what the client
+        # would have seen after each one
+        decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        produced = []
+        def app_iter():
+            for item in items:
+                produced.append(item)
+                yield item
+        seen = []
+        body = b''
+        for chunk in encode_app_iter(app_iter(), GzipEncoder(), **kw):
+            body += chunk
+            seen.append(decompress.decompress(chunk))
+        assert _gunzip(body) == b''.join(produced)
+        return seen
+
+    def test_no_flush(self):
+        seen = self._stream([b'event 1\n', b'event 2\n'])
+        # nothing until the end of the stream
+        assert seen == [b'', b'event 1\nevent 2\n', b'']
+
+    def test_flush_every(self):
+        items = [bytes_('event %d\n' % i) for i in range(5)]
+        seen = self._stream(items, flush_every=1)
+        # the gzip header, then each event as soon as it was produced
+        assert seen[1:6] == items
+        seen = self._stream(items, flush_every=2)
+        assert seen[1:4] == [b''.join(items[:2]), b''.join(items[2:4]),
+                             items[4]]
+
+    def test_flush_bytes(self):
+        items = [b'a' * 10, b'b' * 10, b'c' * 10, b'd']
+        seen = self._stream(items, flush_bytes=15)
+        assert seen[1:4] == [b'a' * 10 + b'b' * 10, b'c' * 10 + b'd', b'']
+
+    def test_flush_interval(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr('webob.compression._clock', lambda: now[0])
+        def app_iter():
+            yield b'first'
+            now[0] += 1
+            yield b'second'
+            now[0] += 0.5
+            yield b'third'
+        seen = self._stream(app_iter(), flush_interval=1)
+        assert seen[1:] == [b'firstsecond', b'third', b'']
+
+    def test_register_encoder(self, monkeypatch):
+        monkeypatch.setattr('webob.compression.encoders', dict(encoders))
+        from webob import compression
+        register_encoder('x-test', DeflateEncoder)
+        assert compression.encoders['x-test'] is DeflateEncoder
+        assert 'x-test' not in encoders
+
+
+class TestNegotiateEncoding(object):
+    @pytest.mark.parametrize('header,expected', [
+        ('gzip', 'gzip'),
+        ('deflate', 'deflate'),
+        ('gzip, deflate', 'gzip'),
+        ('deflate, gzip', 'gzip'),
+        ('gzip;q=0.5, deflate', 'deflate'),
+        ('GZIP', 'gzip'),
+        ('*', 'gzip'),
+        ('gzip;q=0, *', 'deflate'),
+        ('*;q=0', None),
+        ('identity', None),
+        ('br', None),
+        ('', None),
+    ])
+    def test_header(self, header, expected):
+        assert negotiate_encoding(header) == expected
+        assert negotiate_encoding(AcceptEncoding(header)) == expected
+
+    def test_no_header(self):
+        assert negotiate_encoding(NoAccept()) is None
+
+    def test_offers(self):
+        assert negotiate_encoding('gzip, deflate', ('deflate',)) == 'deflate'
+        assert negotiate_encoding('gzip', ('deflate',)) is None
+
+
+class SerialPool(object):
+    def __init__(self):
+        self.calls = 0
+
+    def map(self, func, iterable):
+        self.calls += 1
+        return map(func, iterable)
+
+
+class TestEncodeParallel(object):
+    data = b''.join(
+        bytes_('line %d of a largish text body\n' % i) for i in range(20000))
+
+    @pytest.mark.parametrize('block_size', [1000, 4096, 1 << 17, 1 << 20])
+    def test_gzip(self, block_size):
+        chunks = encode_parallel(self.data, block_size=block_size)
+        assert _gunzip(b''.join(chunks)) == self.data
+
+    def test_deflate(self):
+        chunks = encode_parallel(self.data, 'deflate', level=1,
+                                 block_size=5000)
+        body = b''.join(chunks)
+        assert zlib.decompress(body, -zlib.MAX_WBITS) == self.data
+
+    def test_ratio_close_to_serial(self):
+        serial = b''.join(encode_app_iter([self.data], GzipEncoder()))
+        parallel = b''.join(encode_parallel(self.data, block_size=1 << 16))
+        assert len(parallel) < len(serial) * 1.05
+
+    @pytest.mark.parametrize('data', [b'', b'x'])
+    def test_small(self, data):
+        assert _gunzip(b''.join(encode_parallel(data))) == data
+
+    def test_pool(self):
+        pool = SerialPool()
+        chunks = encode_parallel(self.data, pool=pool, block_size=100000)
+        assert pool.calls == 1
+        # header, blocks, trailer
+        assert len(chunks) == 2 + -(-len(self.data) // 100000)
+        assert _gunzip(b''.join(chunks)) == self.data
+
+    def test_executor(self):
+        futures = pytest.importorskip('concurrent.futures')
+        with futures.ThreadPoolExecutor(2) as pool:
+            chunks = encode_parallel(self.data, pool=pool, block_size=10000)
+        assert _gunzip(b''.join(chunks)) == self.data
+
+    def test_default_pool(self):
+        assert default_pool() is default_pool()
+        assert list(default_pool().map(len, [b'a', b'bc'])) == [1, 2]
+
+    def test_unsupported_encoding(self):
+        with pytest.raises(ValueError):
+            encode_parallel(self.data, 'br')
+
+
+class TestCompressionCache(object):
+    def test_get_set(self):
+        cache = CompressionCache()
+        assert cache.get('a') is None
+        assert cache.set('a', [b'abc', b'de'])
+        assert cache.get('a') == [b'abc', b'de']
+        assert 'a' in cache
+        assert len(cache) == 1
+        assert cache.size == 5
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert repr(cache) == \
+            '<CompressionCache 1 entries, 5 bytes, 1 hits, 1 misses>'
+
+    def test_replace(self):
+        cache = CompressionCache()
+        cache.set('a', [b'abc'])
+        cache.set('a', [b'x'])
+        assert cache.get('a') == [b'x']
+        assert cache.size == 1
+
+    def test_lru_eviction(self):
+        cache = CompressionCache(max_size=10, max_entry_size=10)
+        cache.set('a', [b'aaaa'])
+        cache.set('b', [b'bbbb'])
+        cache.get('a')
+        cache.set('c', [b'cccc'])
+        assert 'b' not in cache
+        assert 'a' in cache and 'c' in cache
+        assert cache.evictions == 1
+        assert cache.size == 8
+
+    def test_too_big(self):
+        cache = CompressionCache(max_size=100)
+        assert cache.max_entry_size == 25
+        assert not cache.set('a', [b'x' * 26])
+        assert 'a' not in cache
+        assert cache.size == 0
+
+    def test_clear(self):
+        cache = CompressionCache()
+        cache.set('a', [b'abc'])
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.size == 0
+
+    def test_store_iter(self):
+        cache = CompressionCache()
+        assert list(cache.store_iter('a', iter([b'a', b'b']))) == [b'a', b'b']
+        assert cache.get('a') == [b'a', b'b']
+
+    def test_store_iter_incomplete(self):
+        cache = CompressionCache()
+        app_iter = cache.store_iter('a', iter([b'a', b'b']))
+        next(app_iter)
+        app_iter.close()
+        assert 'a' not in cache
+
+    def test_store_iter_too_big(self):
+        cache = CompressionCache(max_size=8)
+        assert list(cache.store_iter('a', iter([b'a', b'bcd']))) == \
+            [b'a', b'bcd']
+        assert 'a' not in cache
@@ -469,6 +469,12 @@ def test_serialize_range():
     val = serialize_range((1, 500))
     assert val == 'bytes=1-499'
 
+def test_serialize_range_object():
+    from webob.byterange import Range
+    from webob.descriptors import serialize_range
+    val = serialize_range(Range.parse('bytes=1-5,10-'))
+    assert val == 'bytes=1-5,10-'
+
 def test_parse_int_none():
     from webob.descriptors import parse_int
     val = parse_int(None)
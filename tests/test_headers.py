@@ -76,6 +76,108 @@ def test_ResponseHeaders_contains():
     assert 'a' in d
     assert not 'b' in d
 
+def test_ResponseHeaders_view_on_HeaderList():
+    hl = headers.HeaderList([('Content-Type', 'text/html')])
+    d = headers.ResponseHeaders.view_list(hl)
+    d.add('Set-Cookie', 'a=1')
+    d.add('set-cookie', 'b=2')
+    assert d['content-type'] == 'text/html'
+    assert d.getall('SET-COOKIE') == ['a=1', 'b=2']
+    assert d.pop('Set-Cookie') == 'a=1'
+    d['Content-Type'] = 'text/plain'
+    assert hl == [('Content-Type', 'text/plain'), ('set-cookie', 'b=2')]
+    del d['set-cookie']
+    assert 'set-cookie' not in d
+    assert hl == [('Content-Type', 'text/plain')]
+
+def test_ResponseHeaders_view_on_plain_list():
+    l = [('Content-Type', 'text/html'), ('Set-Cookie', 'a=1')]
+    d = headers.ResponseHeaders.view_list(l)
+    assert d['content-type'] == 'text/html'
+    assert d.getall('SET-COOKIE') == ['a=1']
+    assert 'set-cookie' in d
+    d['Content-Type'] = 'text/plain'
+    assert l == [('Set-Cookie', 'a=1'), ('Content-Type', 'text/plain')]
+    del d['set-cookie']
+    assert l == [('Content-Type', 'text/plain')]
+
+def test_HeaderList_positions():
+    hl = headers.HeaderList([('A', '1'), ('b', '2'), ('a', '3')])
+    assert isinstance(hl, list)
+    assert list(hl.positions('a')) == [0, 2]
+    assert list(hl.positions('B')) == [1]
+    assert list(hl.positions('c')) == []
+    hl.append(('C', '4'))
+    hl.extend([('a', '5')])
+    hl += [('d', '6')]
+    assert list(hl.positions('a')) == [0, 2, 4]
+    assert list(hl.positions('c')) == [3]
+    assert list(hl.positions('d')) == [5]
+
+def test_HeaderList_list_changes_invalidate_index():
+    hl = headers.HeaderList([('A', '1'), ('b', '2')])
+    assert list(hl.positions('b')) == [1]
+    hl.insert(0, ('c', '3'))
+    assert list(hl.positions('b')) == [2]
+    hl[0] = ('b', '4')
+    assert list(hl.positions('b')) == [0, 2]
+    del hl[:2]
+    assert list(hl.positions('b')) == [0]
+    hl.pop()
+    assert list(hl.positions('b')) == []
+    hl[:] = [('x', '1')]
+    assert list(hl.positions('x')) == [0]
+
+def test_HeaderList_replace():
+    hl = headers.HeaderList([('A', '1'), ('b', '2')])
+    hl.replace('a', '3')
+    assert hl == [('a', '3'), ('b', '2')]
+    hl.append(('B', '4'))
+    hl.replace('B', '5')
+    assert hl == [('a', '3'), ('B', '5')]
+    hl.replace('c', '6')
+    assert hl == [('a', '3'), ('B', '5'), ('c', '6')]
+
+def test_HeaderList_remove_all():
+    hl = headers.HeaderList([('A', '1'), ('b', '2'), ('a', '3')])
+    assert hl.remove_all('a')
+    assert not hl.remove_all('a')
+    assert hl == [('b', '2')]
+    assert list(hl.positions('b')) == [0]
+
+def test_HeaderList_version():
+    hl = headers.HeaderList([('A', '1')])
+    versions = [hl.version]
+    def changed():
+        versions.append(hl.version)
+        return versions[-1] != versions[-2]
+    hl.append(('b', '2'))
+    assert changed()
+    hl.extend([('c', '3')])
+    assert changed()
+    hl.replace('a', '4')
+    assert changed()
+    hl.replace('d', '5')
+    assert changed()
+    hl.remove_all('d')
+    assert changed()
+    assert not hl.remove_all('d')
+    assert not changed()
+    hl[0] = ('a', '6')
+    assert changed()
+    del hl[0]
+    assert changed()
+    hl.positions('b')
+    assert not changed()
+
+def test_HeaderList_pickle():
+    import pickle
+    hl = headers.HeaderList([('A', '1')])
+    hl2 = pickle.loads(pickle.dumps(hl))
+    assert isinstance(hl2, headers.HeaderList)
+    assert hl2 == hl
+    assert list(hl2.positions('a')) == [0]
+
 def test_EnvironHeaders_delitem():
     d = headers.EnvironHeaders({'CONTENT_LENGTH': '10'})
     del d['CONTENT-LENGTH']
@@ -113,3 +215,47 @@ def test__trans_key_key2header():
 def test__trans_key_httpheader():
     result = headers._trans_key('HTTP_FOO_BAR')
     assert result == 'Foo-Bar'
+
+def test__trans_name_cached():
+    assert headers._name2key['User-Agent'] == 'HTTP_USER_AGENT'
+    assert headers._name2key['content-type'] == 'CONTENT_TYPE'
+    assert headers._key2name['HTTP_USER_AGENT'] == 'User-Agent'
+    assert headers._trans_name('X-Some-Header') == 'HTTP_X_SOME_HEADER'
+    assert headers._name2key['X-Some-Header'] == 'HTTP_X_SOME_HEADER'
+    assert headers._trans_name('content-LENGTH') == 'CONTENT_LENGTH'
+
+def test__trans_name_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(headers, '_name2key', {})
+    monkeypatch.setattr(headers, '_TRANS_CACHE_SIZE', 2)
+    for name in ('a', 'b', 'c'):
+        assert headers._trans_name(name) == 'HTTP_' + name.upper()
+    assert sorted(headers._name2key) == ['a', 'b']
+
+def test_EnvironHeaders_keys():
+    environ = {'CONTENT_LENGTH': '10', 'HTTP_HOST': 'x', 'PATH_INFO': '/'}
+    d = headers.EnvironHeaders(environ)
+    assert sorted(d.keys()) == ['Content-Length', 'Host']
+    assert len(d) == 2
+
+def test_EnvironHeaders_cache_keys():
+    environ = {'CONTENT_LENGTH': '10', 'HTTP_HOST': 'x', 'PATH_INFO': '/'}
+    d = headers.EnvironHeaders(environ, cache_keys=True)
+    assert sorted(d) == ['Content-Length', 'Host']
+    d['Accept'] = '*/*'
+    assert sorted(d) == ['Accept', 'Content-Length', 'Host']
+    environ['HTTP_X_FOO'] = 'y'
+    assert len(d) == 4
+    del environ['HTTP_X_FOO']
+    environ['QUERY_STRING'] = ''
+    assert len(d) == 3
+    del environ['QUERY_STRING']
+    # removing a header is noticed even if the environ keeps its size
+    del environ['HTTP_ACCEPT']
+    environ['REMOTE_ADDR'] = '127.0.0.1'
+    assert sorted(d) == ['Content-Length', 'Host']
+    # a non-header key swapped for a header isn't, until invalidated
+    del environ['REMOTE_ADDR']
+    environ['HTTP_DNT'] = '1'
+    assert len(d) == 2
+    d.invalidate()
+    assert sorted(d) == ['Content-Length', 'Dnt', 'Host']
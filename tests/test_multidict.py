@@ -246,6 +246,52 @@ class MultiDictTestCase(BaseDictTests, unittest.TestCase):
         self.assertEqual(repr(d), "MultiDict([('password', '******')])")
 
 
+class IndexedMultiDictTestCase(BaseDictTests, unittest.TestCase):
+    klass = multidict.IndexedMultiDict
+
+    def _assert_same(self, d, items):
+        expected = multidict.MultiDict(items)
+        self.assertEqual(list(d.items()), items)
+        for key in set(k for k, v in items) | set(['missing']):
+            self.assertEqual(d.getall(key), expected.getall(key))
+            self.assertEqual(key in d, key in expected)
+            self.assertEqual(d.get(key), expected.get(key))
+
+    def test_index_after_changes(self):
+        d = self._get_instance()
+        items = list(self._list)
+        self._assert_same(d, items)
+        d.add('c', '2')
+        d['a'] = 'x'
+        items = [('b', '1'), ('c', '2'), ('a', 'x')]
+        self._assert_same(d, items)
+        self.assertEqual(d.pop('b'), '1')
+        items.pop(0)
+        self._assert_same(d, items)
+        self.assertEqual(d.popitem(), ('a', 'x'))
+        items.pop()
+        self._assert_same(d, items)
+        d.extend([('c', '3'), ('d', '4')], e='5')
+        items.extend([('c', '3'), ('d', '4'), ('e', '5')])
+        self._assert_same(d, items)
+        self.assertEqual(d.setdefault('c', '9'), '2')
+        del d['c']
+        self._assert_same(d, [('d', '4'), ('e', '5')])
+        d.clear()
+        d.add('a', '1')
+        self._assert_same(d, [('a', '1')])
+
+    def test_delitem_missing(self):
+        d = self._get_instance()
+        self.assertRaises(KeyError, d.__delitem__, 'z')
+        self.assertRaises(KeyError, d.__getitem__, 'z')
+
+    def test_getitem_last_value(self):
+        d = self.klass([('a', '1'), ('b', '2'), ('a', '3')])
+        self.assertEqual(d['a'], '3')
+        self.assertEqual(d.getone('b'), '2')
+
+
 class NestedMultiDictTestCase(BaseDictTests, unittest.TestCase):
     klass = multidict.NestedMultiDict
 
@@ -421,6 +467,83 @@ class TestGetDict(BaseDictTests, unittest.TestCase):
         d.extend([('a', '2')])
         self.assertEqual(env['QUERY_STRING'], 'a=%C3%A9&a=e&a=f&b=1&a=2')
 
+    def _from_query_string(self, qs, environ=None):
+        if environ is None:
+            environ = {}
+        return self.klass.from_query_string(qs, environ)
+
+    def test_from_query_string(self):
+        from webob.compat import parse_qsl_text
+        qs = 'a=%C3%A9&a=e+f;b=&c&=d&&e%3D=%ZZ'
+        d = self._from_query_string(qs)
+        self.assertEqual(list(d.items()), list(parse_qsl_text(qs)))
+
+    def test_from_query_string_decodes_values_lazily(self):
+        d = self._from_query_string('a=1&b=2&a=3&c=4')
+        self.assertEqual(d['a'], '3')
+        self.assertEqual(d.getall('a'), ['1', '3'])
+        self.assertEqual(d.getone('b'), '2')
+        self.assertTrue('c' in d)
+        self.assertFalse('x' in d)
+        self.assertEqual(len(d), 4)
+        self.assertEqual(list(d.keys()), ['a', 'b', 'a', 'c'])
+        self.assertRaises(KeyError, d.__getitem__, 'x')
+        self.assertEqual(sorted(d._values), [0, 1, 2])
+        self.assertEqual(list(d.values()), ['1', '2', '3', '4'])
+        self.assertEqual(d._raw, None)
+
+    def test_from_query_string_indexed(self):
+        d = self._from_query_string('a=1&b=2&a=3')
+        self.assertTrue('b' in d)
+        self.assertEqual(d._index, {'a': [0, 2], 'b': [1]})
+        # the lookups don't scan the names
+        keys = d._keys
+        class Unscannable(list):
+            def __iter__(self):
+                raise AssertionError('scanned')
+            __contains__ = __iter__
+        d._keys = Unscannable(keys)
+        self.assertEqual(d['a'], '3')
+        self.assertEqual(d.getall('a'), ['1', '3'])
+        self.assertFalse('c' in d)
+        # and the index is kept once all the items are decoded
+        d._keys = keys
+        index = d._index
+        d.add('b', '4')
+        self.assertTrue(d._index is index)
+        self.assertEqual(d.getall('b'), ['2', '4'])
+        self.assertEqual(d['a'], '3')
+
+    def test_from_query_string_change_updates_QUERY_STRING(self):
+        env = {'QUERY_STRING': 'a=1&b=%C3%A9'}
+        d = self._from_query_string(env['QUERY_STRING'], env)
+        d['a'] = '2'
+        self.assertEqual(env['QUERY_STRING'], 'b=%C3%A9&a=2')
+        self.assertEqual(d['b'], text_(b'\xc3\xa9', 'utf-8'))
+
+    def test_batch(self):
+        class Environ(dict):
+            writes = 0
+            def __setitem__(self, key, value):
+                if key == 'QUERY_STRING':
+                    self.writes += 1
+                dict.__setitem__(self, key, value)
+        env = Environ()
+        d = self._get_instance(environ=env)
+        with d.batch():
+            d['a'] = '2'
+            with d.batch():
+                d.add('c', '3')
+            del d['b']
+            self.assertEqual(env.writes, 0)
+        self.assertEqual(env.writes, 1)
+        self.assertEqual(env['QUERY_STRING'], 'a=2&c=3')
+        d.update([('x', '1'), ('y', '2')])
+        self.assertEqual(env.writes, 2)
+        with d.batch():
+            pass
+        self.assertEqual(env.writes, 2)
+
 class NoVarsTestCase(unittest.TestCase):
     klass = multidict.NoVars
 
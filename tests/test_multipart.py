@@ -0,0 +1,195 @@
+from io import BytesIO
+import cgi
+
+import pytest
+
+from webob.compat import PY2
+from webob.multipart import (
+    MultipartParser,
+    MultipartPart,
+    parse_boundary,
+    )
+
+BODY = (
+    b'preamble\r\n'
+    b'--XX\r\n'
+    b'Content-Disposition: form-data; name="foo"\r\n'
+    b'\r\n'
+    b'bar\r\n'
+    b'--XX\r\n'
+    b'Content-Disposition: form-data; name="file"; filename="a.txt"\r\n'
+    b'Content-Type: text/plain\r\n'
+    b'\r\n'
+    b'line one\r\n'
+    b'line two --XX not a delimiter\r\n'
+    b'\r\n'
+    b'--XX\r\n'
+    b'Content-Disposition: form-data; name="foo"\r\n'
+    b'\r\n'
+    b'baz\r\n'
+    b'--XX--\r\n'
+    b'epilogue'
+)
+
+FILE_CONTENT = b'line one\r\nline two --XX not a delimiter\r\n'
+
+
+def _parse(body, boundary='XX', **kw):
+    return MultipartParser(BytesIO(body), boundary, **kw)
+
+
+class TestMultipartParser(object):
+    @pytest.mark.parametrize('block_size', [1, 2, 7, 64, 1 << 16])
+    def test_parse(self, block_size):
+        vars = _parse(BODY, block_size=block_size).parse()
+        assert vars.getall('foo') == ['bar', 'baz']
+        upload = vars['file']
+        assert isinstance(upload, MultipartPart)
+        assert isinstance(upload, cgi.FieldStorage)
+        assert upload.name == 'file'
+        assert upload.filename == 'a.txt'
+        assert upload.type == 'text/plain'
+        assert upload.file.read() == FILE_CONTENT
+        assert upload.value == FILE_CONTENT
+
+    def test_sizes(self):
+        parser = _parse(BODY)
+        parser.parse()
+        assert parser.sizes == [
+            ('foo', 3), ('file', len(FILE_CONTENT)), ('foo', 3)]
+
+    def test_iter_is_incremental(self):
+        fp = BytesIO(BODY)
+        parser = MultipartParser(fp, 'XX', block_size=16)
+        part = next(iter(parser))
+        assert part.value == 'bar'
+        assert fp.tell() < len(BODY)
+
+    def test_lf_line_endings(self):
+        body = BODY.replace(b'\r\n', b'\n')
+        vars = _parse(body).parse()
+        assert vars.getall('foo') == ['bar', 'baz']
+        assert vars['file'].value == FILE_CONTENT.replace(b'\r\n', b'\n')
+
+    def test_make_file(self):
+        files = []
+        def make_file():
+            f = BytesIO()
+            files.append(f)
+            return f
+        vars = _parse(BODY, make_file=make_file).parse()
+        assert files == [vars['file'].file]
+
+    def test_empty_filename_is_a_field(self):
+        body = (
+            b'--XX\r\n'
+            b'Content-Disposition: form-data; name="file"; filename=""\r\n'
+            b'\r\n'
+            b'\r\n'
+            b'--XX--')
+        vars = _parse(body).parse()
+        if PY2:
+            assert vars['file'] == u''
+        else:
+            assert vars['file'] == b''
+
+    def test_part_charset(self):
+        body = (
+            b'--XX\r\n'
+            b'Content-Disposition: form-data; name="title"\r\n'
+            b'Content-Type: text/plain; charset=cp1251\r\n'
+            b'\r\n'
+            b'\xea\xf3\r\n'
+            b'--XX--')
+        vars = _parse(body).parse()
+        assert vars['title'] == b'\xea\xf3'.decode('cp1251')
+
+    def test_charset(self):
+        body = (
+            b'--XX\r\n'
+            b'Content-Disposition: form-data; name="\xea\xf3"\r\n'
+            b'\r\n'
+            b'\xea\xf3\r\n'
+            b'--XX--')
+        vars = _parse(body, charset='cp1251').parse()
+        text = b'\xea\xf3'.decode('cp1251')
+        assert vars[text] == text
+
+    @pytest.mark.parametrize('encoding,encoded', [
+        (b'base64', b'Zm9vIGJhcg=='),
+        (b'quoted-printable', b'foo=20bar'),
+    ])
+    def test_content_transfer_encoding(self, encoding, encoded):
+        body = (
+            b'--XX\r\n'
+            b'Content-Disposition: form-data; name="a"\r\n'
+            b'Content-Transfer-Encoding: ' + encoding + b'\r\n'
+            b'\r\n' + encoded + b'\r\n'
+            b'--XX--')
+        vars = _parse(body).parse()
+        assert vars['a'] == 'foo bar'
+
+    def test_folded_header(self):
+        body = (
+            b'--XX\r\n'
+            b'Content-Disposition: form-data;\r\n'
+            b' name="a"\r\n'
+            b'\r\n'
+            b'1\r\n'
+            b'--XX--')
+        vars = _parse(body).parse()
+        assert vars['a'] == '1'
+
+    def test_truncated_body(self):
+        body = (
+            b'--XX\r\n'
+            b'Content-Disposition: form-data; name="a"\r\n'
+            b'\r\n'
+            b'partial')
+        vars = _parse(body).parse()
+        assert vars['a'] == 'partial'
+
+    def test_no_delimiter(self):
+        assert list(_parse(b'')) == []
+        assert list(_parse(b'no parts here')) == []
+
+    def test_no_boundary(self):
+        with pytest.raises(ValueError):
+            MultipartParser(BytesIO(BODY), None)
+
+    def test_headers_too_large(self):
+        body = b'--XX\r\n' + b'x' * (1 << 17)
+        with pytest.raises(ValueError):
+            _parse(body).parse()
+
+    def test_delimiter_line_too_large(self):
+        body = b'--XX' + b'x' * (1 << 17)
+        with pytest.raises(ValueError):
+            _parse(body).parse()
+
+    @pytest.mark.parametrize('body', [
+        b'--XX',
+        b'--XX-',
+        b'--XX trailing',
+        b'--XX\r\nContent-Disposition: form-data; name="a"',
+        b'--XX\r\nContent-Disposition: form-data; name="a"\r\n',
+    ])
+    def test_truncated_headers(self, body):
+        assert list(_parse(body, block_size=4)) == []
+
+    def test_repr(self):
+        assert repr(_parse(b'')) == "<MultipartParser boundary=%r>" % b'XX'
+
+
+class TestMultipartPart(object):
+    def test_is_file(self):
+        parts = list(_parse(BODY))
+        assert [p.is_file for p in parts] == [False, True, False]
+
+
+def test_parse_boundary():
+    assert parse_boundary('multipart/form-data; boundary=XX') == 'XX'
+    assert parse_boundary(
+        'multipart/form-data; boundary="X;Y"; charset=utf8') == 'X;Y'
+    assert parse_boundary('multipart/form-data') is None
+    assert parse_boundary(None) is None
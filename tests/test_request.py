@@ -537,6 +537,19 @@ class TestRequestCommon(object):
         result = req.POST
         assert result['var1'] == 'value1'
 
+    def test_POST_is_indexed(self):
+        from webob.multidict import IndexedMultiDict
+        data = b'var1=value1&rep=1&rep=2'
+        environ = {'wsgi.input': BytesIO(data),
+                   'REQUEST_METHOD': 'POST',
+                   'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+                   'CONTENT_LENGTH': len(data),
+                   'webob.is_body_seekable': True,
+                  }
+        req = self._makeOne(environ)
+        assert isinstance(req.POST, IndexedMultiDict)
+        assert req.POST.getall('rep') == ['1', '2']
+
     def test_POST_json_no_content_type(self):
         data = b'{"password": "last centurion", "email": "rory@wiggy.net"}'
         INPUT = BytesIO(data)
@@ -1045,6 +1058,278 @@ class TestRequestCommon(object):
         with pytest.raises(DeprecationWarning):
             getattr(req, 'POST')
 
+    def test_body_file_unbuffered(self):
+        from webob.request import Request, LimitedLengthFile
+        req = Request.blank('/', POST='abc')
+        req.body_file_raw = UnseekableInput(b'abc')
+        req.is_body_seekable = False
+        req.buffered_body_file = False
+        assert isinstance(req.body_file, LimitedLengthFile)
+        assert req.body_file.read() == b'abc'
+        assert req.body_file.read() == b''
+
+    def _compressed_request(self, body, encoding='gzip', **kw):
+        import gzip
+        import zlib
+        from webob.request import Request
+        if encoding == 'gzip':
+            buf = BytesIO()
+            f = gzip.GzipFile(fileobj=buf, mode='wb')
+            f.write(body)
+            f.close()
+            data = buf.getvalue()
+        elif encoding == 'deflate':
+            data = zlib.compress(body)
+        else:
+            c = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            data = c.compress(body) + c.flush()
+            encoding = 'deflate'
+        req = Request.blank('/', method='POST',
+                            body_file=UnseekableInput(data),
+                            content_length=len(data), **kw)
+        req.headers['Content-Encoding'] = encoding
+        req.decompress_body = True
+        return req, data
+
+    @pytest.mark.parametrize('encoding', ['gzip', 'deflate', 'raw-deflate'])
+    def test_decompress_body(self, encoding):
+        body = b'{"a": "' + b'x' * 1000 + b'"}'
+        req, data = self._compressed_request(body, encoding)
+        assert req.body == body
+        assert req.content_length == len(body)
+        assert 'Content-Encoding' not in req.headers
+        assert req.json_body == {'a': 'x' * 1000}
+
+    def test_decompress_body_file_streams(self):
+        body = bytes_(' '.join(str(i) for i in range(20000)))
+        req, data = self._compressed_request(body)
+        f = req.body_file
+        assert f.read(10) == body[:10]
+        assert f.raw.decompressed < len(body)
+        assert f.read() == body[10:]
+        assert f.raw.decompressed == len(body)
+        assert f.raw.compressed == len(data)
+
+    def test_decompress_body_seekable(self):
+        body = bytes_(' '.join(str(i) for i in range(20000)))
+        req, data = self._compressed_request(body)
+        req.body = data
+        req.headers['Content-Encoding'] = 'gzip'
+        assert req.body_file_seekable.read() == body
+        assert req.content_length == len(body)
+
+    def test_decompress_body_POST(self):
+        req, data = self._compressed_request(
+            b'a=1&b=2', content_type='application/x-www-form-urlencoded')
+        assert req.POST == {'a': '1', 'b': '2'}
+
+    def test_decompress_body_to_tempfile(self):
+        body = bytes_(' '.join(str(i) for i in range(20000)))
+        req, data = self._compressed_request(body)
+        req.copy_body()
+        assert not isinstance(req.body_file_raw, BytesIO)
+        assert req.content_length == len(body)
+        assert req.body == body
+
+    def test_decompress_body_ratio_limit(self):
+        from webob.request import DecompressionError
+        req, data = self._compressed_request(b'\0' * 1000000)
+        with pytest.raises(DecompressionError):
+            req.body
+        assert req.headers['Content-Encoding'] == 'gzip'
+
+    def test_decompress_body_invalid(self):
+        from webob.request import Request, DecompressionError
+        req = Request.blank('/', method='POST', body=b'not gzip')
+        req.headers['Content-Encoding'] = 'gzip'
+        req.decompress_body = True
+        with pytest.raises(DecompressionError):
+            req.body
+
+    @py3only
+    @pytest.mark.parametrize('encoding', ['gzip', 'deflate', 'raw-deflate'])
+    def test_decompress_body_truncated(self, encoding):
+        from webob.request import Request, DecompressionError
+        body = bytes_(' '.join(str(i) for i in range(2000)))
+        req, data = self._compressed_request(body, encoding)
+        req = Request.blank('/', method='POST', body=data[:-5])
+        req.headers['Content-Encoding'] = (
+            'gzip' if encoding == 'gzip' else 'deflate')
+        req.decompress_body = True
+        with pytest.raises(DecompressionError):
+            req.body
+
+    def test_decompress_body_empty(self):
+        from webob.request import Request
+        req = Request.blank('/', method='POST', body=b'')
+        req.headers['Content-Encoding'] = 'gzip'
+        req.decompress_body = True
+        assert req.body == b''
+
+    def test_decompressing_file_repr(self):
+        from webob.request import DecompressingFile
+        f = DecompressingFile('dummy', 'gzip')
+        assert repr(f) == "<DecompressingFile('dummy', encoding='gzip')>"
+
+    def test_decompress_body_off(self):
+        req, data = self._compressed_request(b'abc')
+        req.decompress_body = False
+        assert req.body == data
+        assert req.headers['Content-Encoding'] == 'gzip'
+
+    def test_decompress_body_unknown_encoding(self):
+        req, data = self._compressed_request(b'abc')
+        req.headers['Content-Encoding'] = 'br'
+        assert req.body == data
+
+    def test_body_buffer_in_memory(self):
+        from webob.request import Request
+        req = Request.blank('/', method='POST', body=b'abcdef')
+        buf = req.body_buffer
+        assert isinstance(buf, memoryview)
+        assert buf.tobytes() == b'abcdef'
+        del buf
+        req.body = b'xyz'
+        assert req.body_buffer.tobytes() == b'xyz'
+
+    def test_body_buffer_tempfile(self):
+        import hashlib
+        from webob.request import Request
+        body = b'0123456789' * 10000
+        req = Request.blank('/', method='POST',
+                            body_file=UnseekableInput(body),
+                            content_length=len(body))
+        req.request_body_tempfile_limit = 100
+        buf = req.body_buffer
+        assert not isinstance(req.body_file_raw, BytesIO)
+        assert len(buf) == len(body)
+        assert hashlib.md5(buf).digest() == hashlib.md5(body).digest()
+        assert buf[-10:].tobytes() == b'0123456789'
+
+    def test_body_buffer_no_fileno(self):
+        from webob.request import Request
+        class NoFileno(object):
+            def __init__(self):
+                self.f = BytesIO()
+            def write(self, data):
+                self.f.write(data)
+            def read(self, size=-1):
+                return self.f.read(size)
+            def seek(self, pos):
+                self.f.seek(pos)
+            def tell(self):
+                return self.f.tell()
+        body = b'x' * 1000
+        req = Request.blank('/', method='POST',
+                            body_file=UnseekableInput(body),
+                            content_length=len(body))
+        req.request_body_tempfile_limit = 100
+        req.make_tempfile = NoFileno
+        assert req.body_buffer.tobytes() == body
+
+    def test_body_buffer_empty(self):
+        from webob.request import Request
+        req = Request.blank('/')
+        assert req.body_buffer.tobytes() == b''
+
+    def _chunked_request(self, chunks, trailers=b''):
+        from webob.request import Request
+        data = b''.join(
+            bytes_('%x\r\n' % len(c)) + c + b'\r\n' for c in chunks)
+        data += b'0\r\n' + trailers + b'\r\n'
+        req = Request.blank('/', method='PUT')
+        req.body_file_raw = BytesIO(data)
+        req.content_length = None
+        req.headers['Transfer-Encoding'] = 'chunked'
+        req.decode_chunked_body = True
+        return req
+
+    def test_chunked_body_file(self):
+        req = self._chunked_request([b'abc', b'defgh', b'i'],
+                                    b'X-Trailer: 1\r\n')
+        assert req.is_body_readable
+        f = req.body_file.raw
+        assert f.read(2) == b'ab'
+        assert f.read(100) == b'c'
+        assert f.read(100) == b'defgh'
+        assert f.length == 8
+        assert f.read() == b'i'
+        assert f.read() == b''
+        assert f.length == 9
+        assert f.trailers == [b'X-Trailer: 1']
+
+    def test_chunked_body(self):
+        req = self._chunked_request([b'abc', b'defgh'])
+        assert req.body == b'abcdefgh'
+        assert req.content_length == 8
+        assert 'Transfer-Encoding' not in req.headers
+
+    def test_chunked_body_chunk_extension(self):
+        from webob.request import Request
+        req = Request.blank('/', method='PUT')
+        req.body_file_raw = BytesIO(b'3;name=value\r\nabc\r\n0\r\n\r\n')
+        req.content_length = None
+        req.headers['Transfer-Encoding'] = 'chunked'
+        req.decode_chunked_body = True
+        assert req.body == b'abc'
+
+    def test_chunked_body_off(self):
+        req = self._chunked_request([b'abc'])
+        req.decode_chunked_body = False
+        assert not req.is_body_readable
+        assert req.body == b''
+
+    def test_chunked_body_input_terminated(self):
+        from webob.request import Request
+        req = Request.blank('/', method='PUT')
+        req.body_file_raw = BytesIO(b'abc')
+        req.content_length = None
+        req.headers['Transfer-Encoding'] = 'chunked'
+        req.decode_chunked_body = True
+        req.environ['wsgi.input_terminated'] = True
+        assert req.is_body_readable
+        assert req.body == b'abc'
+
+    @pytest.mark.parametrize('data', [
+        b'zz\r\nabc\r\n0\r\n\r\n',
+        b'-3\r\nabc\r\n0\r\n\r\n',
+        b'1' * 5000 + b'\r\nabc\r\n0\r\n\r\n',
+        b'3\r\nabcX\r\n0\r\n\r\n',
+    ])
+    def test_chunked_body_invalid(self, data):
+        from webob.request import Request
+        req = Request.blank('/', method='PUT')
+        req.body_file_raw = BytesIO(data)
+        req.content_length = None
+        req.headers['Transfer-Encoding'] = 'chunked'
+        req.decode_chunked_body = True
+        with pytest.raises(ValueError):
+            req.body
+
+    def test_chunked_body_disconnected(self):
+        from webob.request import Request, DisconnectionError
+        for data in (b'5\r\nabc', b'3\r\nabc\r\n'):
+            req = Request.blank('/', method='PUT')
+            req.body_file_raw = BytesIO(data)
+            req.content_length = None
+            req.headers['Transfer-Encoding'] = 'chunked'
+            req.decode_chunked_body = True
+            with pytest.raises(DisconnectionError):
+                req.body
+
+    def test_chunked_file_repr(self):
+        from webob.request import ChunkedFile
+        assert repr(ChunkedFile('dummy')) == "<ChunkedFile('dummy')>"
+
+    def test_copy_body_short_input(self):
+        from webob.request import Request, DisconnectionError
+        req = Request.blank('/', method='PUT')
+        req.body_file_raw = BytesIO(b'abc')
+        req.content_length = 10
+        req.is_body_seekable = True
+        with pytest.raises(DisconnectionError):
+            req.copy_body()
+
     def test_limited_length_file_repr(self):
         from webob.request import Request
         req = Request.blank('/', POST='x')
@@ -1244,6 +1529,15 @@ class TestBaseRequest(object):
         assert req.headers == {'Qux': 'Spam'}
         assert environ == {'HTTP_QUX': 'Spam'}
 
+    def test_headers_cache_header_keys(self):
+        environ = {'CONTENT_LENGTH': '123', 'HTTP_HOST': 'example.com'}
+        req = self._makeOne(environ)
+        req.cache_header_keys = True
+        assert req.headers.cache_keys
+        assert sorted(req.headers) == ['Content-Length', 'Host']
+        req.headers['Accept'] = 'text/html'
+        assert len(req.headers) == 3
+
     def test_no_headers_deleter(self):
         CONTENT_TYPE = 'application/xml+foobar;charset="utf8"'
         environ = {'CONTENT_TYPE': CONTENT_TYPE,
@@ -2710,6 +3004,58 @@ class TestRequest_functional(object):
         assert req.body_file_raw is old_body_file
         assert req.body_file is old_body_file
 
+    def test_copy_body_known_length_to_tempfile(self):
+        made = []
+        class R(self._getTargetClass()):
+            def make_tempfile(self):
+                made.append(BytesIO())
+                return made[-1]
+        body = b'x' * 100000
+        req = R.blank('/', method='POST',
+                      body_file=UnseekableInput(body), content_length=100000,
+                      request_body_tempfile_limit=10)
+        req.copy_body()
+        assert req.body_file_raw is made[0]
+        assert req.content_length == 100000
+        assert req.body == body
+
+    def test_copy_body_unknown_length_crosses_limit(self):
+        body = b'0123456789' * 3000
+        req = self._blankOne('/', method='PUT',
+                             body_file=UnseekableInput(body),
+                             request_body_tempfile_limit=1000)
+        req.is_body_readable = True
+        req.copy_body()
+        assert not isinstance(req.body_file_raw, BytesIO)
+        assert req.content_length == len(body)
+        assert req.body == body
+
+    def test_copy_body_unknown_length_in_memory(self):
+        req = self._blankOne('/', method='PUT',
+                             body_file=UnseekableInput(b'abc'))
+        req.is_body_readable = True
+        req.copy_body()
+        assert isinstance(req.body_file_raw, BytesIO)
+        assert req.content_length == 3
+        assert req.body == b'abc'
+
+    def test_copy_body_uses_readinto(self):
+        class ReadintoOnly(object):
+            def __init__(self, data):
+                self.f = BytesIO(data)
+            def readinto(self, buff):
+                return self.f.readinto(buff)
+            def seek(self, pos):
+                self.f.seek(pos)
+            def read(self, size=-1): # pragma: no cover
+                raise AssertionError("read() should not be used")
+        req = self._blankOne('/', method='POST',
+                             body_file=ReadintoOnly(b'abcdef'),
+                             content_length=6)
+        req.is_body_seekable = True
+        req.copy_body()
+        assert req.body == b'abcdef'
+
     def test_already_consumed_stream(self):
         from webob.request import Request
         body = 'something'.encode('latin-1')
@@ -3602,6 +3948,46 @@ class TestLimitedLengthFile(object):
         inst = self._makeOne(dummyfile, 0)
         assert inst.fileno() == 1
 
+    def test_readinto_uses_file_readinto(self):
+        class ReadintoFile(object):
+            def __init__(self, data):
+                self.f = BytesIO(data)
+                self.buffers = []
+            def readinto(self, buff):
+                self.buffers.append(buff)
+                return self.f.readinto(buff)
+        f = ReadintoFile(b'0123456789')
+        inst = self._makeOne(f, 6)
+        buff = bytearray(4)
+        assert inst.readinto(buff) == 4
+        assert buff == bytearray(b'0123')
+        assert isinstance(f.buffers[0], memoryview)
+        assert inst.read(10) == b'45'
+        assert inst.read(10) == b''
+
+    def test_readinto_readinto_disconnected(self):
+        from webob.request import DisconnectionError
+        class ReadintoFile(object):
+            def __init__(self, data):
+                self.readinto = BytesIO(data).readinto
+        inst = self._makeOne(ReadintoFile(b'0123'), 6)
+        assert inst.read(10) == b'0123'
+        with pytest.raises(DisconnectionError):
+            inst.read(10)
+
+    def test_readinto_falls_back_to_read(self):
+        inst = self._makeOne(UnseekableInput(b'0123456789'), 6)
+        buff = bytearray(4)
+        assert inst.readinto(buff) == 4
+        assert buff == bytearray(b'0123')
+        assert inst.read(10) == b'45'
+
+    def test_readinto_read_disconnected(self):
+        from webob.request import DisconnectionError
+        inst = self._makeOne(UnseekableInput(b'0123'), 6)
+        with pytest.raises(DisconnectionError):
+            inst.read(10)
+
 
 class Test_environ_from_url(object):
     def _callFUT(self, *arg, **kw):
@@ -1,3 +1,4 @@
+import gzip
 import zlib
 import io
 import sys
@@ -315,6 +316,120 @@ def test_HEAD_conditional_response_range_not_satisfiable_response():
     assert resp.content_range.length == 4
     assert resp.body == b''
 
+def _parse_byteranges(res):
+    import email
+    from webob.compat import PY2
+    message = (b'Content-Type: ' + bytes_(res.headers['Content-Type']) +
+               b'\r\n\r\n' + res.body)
+    if PY2: # pragma: no cover
+        msg = email.message_from_string(message)
+    else:
+        msg = email.message_from_bytes(message)
+    return [(part['Content-Type'], part['Content-Range'],
+             part.get_payload(decode=True)) for part in msg.get_payload()]
+
+def test_conditional_response_multiple_ranges():
+    body = b'0123456789' * 10
+    res = Response(app_iter=iter([body[:33], body[33:]]),
+                   content_type='text/plain', content_length=len(body))
+    req = Request.blank('/', range='bytes=90-,0-4,20-24,-3')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.status_code == 206
+    assert resp.content_type == 'multipart/byteranges'
+    assert resp.content_length == len(resp.body)
+    assert resp.body.endswith(b'--\r\n')
+    assert _parse_byteranges(resp) == [
+        ('text/plain; charset=UTF-8', 'bytes 0-4/100', b'01234'),
+        ('text/plain; charset=UTF-8', 'bytes 20-24/100', b'01234'),
+        ('text/plain; charset=UTF-8', 'bytes 90-99/100', b'0123456789'),
+    ]
+
+def test_conditional_response_multiple_ranges_head():
+    res = Response(body=b'0123456789')
+    req = Request.blank('/', method='HEAD', range='bytes=0-1,5-6')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.status_code == 206
+    assert resp.content_type == 'multipart/byteranges'
+    assert resp.body == b''
+
+def test_conditional_response_multiple_ranges_coalesced():
+    res = Response(body=b'0123456789')
+    req = Request.blank('/', range='bytes=0-3,2-5,8-20')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.status_code == 206
+    assert _parse_byteranges(resp)[1][1:] == ('bytes 8-9/10', b'89')
+    req = Request.blank('/', range='bytes=0-3,2-5,6-7')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.status_code == 206
+    assert tuple(resp.content_range) == (0, 8, 10)
+    assert resp.body == b'01234567'
+
+def test_conditional_response_multiple_ranges_unsatisfiable():
+    res = Response(body=b'0123456789')
+    req = Request.blank('/', range='bytes=20-30,40-')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.status_code == 416
+
+def test_conditional_response_too_many_ranges():
+    class MyResponse(Response):
+        max_ranges = 2
+    res = MyResponse(body=b'0123456789')
+    req = Request.blank('/', range='bytes=0-0,2-2,4-4')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.status_code == 200
+    assert resp.body == b'0123456789'
+
+def test_app_iter_ranges():
+    from webob.response import AppIterRanges
+    class AppIter(object):
+        closed = False
+        def __iter__(self):
+            return iter([b'0123', b'', b'4567', b'89'])
+        def close(self):
+            self.closed = True
+    app_iter = AppIter()
+    ranges = AppIterRanges(app_iter, [(1, 2), (3, 5), (6, 7), (9, 10)], 10,
+                           boundary='XX')
+    assert ranges.content_type == 'multipart/byteranges; boundary=XX'
+    body = b''.join(ranges)
+    assert body == (
+        b'--XX\r\nContent-Range: bytes 1-1/10\r\n\r\n1'
+        b'\r\n--XX\r\nContent-Range: bytes 3-4/10\r\n\r\n34'
+        b'\r\n--XX\r\nContent-Range: bytes 6-6/10\r\n\r\n6'
+        b'\r\n--XX\r\nContent-Range: bytes 9-9/10\r\n\r\n9'
+        b'\r\n--XX--\r\n')
+    assert ranges.content_length == len(body)
+    ranges.close()
+    assert app_iter.closed
+
+def test_app_iter_ranges_stops_reading():
+    from webob.response import AppIterRanges
+    read = []
+    def app_iter():
+        for chunk in [b'012', b'345', b'678']:
+            read.append(chunk)
+            yield chunk
+    ranges = AppIterRanges(app_iter(), [(0, 1), (2, 4)], 9, boundary='XX')
+    list(ranges)
+    assert read == [b'012', b'345']
+
+def test_app_iter_ranges_uses_app_iter_ranges():
+    from webob.response import AppIterRanges
+    class AppIter(object):
+        def __iter__(self):
+            raise AssertionError('read sequentially')
+        def app_iter_ranges(self, ranges):
+            for index, (start, stop) in enumerate(ranges):
+                yield index, b'x' * (stop - start)
+    ranges = AppIterRanges(AppIter(), [(0, 1), (5, 7)], 10,
+                           content_type='text/plain', boundary='XX')
+    assert b''.join(ranges) == (
+        b'--XX\r\nContent-Type: text/plain\r\n'
+        b'Content-Range: bytes 0-0/10\r\n\r\nx'
+        b'\r\n--XX\r\nContent-Type: text/plain\r\n'
+        b'Content-Range: bytes 5-6/10\r\n\r\nxx'
+        b'\r\n--XX--\r\n')
+
 def test_md5_etag():
     res = Response()
     res.body = b"""\
@@ -348,6 +463,107 @@ def test_md5_etag_set_content_md5():
     res.md5_etag(body, set_content_md5=True)
     assert res.content_md5 == 'nhB9nTcrtoJr2B01QqQZ1g=='
 
+class _ClosingAppIter(object):
+    closed = False
+    def __init__(self, chunks):
+        self.chunks = chunks
+    def __iter__(self):
+        return iter(self.chunks)
+    def close(self):
+        self.closed = True
+
+def test_digest_etag():
+    body = b'The quick brown fox jumps over the lazy dog'
+    app_iter = _ClosingAppIter([body[:10], body[10:]])
+    res = Response(app_iter=app_iter)
+    assert res.digest_etag()
+    assert app_iter.closed
+    assert res.app_iter == [body[:10], body[10:]]
+    assert res.content_length == len(body)
+    expected = Response(body=body)
+    expected.md5_etag()
+    assert res.etag == expected.etag
+    assert res.headers['ETag'] == '"%s"' % expected.etag
+
+@pytest.mark.parametrize('algorithm', ['sha256', 'blake2b', 'sha1'])
+def test_digest_etag_algorithm(algorithm):
+    import base64, hashlib
+    if algorithm not in hashlib.algorithms_available:
+        pytest.skip('%s not available' % algorithm)
+    body = b'abc' * 100
+    res = Response(app_iter=iter([body]))
+    res.digest_etag(algorithm)
+    digest = hashlib.new(algorithm, body).digest()
+    assert res.etag == text_(base64.b64encode(digest)).strip('=')
+    res = Response(app_iter=iter([body]))
+    res.digest_etag(hashlib.sha1)
+    assert res.etag == text_(
+        base64.b64encode(hashlib.sha1(body).digest())).strip('=')
+
+def test_digest_etag_too_large():
+    chunks = [bytes_('chunk %d ' % i) for i in range(10)]
+    body = b''.join(chunks)
+    app_iter = _ClosingAppIter(chunks)
+    res = Response(app_iter=app_iter, content_length=len(body),
+                   last_modified=1000000000)
+    assert not res.digest_etag(max_buffer=20)
+    assert res.headers['ETag'].startswith('W/"')
+    assert res.etag_strong is None
+    assert res.content_length == len(body)
+    assert res.body == body
+    assert app_iter.closed
+    etag = res.etag
+    # the same prefix with another length isn't the same body
+    res = Response(app_iter=iter([body + b'!']), last_modified=1000000000)
+    res.digest_etag(max_buffer=20)
+    assert res.etag != etag
+    res = Response(app_iter=iter(chunks), content_length=len(body),
+                   last_modified=1000000000)
+    res.digest_etag(max_buffer=20)
+    assert res.etag == etag
+
+def test_digest_etag_too_large_no_last_modified():
+    # two bodies with the same prefix mustn't get the same etag
+    prefix = b'x' * 30
+    etags = []
+    for body in (prefix + b'a' * 10, prefix + b'b' * 10):
+        res = Response(app_iter=iter([prefix, body[30:]]),
+                       content_length=len(body), etag='old')
+        assert not res.digest_etag(max_buffer=20)
+        assert 'ETag' not in res.headers
+        assert res.body == body
+        etags.append(res.etag)
+    assert etags == [None, None]
+
+def test_digest_etag_unlimited():
+    body = b'x' * 100
+    res = Response(app_iter=iter([body]))
+    assert res.digest_etag(max_buffer=None)
+    assert res.body == body
+
+def test_digest_app_iter():
+    from webob.response import DigestAppIter
+    body = b'The quick brown fox jumps over the lazy dog'
+    app_iter = _ClosingAppIter([body[:10], body[10:]])
+    etags = []
+    digest_iter = DigestAppIter(app_iter, callback=etags.append)
+    assert digest_iter.etag is None
+    assert b''.join(digest_iter) == body
+    assert list(digest_iter) == []
+    expected = Response(body=body)
+    expected.md5_etag()
+    assert digest_iter.etag == expected.etag
+    assert etags == [expected.etag]
+    digest_iter.close()
+    assert app_iter.closed
+
+def test_digest_app_iter_algorithm():
+    import hashlib
+    from webob.response import DigestAppIter
+    digest_iter = DigestAppIter([b'a', b'b'], algorithm='sha256')
+    list(digest_iter)
+    assert digest_iter.digest == hashlib.sha256(b'ab').digest()
+
 def test_decode_content_defaults_to_identity():
     res = Response()
     res.body = b'There be dragons'
@@ -541,6 +757,40 @@ def test_set_headerlist():
     del res.headerlist
     assert res.headerlist == []
 
+def test_headerlist_is_indexed():
+    from webob.headers import HeaderList
+    res = Response(headerlist=[('Content-Type', 'text/plain'),
+                               ('X-Foo', 'bar')], app_iter=[b''])
+    assert isinstance(res.headerlist, HeaderList)
+    res.content_type = 'application/json'
+    res.etag = 'abc'
+    assert res.headerlist == [('Content-Type', 'application/json'),
+                              ('X-Foo', 'bar'),
+                              ('ETag', '"abc"')]
+    res.headerlist.append(('etag', '"def"'))
+    assert res.etag == 'abc'
+    del res.etag
+    assert res.headerlist == [('Content-Type', 'application/json'),
+                              ('X-Foo', 'bar')]
+    res.headerlist = [('Content-Length', '1')]
+    assert isinstance(res.headerlist, HeaderList)
+    assert res.content_length == 1
+
+def test_headerlist_is_copied():
+    l = [('Content-Type', 'text/plain')]
+    res = Response(headerlist=l, app_iter=[b''])
+    assert res.headerlist is not l
+    l.append(('X-Foo', 'bar'))
+    assert 'X-Foo' not in res.headers
+    res.headerlist = l
+    assert res.headerlist is not l
+    l.append(('X-Bar', 'baz'))
+    assert 'X-Bar' not in res.headers
+    hl = res.headerlist
+    res.headerlist = hl
+    assert res.headerlist is hl
+    assert Response(headerlist=hl).headerlist is hl
+
 def test_request_uri_no_script_name():
     from webob.response import _request_uri
     environ = {
@@ -564,6 +814,90 @@ def test_app_iter_range_starts_after_iter_end():
     range = AppIterRange(iter([]), start=1, stop=1)
     assert list(range) == []
 
+@pytest.mark.parametrize('start,stop,expected', [
+    (3, 5, [b'', b'34']),
+    (4, 9, [b'45', b'678']),
+    (7, None, [b'789']),
+])
+def test_app_iter_range_iterator(start, stop, expected):
+    from webob.response import AppIterRange
+    range = AppIterRange(iter([b'012', b'345', b'6789']), start, stop)
+    assert list(range) == expected
+
+class _NoIterList(list):
+    # a list whose chunks before start mustn't be looked at
+    def __init__(self, chunks, skipped):
+        list.__init__(self, chunks)
+        self.skipped = skipped
+    def __getitem__(self, index):
+        result = list.__getitem__(self, index)
+        if isinstance(index, slice):
+            assert index.start == self.skipped
+        return result
+
+@pytest.mark.parametrize('start,stop,expected', [
+    (0, 3, b'012'),
+    (3, 5, b'34'),
+    (4, 9, b'45678'),
+    (7, None, b'789'),
+    (10, None, b''),
+])
+def test_app_iter_range_list(start, stop, expected):
+    from webob.response import AppIterRange
+    chunks = [b'012', b'345', b'6789']
+    assert b''.join(AppIterRange(chunks, start, stop)) == expected
+    assert b''.join(AppIterRange(tuple(chunks), start, stop)) == expected
+
+def test_app_iter_range_list_skips_chunks():
+    from webob.response import AppIterRange
+    range = AppIterRange(_NoIterList([b'012', b'345', b'6789'], 2), 7, 9)
+    assert list(range) == [b'78']
+
+def test_app_iter_range_file():
+    from webob.response import AppIterRange
+    fp = io.BytesIO(b'header' + b'0123456789')
+    fp.seek(6)
+    range = AppIterRange(fp, 3, 6)
+    assert fp.tell() == 9
+    assert b''.join(range) == b'345'
+    range.close()
+    assert fp.closed
+
+def test_app_iter_range_unseekable_file():
+    from webob.response import AppIterRange
+    class Unseekable(io.BytesIO):
+        def seekable(self):
+            return False
+    range = AppIterRange(Unseekable(b'0123456789'), 3, 6)
+    assert b''.join(range) == b'345'
+
+def test_app_iter_range_seek():
+    from webob.response import AppIterRange
+    class AppIter(object):
+        closed = False
+        def __init__(self):
+            self.pos = 0
+        def seek(self, pos):
+            self.pos = pos
+        def __iter__(self):
+            for i in range(self.pos, 10):
+                yield bytes_(str(i))
+        def close(self):
+            self.closed = True
+    app_iter = AppIter()
+    app_iter_range = AppIterRange(app_iter, 5, 8)
+    assert app_iter.pos == 5
+    assert b''.join(app_iter_range) == b'567'
+    app_iter_range.close()
+    assert app_iter.closed
+
+def test_response_app_iter_range_file():
+    fp = io.BytesIO(b'0123456789')
+    res = Response(app_iter=fp, content_length=10)
+    req = Request.blank('/', range='bytes=-3')
+    resp = req.get_response(res.conditional_response_app)
+    assert resp.body == b'789'
+
 def test_resp_write_app_iter_non_list():
     res = Response(app_iter=(b'a', b'b'))
     assert res.content_length is None
@@ -576,9 +910,9 @@ def test_response_file_body_writelines():
     res = Response(app_iter=[b'foo'])
     rbo = ResponseBodyFile(res)
     rbo.writelines(['bar', 'baz'])
-    assert res.app_iter == [b'foo', b'bar', b'baz']
+    assert res.app_iter == [b'foo', b'barbaz']
     rbo.flush() # noop
-    assert res.app_iter, [b'foo', b'bar', b'baz']
+    assert res.app_iter, [b'foo', b'barbaz']
 
 @pytest.mark.xfail(sys.version_info >= (3,6),
                    reason="Python 3.6 and up requires that rbo is seekable.")
@@ -599,6 +933,65 @@ def test_response_file_body_tell_text():
     rbo.write('123456789')
     assert rbo.tell() == 9
 
+def test_response_write_coalesces_small_chunks():
+    class MyResponse(Response):
+        write_block_size = 10
+    res = MyResponse(body=b'head')
+    for i in range(7):
+        res.write(b'abc')
+    assert res._raw_app_iter == [b'head', b'abcabcabcabc', b'abc', b'abc',
+                                 b'abc']
+    # what's left below a block is joined when the app_iter is read
+    assert res.app_iter == [b'head', b'abcabcabcabc', b'abcabcabc']
+    res.write(b'0123456789ab')
+    res.write(b'xy')
+    assert res.app_iter == [b'head', b'abcabcabcabc', b'abcabcabc',
+                            b'0123456789ab', b'xy']
+    assert res.content_length == 39
+    assert res.body_file.tell() == 39
+
+def test_response_write_small_page():
+    res = Response(app_iter=[])
+    for i in range(3000):
+        res.write(b'0123456789')
+    assert res.body_file.tell() == 30000
+    assert res.app_iter == [b'0123456789' * 3000]
+    res = Response(app_iter=[])
+    for i in range(1000):
+        res.write(b'x' * 100)
+    assert res.body == b'x' * 100000
+    assert len(res.app_iter) == 1
+    res = Response(app_iter=[])
+    for i in range(1000):
+        res.write(b'x' * 100)
+    app_iter = res({'REQUEST_METHOD': 'GET'}, lambda *args: None)
+    assert [len(chunk) for chunk in app_iter] == [65600, 34400]
+
+def test_response_write_no_coalescing():
+    class MyResponse(Response):
+        write_block_size = 0
+    res = MyResponse(app_iter=[])
+    for i in range(3):
+        res.write(b'a' * 100)
+    assert res.app_iter == [b'a' * 100] * 3
+
+def test_response_file_body_tell_is_tracked():
+    res = Response(app_iter=[])
+    rbo = res.body_file
+    for i in range(100):
+        rbo.write(b'x' * i)
+        assert rbo.tell() == i * (i + 1) // 2
+    # changes made behind write's back are noticed
+    res.app_iter.append(b'12345')
+    assert rbo.tell() == 4955
+    rbo.write(b'6')
+    assert rbo.tell() == 4956
+    res.body = b'abc'
+    assert rbo.tell() == 3
+    rbo.write(b'd')
+    assert rbo.tell() == 4
+    assert res.body == b'abcd'
+
 def test_response_write_non_str():
     res = Response()
     with pytest.raises(TypeError):
@@ -1005,6 +1398,154 @@ def test_location():
                    "added due to https://github.com/Pylons/webob/issues/247. "
                    "PEP3333 requires environ variables are str, Django messes "
                    "with the environ and changes it from str to unicode.")
+def test_cache_headerlist():
+    class MyResponse(Response):
+        cache_headerlist = True
+    res = MyResponse(body=b'ok', location='/here')
+    seen = []
+    def start_response(status, headerlist):
+        seen.append(headerlist)
+        # servers may add their own headers
+        headerlist.append(('Server', 'test'))
+    environ = Request.blank('/a/b').environ
+    assert res(environ, start_response) == [b'ok']
+    res(environ, start_response)
+    cache = res._headerlist_cache
+    assert seen[0] is not seen[1]
+    assert seen[1] == seen[0]
+    assert ('Location', 'http://localhost/here') in seen[0]
+    assert ('Server', 'test') not in res.headerlist
+    assert res.headers['Location'] == '/here'
+    res(environ, start_response)
+    assert res._headerlist_cache is cache
+    # relative Locations are resolved for each request URI
+    res.location = 'there'
+    res(environ, start_response)
+    assert ('Location', 'http://localhost/a/there') in seen[-1]
+    res(Request.blank('/c/d').environ, start_response)
+    assert ('Location', 'http://localhost/c/there') in seen[-1]
+    res(environ, start_response)
+    assert ('Location', 'http://localhost/a/there') in seen[-1]
+    assert len(res._headerlist_cache[4]) == 2
+    # any change to the headers is picked up
+    res.content_type = 'text/plain'
+    res.headers['X-Foo'] = 'bar'
+    res(environ, start_response)
+    assert ('Content-Type', 'text/plain; charset=UTF-8') in seen[-1]
+    assert ('X-Foo', 'bar') in seen[-1]
+    res.headerlist = [('Content-Length', '2')]
+    res(environ, start_response)
+    assert seen[-1] == [('Content-Length', '2'), ('Server', 'test')]
+
+def test_cache_headerlist_location_cache_size(monkeypatch):
+    from webob import response
+    monkeypatch.setattr(response, '_LOCATION_CACHE_SIZE', 2)
+    class MyResponse(Response):
+        cache_headerlist = True
+    res = MyResponse(location='x')
+    for path in ('/a/', '/b/', '/c/'):
+        resp = Request.blank(path).get_response(res)
+        assert resp.location == 'http://localhost%sx' % path
+    assert len(res._headerlist_cache[4]) == 1
+
+def test_cache_headerlist_conditional():
+    class MyResponse(Response):
+        cache_headerlist = True
+    res = MyResponse(body=b'ok', etag='abc', conditional_response=True)
+    req = Request.blank('/', if_none_match='"abc"')
+    assert req.get_response(res).status_code == 304
+    assert req.get_response(res).status_code == 304
+    res.etag = 'def'
+    resp = req.get_response(res)
+    assert resp.status_code == 200
+    assert resp.etag == 'def'
+
+def test_canned_response():
+    from webob.response import CannedResponse
+    canned = CannedResponse(b'ok', content_type='text/plain')
+    assert canned.status == '200 OK'
+    assert canned.status_code == 200
+    assert canned.body == b'ok'
+    assert repr(canned).startswith('<CannedResponse at 0x')
+    for i in range(2):
+        resp = Request.blank('/').get_response(canned)
+        assert resp.body == b'ok'
+        assert resp.content_type == 'text/plain'
+        assert resp.content_length == 2
+    resp = Request.blank('/', method='HEAD').get_response(canned)
+    assert resp.body == b''
+    assert resp.content_length == 2
+    with pytest.raises(AttributeError):
+        canned.body = b'changed'
+    with pytest.raises(AttributeError):
+        del canned.status
+
+def test_canned_response_start_response_gets_a_copy():
+    from webob.response import CannedResponse
+    canned = CannedResponse(b'ok')
+    def start_response(status, headerlist):
+        headerlist.append(('Server', 'test'))
+    canned(Request.blank('/').environ, start_response)
+    assert ('Server', 'test') not in canned.headerlist
+
+def test_canned_response_from_response():
+    from webob.response import CannedResponse
+    res = Response(app_iter=iter([b'a', b'b']), status=404)
+    canned = CannedResponse.from_response(res)
+    res.body = b'changed'
+    assert canned.status == '404 Not Found'
+    assert canned.body == b'ab'
+    assert Request.blank('/').get_response(canned).body == b'ab'
+
+def test_canned_response_location():
+    from webob.response import CannedResponse
+    canned = CannedResponse(status=302, location='there',
+                            conditional_response=True, etag='abc')
+    for path in ('/a/', '/b/', '/a/'):
+        resp = Request.blank(path).get_response(canned)
+        assert resp.location == 'http://localhost%sthere' % path
+    resp = Request.blank('/c/', if_none_match='"abc"').get_response(canned)
+    assert resp.status_code == 304
+    assert resp.location == 'http://localhost/c/there'
+    canned = CannedResponse(status=302, location='http://example.com/')
+    resp = Request.blank('/').get_response(canned)
+    assert resp.location == 'http://example.com/'
+
+def test_canned_response_location_cache_size(monkeypatch):
+    from webob import response
+    monkeypatch.setattr(response, '_LOCATION_CACHE_SIZE', 1)
+    canned = response.CannedResponse(status=302, location='x')
+    for path in ('/a/', '/b/'):
+        resp = Request.blank(path).get_response(canned)
+        assert resp.location == 'http://localhost%sx' % path
+
+def test_canned_response_conditional():
+    import datetime
+    from webob.response import CannedResponse
+    from webob.datetime_utils import UTC
+    modified = datetime.datetime(2020, 1, 1, tzinfo=UTC)
+    canned = CannedResponse(b'ok', etag='abc', last_modified=modified,
+                            conditional_response=True)
+    def get(**kw):
+        return Request.blank('/', **kw).get_response(canned)
+    resp = get(if_none_match='"abc"')
+    assert resp.status_code == 304
+    assert resp.body == b''
+    assert resp.content_length is None
+    assert resp.etag == 'abc'
+    assert get(if_none_match='"x", W/"abc"').status_code == 304
+    assert get(if_none_match='"x"').status_code == 200
+    assert get(if_modified_since=modified).status_code == 304
+    later = modified + datetime.timedelta(days=1)
+    assert get(if_modified_since=later).status_code == 304
+    earlier = modified - datetime.timedelta(days=1)
+    assert get(if_modified_since=earlier).status_code == 200
+    assert get(headers={'If-Modified-Since': 'junk'}).status_code == 200
+    assert get(method='POST', if_none_match='"abc"').status_code == 200
+    assert get().status_code == 200
+    canned = CannedResponse(b'ok', etag='abc')
+    assert get(if_none_match='"abc"').status_code == 200
+
 def test_location_unicode():
     environ = {
         'REQUEST_METHOD': 'GET',
@@ -1198,6 +1739,213 @@ def test_encode_content_gzip_buffer_coverage():
     result = list(res.app_iter)
     assert len(b"".join(result)) < len(DATA)
 
+def test_encode_content_deflate():
+    res = Response(app_iter=[b'foo' * 100])
+    res.encode_content('deflate')
+    assert res.content_encoding == 'deflate'
+    assert res.content_length == len(res.body)
+    res.decode_content()
+    assert res.body == b'foo' * 100
+
+def test_encode_content_level():
+    data = b'foo' * 1000
+    stored = Response(app_iter=[data])
+    stored.encode_content('gzip', level=0)
+    assert stored.content_length > len(data)
+    res = Response(app_iter=[data])
+    res.encode_content('gzip')
+    assert res.content_length < 100
+    stored.decode_content()
+    assert stored.body == data
+
+def test_encode_content_recodes():
+    res = Response(app_iter=[b'foo' * 100])
+    res.encode_content('deflate')
+    res.encode_content('gzip')
+    assert res.content_encoding == 'gzip'
+    res.decode_content()
+    assert res.body == b'foo' * 100
+
+def _compressible_response(**kw):
+    kw.setdefault('body', b'x' * 1000)
+    kw.setdefault('content_type', 'application/json')
+    return Response(**kw)
+
+def test_encode_content_for():
+    req = BaseRequest.blank('/', headers={'Accept-Encoding': 'deflate, gzip'})
+    res = _compressible_response()
+    res.vary = 'Cookie'
+    assert res.encode_content_for(req, level=1) == 'gzip'
+    assert res.content_encoding == 'gzip'
+    assert res.vary == ('Cookie', 'Accept-Encoding')
+    res.decode_content()
+    assert res.body == b'x' * 1000
+
+def test_encode_content_for_not_accepted():
+    req = BaseRequest.blank('/')
+    res = _compressible_response()
+    assert res.encode_content_for(req) is None
+    assert res.content_encoding is None
+    assert res.vary == ('Accept-Encoding',)
+    req.headers['Accept-Encoding'] = 'br'
+    assert res.encode_content_for(req) is None
+    assert res.vary == ('Accept-Encoding',)
+
+@pytest.mark.parametrize('kw', [
+    {'content_type': 'image/png'},
+    {'body': b'{}'},
+    {'status': 304},
+    {'cache_control': 'no-transform'},
+    {'content_encoding': 'br'},
+])
+def test_encode_content_for_not_compressible(kw):
+    req = BaseRequest.blank('/', headers={'Accept-Encoding': 'gzip'})
+    res = _compressible_response(**kw)
+    assert res.encode_content_for(req) is None
+    assert res.vary is None
+
+def test_encode_content_for_no_content_type():
+    req = BaseRequest.blank('/', headers={'Accept-Encoding': 'gzip'})
+    res = _compressible_response()
+    del res.content_type
+    assert res.encode_content_for(req) is None
+    assert res.content_encoding is None
+
+def test_gzip_app_iter():
+    from webob.response import gzip_app_iter
+    data = b''.join(gzip_app_iter([b'abc', b'def'], level=1))
+    assert gzip.GzipFile(fileobj=io.BytesIO(data)).read() == b'abcdef'
+
+def test_encode_content_for_policy_attributes():
+    class MyResponse(Response):
+        compressible_types = None
+        compress_min_size = 0
+        compress_encodings = ('deflate',)
+    req = BaseRequest.blank('/', headers={'Accept-Encoding': 'gzip, deflate'})
+    res = MyResponse(body=b'{}', content_type='image/png')
+    assert res.encode_content_for(req) == 'deflate'
+
+def test_encode_content_for_streaming():
+    req = BaseRequest.blank('/', headers={'Accept-Encoding': 'gzip'})
+    res = Response(app_iter=iter([b'a', b'b']), content_type='text/plain')
+    assert res.encode_content_for(req, lazy=True) == 'gzip'
+    assert res.content_length is None
+    assert gzip.GzipFile(fileobj=io.BytesIO(res.body)).read() == b'ab'
+
+def test_encode_content_lazy_flush():
+    def app_iter():
+        for i in range(3):
+            yield bytes_('data: %d\n\n' % i)
+    res = Response(app_iter=app_iter(), content_type='text/event-stream')
+    res.encode_content('gzip', lazy=True, flush_every=1)
+    decompress = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    seen = [decompress.decompress(chunk) for chunk in res.app_iter]
+    assert seen[1:4] == [b'data: 0\n\n', b'data: 1\n\n', b'data: 2\n\n']
+
+def test_encode_content_parallel():
+    class Pool(object):
+        blocks = 0
+        def map(self, func, iterable):
+            result = [func(args) for args in iterable]
+            self.blocks += len(result)
+            return result
+    class MyResponse(Response):
+        parallel_compression_threshold = 1000
+        parallel_compression_block_size = 300
+        parallel_compression_pool = Pool()
+    data = b'foo bar baz ' * 100
+    res = MyResponse(app_iter=iter([data]))
+    res.encode_content('gzip')
+    assert MyResponse.parallel_compression_pool.blocks == 4
+    assert res.content_length == len(res.body)
+    res.decode_content()
+    assert res.body == data
+    # bodies below the threshold are compressed as usual
+    res = MyResponse(app_iter=[data[:999]])
+    res.encode_content('deflate')
+    assert MyResponse.parallel_compression_pool.blocks == 4
+    res.decode_content()
+    assert res.body == data[:999]
+
+def test_encode_content_cache():
+    from webob.compression import CompressionCache
+    class MyResponse(Response):
+        compression_cache = CompressionCache()
+    cache = MyResponse.compression_cache
+    data = b'foo bar baz ' * 100
+    res = MyResponse(app_iter=[data])
+    res.encode_content('gzip')
+    body = res.body
+    assert (cache.hits, cache.misses) == (0, 1)
+    res = MyResponse(app_iter=[data])
+    res.encode_content('gzip')
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert res.body == body
+    assert res.content_length == len(body)
+    assert res.content_encoding == 'gzip'
+    # the level is part of the key
+    res = MyResponse(app_iter=[data])
+    res.encode_content('gzip', level=1)
+    assert (cache.hits, cache.misses) == (1, 2)
+    # so is the body
+    res = MyResponse(app_iter=[data + b'!'])
+    res.encode_content('gzip')
+    assert (cache.hits, cache.misses) == (1, 3)
+    res.decode_content()
+    assert res.body == data + b'!'
+
+def test_encode_content_cache_etag():
+    from webob.compression import CompressionCache
+    class MyResponse(Response):
+        compression_cache = CompressionCache()
+    cache = MyResponse.compression_cache
+    data = b'foo bar baz ' * 100
+    class AppIter(object):
+        closed = False
+        def __iter__(self):
+            return iter([data])
+        def close(self):
+            self.closed = True
+    res = MyResponse(app_iter=AppIter(), etag='abc',
+                     content_length=len(data))
+    res.encode_content('gzip', lazy=True)
+    assert res.content_length is None
+    body = b''.join(res.app_iter)
+    assert (cache.hits, cache.misses) == (0, 1)
+    app_iter = AppIter()
+    res = MyResponse(app_iter=app_iter, etag='abc', content_length=len(data))
+    res.encode_content('gzip', lazy=True)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert app_iter.closed
+    assert res.body == body
+    assert res.content_length == len(body)
+    # the same ETag with another type isn't the same body
+    res = MyResponse(app_iter=[data], etag='abc', content_type='text/plain',
+                     content_length=len(data))
+    res.encode_content('gzip')
+    assert (cache.hits, cache.misses) == (1, 2)
+    # weak ETags aren't used, lazily encoded bodies aren't cached then
+    res = MyResponse(app_iter=[data])
+    res.headers['ETag'] = 'W/"abc"'
+    res.encode_content('gzip', lazy=True)
+    b''.join(res.app_iter)
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(cache) == 2
+
+def test_encode_content_cache_parallel():
+    from webob.compression import CompressionCache
+    class MyResponse(Response):
+        compression_cache = CompressionCache()
+        parallel_compression_threshold = 1000
+    data = b'foo bar baz ' * 100
+    res = MyResponse(app_iter=[data])
+    res.encode_content('gzip')
+    body = res.body
+    res = MyResponse(app_iter=[data])
+    res.encode_content('gzip')
+    assert MyResponse.compression_cache.hits == 1
+    assert res.body == body
+
 def test_decode_content_identity():
     res = Response()
     res.content_encoding = 'identity'
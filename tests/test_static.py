@@ -5,6 +5,7 @@ from time import gmtime
 import os
 import shutil
 import unittest
+import zlib
 
 from webob import static
 from webob.compat import bytes_
@@ -55,6 +56,16 @@ class TestFileApp(unittest.TestCase):
         self.assertEqual(resp3.last_modified.timetuple(), gmtime(getmtime(self.tempfile)))
         self.assertEqual(resp3.body, bytes_('this'))
 
+    def test_fileapp_multiple_ranges(self):
+        app = static.FileApp(self.tempfile)
+        resp = get_response(app, range='bytes=0-1,7-')
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.content_type, 'multipart/byteranges')
+        self.assertEqual(resp.content_length, len(resp.body))
+        assert b'Content-Range: bytes 0-1/12\r\n\r\nim\r\n' in resp.body
+        assert b'Content-Range: bytes 7-11/12\r\n\r\nthis\n\r\n' \
+            in resp.body
+
     def test_unexisting_file(self):
         app = static.FileApp('/tmp/this/doesnt/exist')
         self.assertEqual(404, get_response(app).status_code)
@@ -104,6 +115,59 @@ class TestFileApp(unittest.TestCase):
         self.assertEqual(static.BLOCK_SIZE, app_iter.block_size)
 
 
+    def test_etag_from_stat(self):
+        os.utime(self.tempfile, (1000000000, 1000000000))
+        app = static.FileApp(self.tempfile)
+        resp = get_response(app)
+        st = os.stat(self.tempfile)
+        assert resp.headers['ETag'].startswith(
+            '"%x-%x-' % (st.st_ino, st.st_size))
+        resp = get_response(app, if_none_match=resp.etag)
+        self.assertEqual(resp.status_code, 304)
+        os.utime(self.tempfile, (1000000001, 1000000001))
+        self.assertEqual(
+            get_response(app, if_none_match=resp.etag).status_code, 200)
+
+    def test_etag_recently_modified_is_weak(self):
+        app = static.FileApp(self.tempfile)
+        resp = get_response(app)
+        assert resp.headers['ETag'].startswith('W/"')
+
+    def test_etag_from_content(self):
+        opened = []
+        def open_(*args):
+            opened.append(args)
+            return open(*args)
+        app = static.FileApp(self.tempfile, etag_source='content')
+        app._open = open_
+        resp = get_response(app)
+        expected = Response(b"import this\n")
+        expected.md5_etag()
+        self.assertEqual(resp.etag, expected.etag)
+        self.assertEqual(len(opened), 2)
+        resp = get_response(app, if_none_match=resp.etag)
+        self.assertEqual(resp.status_code, 304)
+        # the digest is only computed again when the file changes
+        self.assertEqual(len(opened), 3)
+        create_file('import that\n', self.tempfile)
+        os.utime(self.tempfile, (1000000000, 1000000000))
+        resp = get_response(app, if_none_match=resp.etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(opened), 5)
+
+    def test_etag_disabled(self):
+        app = static.FileApp(self.tempfile, etag_source=None)
+        self.assertEqual(get_response(app).etag, None)
+
+    def test_etag_fixed(self):
+        app = static.FileApp(self.tempfile, etag='abc')
+        self.assertEqual(get_response(app).etag, 'abc')
+
+    def test_invalid_etag_source(self):
+        self.assertRaises(ValueError, static.FileApp, self.tempfile,
+                          etag_source='md5')
+
+
 class TestFileIter(unittest.TestCase):
     def test_empty_file(self):
         fp = BytesIO()
@@ -156,6 +220,150 @@ class TestFileIter(unittest.TestCase):
         self.assertRaises(StopIteration, next, i)
 
 
+    def test_ranges(self):
+        fp = BytesIO(bytes_("0123456789"))
+        i = static.FileIter(fp).app_iter_ranges([(1, 3), (6, 10)],
+                                                block_size=3)
+
+        self.assertEqual(list(i), [
+            (0, bytes_("12")), (1, bytes_("678")), (1, bytes_("9"))])
+        self.assertTrue(fp.closed)
+
+    def test_ranges_past_end(self):
+        fp = BytesIO(bytes_("0123456789"))
+        i = static.FileIter(fp).app_iter_ranges([(8, 12), (20, 30)])
+
+        self.assertEqual(list(i), [(0, bytes_("89"))])
+
+
+
+class TestSendfileIter(unittest.TestCase):
+    def test_iter(self):
+        fp = BytesIO(bytes_("0123456789"))
+        i = static.SendfileIter(fp, block_size=4)
+
+        self.assertEqual(list(i), [bytes_("0123"), bytes_("4567"),
+                                   bytes_("89")])
+        self.assertTrue(fp.closed)
+
+    def test_offset_and_length(self):
+        fp = BytesIO(bytes_("0123456789"))
+        i = static.SendfileIter(fp, offset=2, length=5)
+
+        self.assertEqual(list(i), [bytes_("23456")])
+
+    def test_zero_length(self):
+        fp = BytesIO(bytes_("0123456789"))
+        self.assertEqual(list(static.SendfileIter(fp, length=0)), [])
+        self.assertTrue(fp.closed)
+
+    def test_app_iter_range(self):
+        fp = BytesIO(bytes_("0123456789"))
+        i = static.SendfileIter(fp, offset=1, length=8)
+
+        r = i.app_iter_range(2, 5)
+        self.assertEqual((r.offset, r.length), (3, 3))
+        r = i.app_iter_range(2, 50)
+        self.assertEqual((r.offset, r.length), (3, 6))
+        r = i.app_iter_range(2)
+        self.assertEqual((r.offset, r.length), (3, 6))
+        r = static.SendfileIter(fp).app_iter_range(2)
+        self.assertEqual((r.offset, r.length), (2, None))
+        r = i.app_iter_range(seek=4, limit=2)
+        self.assertEqual((r.offset, r.length), (5, 0))
+        self.assertEqual(list(i.app_iter_range(2, 5)), [bytes_("345")])
+
+    def test_app_iter_ranges(self):
+        fp = BytesIO(bytes_("0123456789"))
+        i = static.SendfileIter(fp, offset=2)
+
+        self.assertEqual(list(i.app_iter_ranges([(0, 2), (5, 7)])),
+                         [(0, bytes_("23")), (1, bytes_("78"))])
+
+    def test_close(self):
+        fp = BytesIO(bytes_("0123456789"))
+        static.SendfileIter(fp).close()
+        self.assertTrue(fp.closed)
+
+    def test_fileno(self):
+        with tempfile.TemporaryFile() as fp:
+            self.assertEqual(static.SendfileIter(fp).fileno(), fp.fileno())
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'no os.sendfile')
+    def test_sendfile(self):
+        with tempfile.TemporaryFile() as src:
+            src.write(bytes_("0123456789"))
+            src.flush()
+            for offset, length, expected in [
+                    (0, None, "0123456789"), (3, 4, "3456"), (8, 10, "89"),
+                    (20, None, "")]:
+                with tempfile.TemporaryFile() as out:
+                    i = static.SendfileIter(src, offset, length)
+                    self.assertEqual(i.sendfile(out), len(expected))
+                    out.seek(0)
+                    self.assertEqual(out.read(), bytes_(expected))
+
+
+class TestSendfileServerHandler(unittest.TestCase):
+    def setUp(self):
+        fp = tempfile.NamedTemporaryFile(delete=False)
+        self.tempfile = fp.name
+        fp.write(bytes_("0123456789"))
+        fp.close()
+
+    def tearDown(self):
+        os.unlink(self.tempfile)
+
+    def _run(self, app, out, **req_kw):
+        environ = Request.blank('/', **req_kw).environ
+        handler = static.SendfileServerHandler(
+            BytesIO(), out, BytesIO(), environ)
+        handler.request_handler = self
+        handler.run(app)
+
+    def log_request(self, code, size):
+        self.logged = (code, size)
+
+    def _response(self, out):
+        out.seek(0)
+        head, body = out.read().split(bytes_('\r\n\r\n'), 1)
+        return head, body
+
+    def test_no_file_wrapper(self):
+        environs = []
+        def app(environ, start_response):
+            environs.append(environ)
+            return static.FileApp(self.tempfile)(environ, start_response)
+        self._run(app, BytesIO())
+        self.assertNotIn('wsgi.file_wrapper', environs[0])
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'no os.sendfile')
+    def test_sendfile(self):
+        with tempfile.TemporaryFile() as out:
+            self._run(static.FileApp(self.tempfile), out)
+            head, body = self._response(out)
+        self.assertEqual(body, bytes_("0123456789"))
+        assert bytes_('Content-Length: 10') in head
+        self.assertEqual(self.logged, ('200', 10))
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'no os.sendfile')
+    def test_sendfile_range(self):
+        with tempfile.TemporaryFile() as out:
+            self._run(static.FileApp(self.tempfile), out, range=(2, 5))
+            head, body = self._response(out)
+        assert head.startswith(bytes_('HTTP/1.0 206'))
+        self.assertEqual(body, bytes_("234"))
+
+    def test_no_fileno(self):
+        out = BytesIO()
+        self._run(static.FileApp(self.tempfile), out)
+        self.assertEqual(self._response(out)[1], bytes_("0123456789"))
+
+    def test_other_app_iter(self):
+        out = BytesIO()
+        self._run(Response(b'abc'), out)
+        self.assertEqual(self._response(out)[1], bytes_("abc"))
+
 
 class TestDirectoryApp(unittest.TestCase):
     def setUp(self):
@@ -211,6 +419,26 @@ class TestDirectoryApp(unittest.TestCase):
         self.assertEqual(200, resp.status_code)
         self.assertEqual('xxx/yyy', resp.content_type)
 
+    def test_content_etag_computed_once(self):
+        path = create_file('abc', self.test_dir, 'a.txt')
+        os.utime(path, (1000000000, 1000000000))
+        opened = []
+        def open_(*args):
+            opened.append(args)
+            return open(*args)
+        class App(static.DirectoryApp):
+            def make_fileapp(self, path):
+                app = static.DirectoryApp.make_fileapp(self, path)
+                app._open = open_
+                return app
+        app = App(self.test_dir, etag_source='content')
+        etag = get_response(app, '/a.txt').etag
+        self.assertEqual(len(opened), 2)
+        resp = get_response(app, '/a.txt', if_none_match=etag)
+        self.assertEqual(resp.status_code, 304)
+        # only opened to be served
+        self.assertEqual(len(opened), 3)
+
     def test_file_app_factory(self):
         def make_fileapp(*args, **kwargs):
             make_fileapp.called = True
@@ -252,3 +480,548 @@ class TestDirectoryApp(unittest.TestCase):
         self.assertTrue(resp.location.endswith('/index-test/?test'))
         page_app = static.DirectoryApp(self.test_dir, index_page='something-else.html')
         self.assertEqual(get_response(page_app, '/index-test/').status_code, 404)
+
+
+class TestPrecompressed(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.body = b'var x = 1;\n' * 100
+        self.path = create_file(self.body, self.test_dir, 'app.js')
+        os.utime(self.path, (1000000000, 1000000000))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def _gzip(self):
+        written = static.precompress(self.test_dir)
+        self.assertEqual(written, [self.path + '.gz'])
+        with open(self.path + '.gz', 'rb') as f:
+            return f.read()
+
+    def test_precompress(self):
+        data = self._gzip()
+        self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS),
+                         self.body)
+        self.assertEqual(os.path.getmtime(self.path + '.gz'),
+                         os.path.getmtime(self.path))
+        # fresh files aren't compressed again
+        self.assertEqual(static.precompress(self.test_dir), [])
+
+    def test_precompress_replaces_stale(self):
+        self._gzip()
+        body = self.body * 2
+        create_file(body, self.path)
+        mtime = os.path.getmtime(self.path + '.gz') + 10
+        os.utime(self.path, (mtime, mtime))
+        data = self._gzip()
+        self.assertEqual(zlib.decompress(data, 16 + zlib.MAX_WBITS), body)
+        self.assertEqual(sorted(os.listdir(self.test_dir)),
+                         ['app.js', 'app.js.gz'])
+
+    def test_precompress_pool(self):
+        class SerialPool(object):
+            def map(self, func, iterable):
+                return [func(args) for args in iterable]
+        written = static.precompress(self.test_dir, pool=SerialPool())
+        self.assertEqual(written, [self.path + '.gz'])
+
+    def test_precompress_skips(self):
+        create_file('small', self.test_dir, 'small.js')
+        create_file(self.body, self.test_dir, 'image.png')
+        self.assertEqual(static.precompress(self.test_dir),
+                         [self.path + '.gz'])
+        self.assertEqual(
+            static.precompress(self.test_dir, extensions=None, min_size=0),
+            [os.path.join(self.test_dir, 'image.png.gz')])
+
+    def test_precompress_not_smaller(self):
+        self._gzip()
+        create_file(os.urandom(1000), self.path)
+        self.assertEqual(static.precompress(self.test_dir), [])
+        self.assertEqual(os.listdir(self.test_dir), ['app.js'])
+
+    def test_precompress_encodings(self):
+        written = static.precompress(self.test_dir,
+                                     encodings=[('deflate', '.zz')])
+        self.assertEqual(written, [self.path + '.zz'])
+        self.assertRaises(ValueError, static.precompress, self.test_dir,
+                          encodings=['deflate'])
+        self.assertRaises(ValueError, static.precompress, self.test_dir,
+                          encodings=['br'])
+
+    def test_serve_precompressed(self):
+        data = self._gzip()
+        app = static.DirectoryApp(self.test_dir, precompressed=True)
+        resp = get_response(app, '/app.js', accept_encoding='br, gzip')
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual(resp.content_type, 'text/javascript')
+        self.assertEqual(resp.vary, ('Accept-Encoding',))
+        self.assertEqual(resp.body, data)
+        resp = get_response(app, '/app.js', accept_encoding='gzip',
+                            range=(0, 10))
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.body, data[:10])
+        self.assertEqual(resp.content_range.length, len(data))
+
+    def test_serve_identity(self):
+        self._gzip()
+        app = static.DirectoryApp(self.test_dir, precompressed=True)
+        for accept_encoding in (None, 'identity', 'gzip;q=0, *'):
+            resp = get_response(app, '/app.js',
+                                accept_encoding=accept_encoding)
+            self.assertEqual(resp.content_encoding, None)
+            self.assertEqual(resp.vary, ('Accept-Encoding',))
+            self.assertEqual(resp.body, self.body)
+
+    def test_stale_precompressed(self):
+        self._gzip()
+        os.utime(self.path, (1000000001, 1000000001))
+        app = static.DirectoryApp(self.test_dir, precompressed=True)
+        resp = get_response(app, '/app.js', accept_encoding='gzip')
+        self.assertEqual(resp.content_encoding, None)
+        self.assertEqual(resp.body, self.body)
+
+    def test_index_page(self):
+        os.rename(self.path, os.path.join(self.test_dir, 'index.html'))
+        static.precompress(self.test_dir)
+        app = static.DirectoryApp(self.test_dir, precompressed=True,
+                                  stat_cache=static.StatCache())
+        resp = get_response(app, '/', accept_encoding='gzip')
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual(resp.content_type, 'text/html')
+
+    def test_missing_file(self):
+        app = static.DirectoryApp(self.test_dir, precompressed=True)
+        req = Request.blank('/', accept_encoding='gzip')
+        self.assertEqual(app._precompressed_app(
+            req, os.path.join(self.test_dir, 'missing.js')), None)
+
+    def test_disabled(self):
+        self._gzip()
+        app = static.DirectoryApp(self.test_dir)
+        resp = get_response(app, '/app.js', accept_encoding='gzip')
+        self.assertEqual(resp.content_encoding, None)
+        self.assertEqual(resp.vary, None)
+
+
+class TestFileCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = create_file(b'icon', self.test_dir, 'favicon.ico')
+        os.utime(self.path, (1000000000, 1000000000))
+        self.cache = static.FileCache(ttl=None)
+        self.app = static.DirectoryApp(self.test_dir, file_cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_cached(self):
+        resp = get_response(self.app, '/favicon.ico')
+        self.assertEqual(resp.body, b'icon')
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 4)
+        os.remove(self.path)
+        resp = get_response(self.app, '/favicon.ico')
+        self.assertEqual(resp.body, b'icon')
+        self.assertEqual(resp.content_type, 'image/x-icon')
+        self.assertEqual(resp.content_length, 4)
+        assert resp.etag
+        assert resp.last_modified
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertEqual(get_response(self.app, '/favicon.ico',
+                                      method='HEAD').body, b'')
+
+    def test_conditional(self):
+        etag = get_response(self.app, '/favicon.ico').etag
+        resp = get_response(self.app, '/favicon.ico', if_none_match=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_range_not_cached(self):
+        resp = get_response(self.app, '/favicon.ico', range=(0, 2))
+        self.assertEqual(resp.body, b'ic')
+        self.assertEqual(len(self.cache), 0)
+        get_response(self.app, '/favicon.ico')
+        resp = get_response(self.app, '/favicon.ico', range=(0, 2))
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_not_cached(self):
+        create_file(b'x' * 100, self.test_dir, 'big.js')
+        # just modified: the etag is weak
+        create_file(b'new', self.test_dir, 'new.txt')
+        opened = []
+        def open_(*args):
+            opened.append(args[0])
+            return open(*args)
+        class App(static.DirectoryApp):
+            def make_fileapp(self, path):
+                app = static.DirectoryApp.make_fileapp(self, path)
+                app._open = open_
+                return app
+        app = App(self.test_dir, file_cache=self.cache)
+        self.cache.max_entry_size = 10
+        self.assertEqual(get_response(app, '/big.js').body, b'x' * 100)
+        resp = get_response(app, '/new.txt')
+        self.assertEqual(resp.body, b'new')
+        # each file was opened (and read) once, to be served
+        self.assertEqual([os.path.basename(p) for p in opened],
+                         ['big.js', 'new.txt'])
+        resp = get_response(app, '/new.txt',
+                            if_none_match=resp.headers['ETag'])
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(get_response(app, '/missing').status_code, 404)
+        self.assertEqual(get_response(app, '/favicon.ico',
+                                      method='POST').status_code, 405)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_big_file_uses_file_wrapper(self):
+        path = create_file(b'x' * 100, self.test_dir, 'big.js')
+        os.utime(path, (1000000000, 1000000000))
+        self.cache.max_entry_size = 10
+        class Wrapper(object):
+            def __init__(self, file, block_size):
+                self.file = file
+            def __iter__(self):
+                return iter([self.file.read()])
+            def close(self):
+                self.file.close()
+        environ = environ_from_url('/big.js')
+        environ['wsgi.file_wrapper'] = Wrapper
+        resp = Request(environ).get_response(self.app)
+        self.assertTrue(isinstance(resp.app_iter, Wrapper))
+        self.assertEqual(resp.body, b'x' * 100)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_recently_modified_not_cached(self):
+        create_file(b'new', self.test_dir, 'new.txt')
+        app = static.DirectoryApp(self.test_dir, file_cache=self.cache,
+                                  etag_source=None)
+        self.assertEqual(get_response(app, '/new.txt').body, b'new')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_load_not_cacheable(self):
+        missing = os.path.join(self.test_dir, 'missing')
+        resp = self.cache.load('k', static.FileApp(missing), [missing])
+        self.assertEqual(resp.status_code, 404)
+        resp = self.cache.load('k', static.FileApp(self.path),
+                               [self.path, missing])
+        self.assertEqual(resp.body, b'icon')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_load_replaces(self):
+        app = static.FileApp(self.path)
+        self.cache.load('k', app, [self.path])
+        create_file(b'ICON!', self.path)
+        os.utime(self.path, (1000000001, 1000000001))
+        self.assertEqual(
+            self.cache.load('k', app, [self.path]).body, b'ICON!')
+        self.assertEqual((len(self.cache), self.cache.size), (1, 5))
+
+    def test_changed_file_served(self):
+        self.cache.ttl = 0
+        self.assertEqual(get_response(self.app, '/favicon.ico').body,
+                         b'icon')
+        create_file(b'ICON!', self.path)
+        os.utime(self.path, (1000000001, 1000000001))
+        self.assertEqual(get_response(self.app, '/favicon.ico').body,
+                         b'ICON!')
+        self.assertEqual(get_response(self.app, '/favicon.ico').body,
+                         b'ICON!')
+        self.assertEqual((len(self.cache), self.cache.size), (1, 5))
+
+    def test_revalidate(self):
+        self.cache.ttl = 0
+        get_response(self.app, '/favicon.ico')
+        self.assertEqual(get_response(self.app, '/favicon.ico').body,
+                         b'icon')
+        self.assertEqual((self.cache.hits, self.cache.revalidations), (1, 1))
+        create_file(b'ICON', self.path)
+        os.utime(self.path, (1000000001, 1000000001))
+        self.assertEqual(get_response(self.app, '/favicon.ico').body,
+                         b'ICON')
+        self.assertEqual(self.cache.revalidations, 2)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.size, 4)
+        os.remove(self.path)
+        self.assertEqual(get_response(self.app, '/favicon.ico').status_code,
+                         404)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_eviction(self):
+        create_file(b'12345', self.test_dir, 'a.txt')
+        create_file(b'67890', self.test_dir, 'b.txt')
+        for name in ('a.txt', 'b.txt'):
+            os.utime(os.path.join(self.test_dir, name),
+                     (1000000000, 1000000000))
+        self.cache.max_size = 10
+        for name in ('favicon.ico', 'a.txt', 'b.txt'):
+            get_response(self.app, '/' + name)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.size, 10)
+        self.cache.clear()
+        self.assertEqual((len(self.cache), self.cache.size), (0, 0))
+
+    def test_precompressed(self):
+        body = b'var x = 1;\n' * 100
+        path = create_file(body, self.test_dir, 'app.js')
+        os.utime(path, (1000000000, 1000000000))
+        static.precompress(self.test_dir)
+        app = static.DirectoryApp(self.test_dir, precompressed=True,
+                                  file_cache=self.cache)
+        get_response(app, '/app.js', accept_encoding='gzip')
+        get_response(app, '/app.js')
+        resp = get_response(app, '/app.js', accept_encoding='gzip')
+        self.assertEqual(resp.content_encoding, 'gzip')
+        resp = get_response(app, '/app.js')
+        self.assertEqual(resp.body, body)
+        self.assertEqual((len(self.cache), self.cache.hits), (2, 2))
+        # the same codings in the same order share the entry
+        for accept_encoding in ('gzip;q=0.5', 'GZIP', 'identity, gzip'):
+            resp = get_response(app, '/app.js',
+                                accept_encoding=accept_encoding)
+            self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual((len(self.cache), self.cache.hits), (2, 5))
+        # the original is checked too
+        self.cache.ttl = 0
+        os.utime(path, (1000000001, 1000000001))
+        resp = get_response(app, '/app.js', accept_encoding='gzip')
+        self.assertEqual(resp.content_encoding, None)
+
+    def test_repr(self):
+        get_response(self.app, '/favicon.ico')
+        self.assertEqual(repr(self.cache),
+                         '<FileCache 1 entries, 4 bytes, 0 hits, 1 misses>')
+
+
+class TestStatCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_stat(self):
+        path = create_file('abc', self.test_dir, 'a')
+        cache = static.StatCache()
+        self.assertEqual(cache.stat(path).st_size, 3)
+        self.assertEqual(cache.stat(path).st_size, 3)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(len(cache), 1)
+        self.assertTrue(cache.isfile(path))
+        self.assertFalse(cache.isdir(path))
+        self.assertTrue(cache.isdir(self.test_dir))
+        self.assertFalse(cache.isfile(self.test_dir))
+        self.assertEqual(
+            repr(cache), '<StatCache 2 entries, 0 open files, 4 hits, '
+            '2 misses>')
+
+    def test_missing(self):
+        path = os.path.join(self.test_dir, 'missing')
+        cache = static.StatCache()
+        for i in range(2):
+            with self.assertRaises(OSError):
+                cache.stat(path)
+        self.assertFalse(cache.isfile(path))
+        self.assertFalse(cache.isdir(path))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+        cache.ttl = 0
+        create_file('abc', self.test_dir, 'missing')
+        self.assertTrue(cache.isfile(path))
+
+    def test_ttl(self):
+        path = create_file('abc', self.test_dir, 'a')
+        cache = static.StatCache(ttl=None)
+        cache.stat(path)
+        create_file('abcdef', self.test_dir, 'a')
+        self.assertEqual(cache.stat(path).st_size, 3)
+        cache = static.StatCache(ttl=0)
+        cache.stat(path)
+        create_file('abcdefgh', self.test_dir, 'a')
+        self.assertEqual(cache.stat(path).st_size, 8)
+        self.assertEqual(cache.revalidations, 1)
+
+    def test_eviction(self):
+        paths = [create_file('x', self.test_dir, name) for name in 'abc']
+        cache = static.StatCache(max_entries=2)
+        cache.stat(paths[0])
+        cache.stat(paths[1])
+        cache.stat(paths[0])
+        cache.stat(paths[2])
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(len(cache), 2)
+        cache.stat(paths[0])
+        self.assertEqual(cache.misses, 3)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_open(self):
+        path = create_file('abc', self.test_dir, 'a')
+        cache = static.StatCache()
+        with cache.open(path) as f:
+            self.assertEqual(f.read(), bytes_('abc'))
+        opened = []
+        def opener(*args):
+            opened.append(args)
+            return BytesIO(bytes_('x'))
+        self.assertEqual(cache.open(path, opener).read(), bytes_('x'))
+        self.assertEqual(opened, [(path, 'rb')])
+
+    @unittest.skipUnless(hasattr(os, 'pread'), 'no os.pread')
+    def test_open_files(self):
+        path = create_file('0123456789', self.test_dir, 'a')
+        cache = static.StatCache(open_files=1)
+        f1 = cache.open(path)
+        f2 = cache.open(path)
+        self.assertEqual(f1.fileno(), f2.fileno())
+        self.assertEqual(cache.open_files_count, 1)
+        self.assertEqual(f1.read(3), bytes_('012'))
+        f2.seek(5)
+        self.assertEqual(f2.read(), bytes_('56789'))
+        self.assertEqual(f1.read(2), bytes_('34'))
+        self.assertEqual(f1.tell(), 5)
+        f1.seek(-2, 2)
+        self.assertEqual(f1.read(), bytes_('89'))
+        f1.seek(-3, 1)
+        self.assertEqual(f1.read(1), bytes_('7'))
+        f1.close()
+        f1.close()
+        self.assertTrue(f1.closed)
+        # still open for the pool and f2
+        self.assertEqual(f2.read(), bytes_(''))
+        fd = f2.fileno()
+        # opening another file evicts it, but f2 still has it
+        other = create_file('x', self.test_dir, 'b')
+        cache.open(other).close()
+        os.fstat(fd)
+        f2.close()
+        self.assertRaises(OSError, os.fstat, fd)
+        cache.clear()
+        self.assertEqual(cache.open_files_count, 0)
+
+    def test_digest(self):
+        a = create_file('abc', self.test_dir, 'a')
+        b = create_file('def', self.test_dir, 'b')
+        cache = static.StatCache(max_entries=1)
+        computed = []
+        def compute(value):
+            def compute():
+                computed.append(value)
+                return value
+            return compute
+        self.assertEqual(cache.digest(a, os.stat(a), compute(1)), 1)
+        self.assertEqual(cache.digest(a, os.stat(a), compute(2)), 1)
+        os.utime(a, (1000000000, 1000000000))
+        self.assertEqual(cache.digest(a, os.stat(a), compute(3)), 3)
+        # evicts a
+        self.assertEqual(cache.digest(b, os.stat(b), compute(4)), 4)
+        self.assertEqual(cache.digest(a, os.stat(a), compute(5)), 5)
+        self.assertEqual(computed, [1, 3, 4, 5])
+        cache.clear()
+        self.assertEqual(cache.digest(a, os.stat(a), compute(6)), 6)
+
+    @unittest.skipUnless(hasattr(os, 'pread'), 'no os.pread')
+    def test_open_fstat_fails(self):
+        path = create_file('0123456789', self.test_dir, 'a')
+        cache = static.StatCache(open_files=2)
+        fstat = os.fstat
+        fds = []
+        def failing_fstat(fd):
+            fds.append(fd)
+            raise OSError('fstat failed')
+        os.fstat = failing_fstat
+        try:
+            self.assertRaises(OSError, cache.open, path)
+        finally:
+            os.fstat = fstat
+        # the descriptor was closed, and not kept
+        self.assertRaises(OSError, os.fstat, fds[0])
+        self.assertEqual(cache.open_files_count, 0)
+
+    @unittest.skipUnless(hasattr(os, 'pread'), 'no os.pread')
+    def test_open_race(self):
+        path = create_file('0123456789', self.test_dir, 'a')
+        cache = static.StatCache(open_files=2)
+        fstat = os.fstat
+        opened = []
+        def racing_fstat(fd):
+            # another thread opens the file while this one is in open()
+            os.fstat = fstat
+            opened.append(cache.open(path))
+            return fstat(fd)
+        os.fstat = racing_fstat
+        try:
+            f = cache.open(path)
+        finally:
+            os.fstat = fstat
+        self.assertEqual(cache.open_files_count, 1)
+        self.assertNotEqual(f.fileno(), opened[0].fileno())
+        self.assertEqual(f.read(), bytes_('0123456789'))
+        fd = f.fileno()
+        f.close()
+        # ours wasn't kept
+        self.assertRaises(OSError, os.fstat, fd)
+        opened[0].close()
+        cache.clear()
+
+    @unittest.skipUnless(hasattr(os, 'pread'), 'no os.pread')
+    def test_file_wrapper_gets_own_file(self):
+        path = create_file('0123456789', self.test_dir, 'a')
+        cache = static.StatCache(open_files=2)
+        environ = environ_from_url('/')
+        environ['wsgi.file_wrapper'] = lambda file, block_size: file
+        app = static.FileApp(path, stat_cache=cache)
+        file = Request(environ).get_response(app).app_iter
+        self.assertEqual(cache.open_files_count, 0)
+        self.assertEqual(file.read(), bytes_('0123456789'))
+        file.close()
+
+    @unittest.skipUnless(hasattr(os, 'pread'), 'no os.pread')
+    def test_changed_file_is_reopened(self):
+        path = create_file('abc', self.test_dir, 'a')
+        cache = static.StatCache(ttl=0, open_files=10)
+        cache.stat(path)
+        cache.open(path).close()
+        os.unlink(path)
+        create_file('abcdef', self.test_dir, 'a')
+        self.assertEqual(cache.stat(path).st_size, 6)
+        self.assertEqual(cache.open_files_count, 0)
+        f = cache.open(path)
+        self.assertEqual(f.read(), bytes_('abcdef'))
+        f.close()
+
+    @unittest.skipUnless(hasattr(os, 'pread'), 'no os.pread')
+    def test_fileapp(self):
+        path = create_file('0123456789', self.test_dir, 'a')
+        cache = static.StatCache(open_files=10)
+        app = static.FileApp(path, stat_cache=cache)
+        for i in range(2):
+            self.assertEqual(get_response(app).body, bytes_('0123456789'))
+            resp = get_response(app, range=(2, 5))
+            self.assertEqual(resp.body, bytes_('234'))
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.open_files_count, 1)
+        missing = static.FileApp(path + 'x', stat_cache=cache)
+        self.assertEqual(get_response(missing).status_code, 404)
+
+    def test_fileapp_forbidden(self):
+        path = create_file('abc', self.test_dir, 'a')
+        app = static.FileApp(path, stat_cache=static.StatCache())
+        def open_ioerror(*args, **kwargs):
+            raise IOError()
+        app._open = open_ioerror
+        self.assertEqual(403, get_response(app).status_code)
+
+    def test_directoryapp(self):
+        create_file('abcde', self.test_dir, 'bar')
+        os.mkdir(os.path.join(self.test_dir, 'sub'))
+        create_file('index', self.test_dir, 'sub', 'index.html')
+        cache = static.StatCache()
+        app = static.DirectoryApp(self.test_dir, stat_cache=cache)
+        for i in range(2):
+            self.assertEqual(get_response(app, '/bar').body, bytes_('abcde'))
+            self.assertEqual(get_response(app, '/sub/').body,
+                             bytes_('index'))
+            self.assertEqual(get_response(app, '/sub').status_code, 301)
+            self.assertEqual(get_response(app, '/foo').status_code, 404)
+        self.assertEqual(cache.misses, 4)